@@ -1,8 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import json
+from datetime import datetime
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Header, Request, WebSocket, WebSocketDisconnect
+from starlette.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from app.core.database import get_db
-from app.schemas.alarm_schema import AlarmOut, AlarmCreate, AlarmUpdate
+from app.core.security import get_current_user
+from app.schemas.alarm_schema import (
+    AlarmOut, AlarmCreate, AlarmUpdate, AlarmFilter, AlarmPage, AlarmAnalytics, AlarmBulkStatus, AlarmBulkResult,
+)
 from app.services.alarm_service import AlarmService
+from app.services.alarm_events import alarm_events, RESET
+from app.services.alarm_archive import alarm_archiver
+from app.services.alarm_export import alarm_exporter
+from app.services.alarm_rollup import alarm_rollups
 from app.services.video_service import VideoService
 
 router = APIRouter(prefix="/alarms", tags=["Alarm Records"])
@@ -10,8 +21,137 @@ service = AlarmService()
 video_service = VideoService()
 
 @router.get("/", response_model=list[AlarmOut])
-def get_alarms(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return service.get_alarms(db, skip, limit)
+def get_alarms(skip: int = 0, limit: int = 100, filters: AlarmFilter = Depends(), db: Session = Depends(get_db)):
+    return service.get_alarms(db, skip, limit, filters)
+
+@router.get("/page", response_model=AlarmPage)
+def get_alarm_page(
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    filters: AlarmFilter = Depends(),
+    db: Session = Depends(get_db),
+):
+    # 游标分页: 深翻页与第一页开销相同, 用返回的 next_cursor 取下一页
+    items, next_cursor = service.get_alarm_page(db, filters, cursor, limit)
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.get("/archive", response_model=AlarmPage)
+def get_archived_alarms(
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    filters: AlarmFilter = Depends(),
+    db: Session = Depends(get_db),
+):
+    # 历史归档报警查询 (已处理且超过保留期的报警), 参数与 /alarms/page 相同
+    items, next_cursor = alarm_archiver.get_page(db, filters, cursor, limit)
+    return {"items": items, "next_cursor": next_cursor}
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+@router.get("/export")
+def export_alarms(
+    format: Literal["csv", "xlsx"] = "csv",
+    filters: AlarmFilter = Depends(),
+    user: dict = Depends(get_current_user),
+):
+    # 报警导出 (月度安全报表): 服务端游标分块读取并边读边写, 内存占用与行数无关; 筛选参数同 /alarms/;
+    # 分部账号只导出本部门设备的报警
+    if not alarm_exporter.available(format):
+        raise HTTPException(status_code=400, detail="XLSX export needs openpyxl installed")
+    branch_only = user.get("role") == "BRANCH"
+    chunks = alarm_exporter.xlsx_chunks if format == "xlsx" else alarm_exporter.csv_chunks
+    filename = f"alarms_{datetime.now():%Y%m%d_%H%M%S}.{format}"
+    return StreamingResponse(
+        chunks(filters, user.get("department_id"), branch_only),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.get("/analytics", response_model=AlarmAnalytics)
+def alarm_analytics(
+    start: datetime,
+    end: datetime,
+    interval: Literal["hour", "day", "month"] = "day",
+    group_by: Literal["alarm_type", "severity", "device_id", "fence_id"] | None = None,
+    alarm_type: str | None = None,
+    severity: str | None = None,
+    device_id: str | None = None,
+    fence_id: int | None = None,
+    user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # 报警趋势统计: 读取按小时预聚合的 alarm_rollups, 不扫描原始报警表; 分部账号只看本部门设备
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    department_id = user.get("department_id") if user.get("role") == "BRANCH" else None
+    if user.get("role") == "BRANCH" and department_id is None:
+        return {"interval": interval, "group_by": group_by, "series": []}
+    filters = {"alarm_type": alarm_type, "severity": severity, "device_id": device_id, "fence_id": fence_id}
+    series = alarm_rollups.series(db, start, end, interval, group_by, department_id, filters)
+    return {"interval": interval, "group_by": group_by, "series": series}
+
+def _event_id(value: str | None):
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return -1  # Unknown id: the stream starts with a reset
+
+@router.get("/stream")
+async def stream_alarms(
+    request: Request,
+    last_event_id: int | None = None,
+    last_event_header: str | None = Header(default=None, alias="Last-Event-ID"),
+    user: dict = Depends(get_current_user),
+):
+    # SSE 实时推送新报警, 代替轮询 /alarms/; 重连时带上 Last-Event-ID (或 ?last_event_id=) 续传,
+    # 收到 reset 事件说明中间有报警已无法补发, 需重新加载列表
+    if last_event_id is None:
+        last_event_id = _event_id(last_event_header)
+    sub = alarm_events.subscribe(user, last_event_id)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                event = await sub.next()
+                if event is None:
+                    yield ": keep-alive\n\n"
+                elif event is RESET:
+                    yield "event: reset\ndata: {}\n\n"
+                else:
+                    data = json.dumps(event["alarm"], ensure_ascii=False)
+                    yield f"id: {event['id']}\nevent: alarm\ndata: {data}\n\n"
+        finally:
+            alarm_events.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/ws")
+async def alarm_socket(websocket: WebSocket, last_event_id: int | None = None, user: dict = Depends(get_current_user)):
+    # WebSocket 版本的报警推送, 消息格式: {"event": "alarm", "id", "alarm"} / {"event": "reset"} / {"event": "ping"}
+    await websocket.accept()
+    sub = alarm_events.subscribe(user, last_event_id)
+    try:
+        while True:
+            event = await sub.next()
+            if event is None:
+                await websocket.send_json({"event": "ping"})
+            elif event is RESET:
+                await websocket.send_json(RESET)
+            else:
+                await websocket.send_json({"event": "alarm", "id": event["id"], "alarm": event["alarm"]})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        alarm_events.unsubscribe(sub)
 
 # @router.post("/", response_model=AlarmOut)
 @router.post("/", response_model=AlarmOut)
@@ -26,6 +166,19 @@ def create_alarm(alarm: AlarmCreate, background_tasks: BackgroundTasks, db: Sess
         
     return new_alarm
 
+# 需注册在 /{alarm_id} 之前, 否则 "bulk" 会被当作报警ID
+@router.put("/bulk", response_model=AlarmBulkResult)
+def bulk_update_alarms(body: AlarmBulkStatus, db: Session = Depends(get_db)):
+    # 批量处理报警: 一条 UPDATE 完成, 代替逐条 PUT /alarms/{id}
+    if (body.ids is None) == (body.filters is None):
+        raise HTTPException(status_code=400, detail="Pass either ids or filters")
+    if body.ids is not None and not body.ids:
+        return {"updated": 0}
+    if body.filters is not None and not body.filters.model_dump(exclude_none=True):
+        raise HTTPException(status_code=400, detail="filters must set at least one field")
+    updated = service.bulk_update_status(db, body.status, ids=body.ids, filters=body.filters)
+    return {"updated": updated}
+
 @router.put("/{alarm_id}", response_model=AlarmOut)
 def update_alarm(alarm_id: int, alarm: AlarmUpdate, db: Session = Depends(get_db)):
     updated = service.update_alarm(db, alarm_id, alarm)
@@ -4,6 +4,7 @@ from sqlalchemy import text
 
 from app.core.database import get_db
 from app.core.security import get_current_user  # ✅ 新增：按你项目实际路径调整
+from app.services.dashboard_counters import dashboard_counters
 
 router = APIRouter(prefix="/api/dashboard", tags=["Dashboard"])
 
@@ -16,30 +17,8 @@ def dashboard_summary(db: Session = Depends(get_db)):
     - alarmCount: 今日报警数量（使用 alarm_records.timestamp）
     - deviceCount: 设备数量
     """
-    # 设备数量
-    device_count = db.execute(
-        text("SELECT COUNT(*) FROM devices")
-    ).scalar() or 0
-
-    # 今日报警数量（你的表字段名就是 timestamp）
-    alarm_count = db.execute(
-        text("""
-            SELECT COUNT(*)
-            FROM alarm_records
-            WHERE DATE(`timestamp`) = CURDATE()
-        """)
-    ).scalar() or 0
-
-    # 围栏数量
-    fence_count = db.execute(
-        text("SELECT COUNT(*) FROM electronic_fences")
-    ).scalar() or 0
-
-    return {
-        "fenceCount": int(fence_count),
-        "alarmCount": int(alarm_count),
-        "deviceCount": int(device_count),
-    }
+    # 内存计数器, 由增删操作实时维护并定期与数据库对账, 不再每次轮询都 COUNT(*) 全表
+    return dashboard_counters.summary(db)
 
 
 @router.get("/branches")
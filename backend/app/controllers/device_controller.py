@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.models.device import Device
-from app.schemas.device_schema import DeviceOut, DeviceCreate, DeviceUpdate
+from app.schemas.device_schema import DeviceOut, DeviceCreate, DeviceUpdate, TrackPoint
+from app.services.alarm_service import alarm_refs
+from app.services.dashboard_counters import dashboard_counters
+from app.services.position_history import position_history
 
 router = APIRouter(prefix="/devices", tags=["Devices"])
 
@@ -16,13 +20,13 @@ def create_device(device_in: DeviceCreate, db: Session = Depends(get_db)):
     db.add(db_device)
     db.commit()
     db.refresh(db_device)
+    dashboard_counters.device_added()
     return db_device
 
 @router.put("/{device_id}", response_model=DeviceOut)
 def update_device(device_id: str, device_in: DeviceUpdate, db: Session = Depends(get_db)):
     db_device = db.query(Device).filter(Device.id == device_id).first()
     if not db_device:
-        from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Device not found")
     
     update_data = device_in.model_dump(exclude_unset=True)
@@ -37,9 +41,17 @@ def update_device(device_id: str, device_in: DeviceUpdate, db: Session = Depends
 def delete_device(device_id: str, db: Session = Depends(get_db)):
     db_device = db.query(Device).filter(Device.id == device_id).first()
     if not db_device:
-        from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Device not found")
     
     db.delete(db_device)
     db.commit()
+    alarm_refs.discard_device(device_id)
+    dashboard_counters.device_removed()
     return {"status": "success"}
+
+@router.get("/{device_id}/track", response_model=list[TrackPoint])
+def get_device_track(device_id: str, start: datetime, end: datetime, db: Session = Depends(get_db)):
+    # 轨迹回放: 指定时间段内的历史定位点 (按时间升序)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    return position_history.get_track(db, device_id, start, end)
@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from app.core.database import get_db
 from app.schemas.fence_schema import (
     FenceCreate, FenceOut, FenceUpdate,
-    ProjectRegionCreate, ProjectRegionOut, ProjectRegionUpdate
+    ProjectRegionCreate, ProjectRegionOut, ProjectRegionUpdate,
+    LocationPing, LocationBatch, LocationBatchResult,
+    FenceBacktestRequest, FenceBacktestResult, NearestFenceOut
 )
 from app.services.fence_service import FenceService
+from app.services.ingest_service import location_ingest
+from app.services.fence_shards import fence_shards
+from app.services.fence_backtest import fence_backtester
+from app.models.fence import ElectronicFence
 
 router = APIRouter(prefix="/fence", tags=["Electronic Fence"])
 service = FenceService()
@@ -48,6 +54,24 @@ def create_fence(fence: FenceCreate, db: Session = Depends(get_db)):
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.get("/nearest", response_model=Optional[NearestFenceOut])
+def nearest_fence(lat: float, lng: float, radius: float = Query(500, gt=0), db: Session = Depends(get_db)):
+    # Closest fence boundary within radius meters, null when none is that close
+    return service.nearest_fence(db, lat, lng, radius)
+
+@router.post("/backtest", response_model=FenceBacktestResult)
+def backtest_fence(request: FenceBacktestRequest, db: Session = Depends(get_db)):
+    # Replays stored tracks through a saved fence or a draft, without creating alarms
+    if request.fence_id is not None:
+        fence = db.query(ElectronicFence).filter(ElectronicFence.id == request.fence_id).first()
+        if not fence:
+            raise HTTPException(status_code=404, detail="Fence not found")
+    elif request.fence is not None:
+        fence = fence_backtester.draft_fence(request.fence)
+    else:
+        raise HTTPException(status_code=400, detail="Either fence_id or fence is required")
+    return fence_backtester.run(db, fence, request.start, request.end, request.device_ids)
+
 @router.put("/{fence_id}", response_model=FenceOut)
 def update_fence(fence_id: int, fence: FenceUpdate, db: Session = Depends(get_db)):
     updated_fence = service.update_fence(db, fence_id, fence)
@@ -67,3 +91,25 @@ def check_fence_violation(device_id: str, lat: float, lng: float, db: Session =
     # This endpoint receives GPS updates from the helmet
     service.check_fence_status(db, device_id, lat, lng)
     return {"status": "checked"}
+
+@router.post("/check-status/batch", response_model=LocationBatchResult)
+def check_fence_violation_batch(batch: LocationBatch, db: Session = Depends(get_db)):
+    # Gateways buffer helmet positions and upload them in one request
+    results = service.check_fence_status_batch(db, batch.records)
+    return {
+        "total": len(results),
+        "checked": sum(1 for r in results if r["status"] == "checked"),
+        "alarms": sum(len(r["alarms"]) for r in results),
+        "results": results,
+    }
+
+@router.post("/ingest", status_code=202)
+async def ingest_location(ping: LocationPing):
+    # Returns as soon as the ping is queued; fence evaluation runs on the ingest consumers
+    if not location_ingest.submit(ping):
+        raise HTTPException(status_code=503, detail="Location queue is full", headers={"Retry-After": "1"})
+    return {"status": "accepted", "queue_depth": location_ingest.depth()}
+
+@router.get("/ingest/stats")
+async def ingest_stats():
+    return {**location_ingest.stats(), "fence_shards": fence_shards.stats()}
@@ -0,0 +1,72 @@
+import threading
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Index, inspect
+from app.core.database import engine
+
+# Kept out of Base.metadata so create_all() at startup never touches them
+monthly_metadata = MetaData()
+
+
+def month_key(dt: datetime) -> str:
+    """'YYYYMM' suffix of the table holding rows for dt."""
+    return dt.strftime("%Y%m")
+
+
+def months_between(start: datetime, end: datetime) -> list[str]:
+    """Every 'YYYYMM' from start's month to end's month, inclusive."""
+    keys = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        keys.append(f"{year:04d}{month:02d}")
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return keys
+
+
+class MonthlyTables:
+    """
+    One physical table per calendar month, e.g. device_positions_202610.
+    Old months can be dropped or archived as a whole and range queries only
+    touch the months they cover. Tables are created on first write.
+    columns_factory: returns fresh Column objects (a Column can belong to one table only)
+    indexes: tuples of column names to index in every month
+    """
+
+    def __init__(self, prefix: str, columns_factory, indexes=()):
+        self.prefix = prefix
+        self.columns_factory = columns_factory
+        self.indexes = indexes
+        self._created = set()
+        self._lock = threading.Lock()
+
+    def table(self, key: str) -> Table:
+        name = f"{self.prefix}_{key}"
+        table = monthly_metadata.tables.get(name)
+        if table is None:
+            with self._lock:
+                table = monthly_metadata.tables.get(name)
+                if table is None:
+                    table = Table(name, monthly_metadata, *self.columns_factory())
+                    for cols in self.indexes:
+                        Index(f"ix_{name}_{'_'.join(cols)}", *(table.c[c] for c in cols))
+        return table
+
+    def table_for_write(self, key: str) -> Table:
+        """Month table, created in the DB if it does not exist yet."""
+        table = self.table(key)
+        if key not in self._created:
+            table.create(bind=engine, checkfirst=True)
+            self._created.add(key)
+        return table
+
+    def existing_keys(self) -> list[str]:
+        """'YYYYMM' of every month table that exists in the DB, oldest first."""
+        prefix = f"{self.prefix}_"
+        names = inspect(engine).get_table_names()
+        return sorted(n[len(prefix):] for n in names if n.startswith(prefix) and n[len(prefix):].isdigit())
+
+    def existing_tables(self, keys) -> list[Table]:
+        """Month tables among keys that exist in the DB, for reads."""
+        names = set(inspect(engine).get_table_names())
+        return [self.table(k) for k in keys if f"{self.prefix}_{k}" in names]
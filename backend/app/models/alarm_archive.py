@@ -0,0 +1,31 @@
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime
+from app.core.monthly_tables import MonthlyTables
+
+
+def _archive_columns():
+    return [
+        Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=False, comment="原报警ID"),
+        Column("device_id", String(50), comment="设备ID"),
+        Column("fence_id", Integer, nullable=True, comment="围栏ID"),
+        Column("department_id", Integer, nullable=True, comment="报警时设备所属部门ID"),
+        Column("alarm_type", String(50), comment="报警类型"),
+        Column("severity", String(20), comment="报警级别"),
+        Column("timestamp", DateTime, nullable=False, comment="报警时间"),
+        Column("description", String(255), comment="报警描述"),
+        Column("status", String(20), comment="处理状态"),
+        Column("handled_at", DateTime, nullable=True, comment="处理时间"),
+        Column("location", String(100), nullable=True, comment="报警位置"),
+        Column("recording_path", String(255), nullable=True, comment="录像/截图路径"),
+        Column("recording_status", String(20), nullable=True, comment="录像状态"),
+        Column("recording_error", String(255), nullable=True, comment="录像失败原因"),
+        Column("occurrences", Integer, nullable=False, default=1, comment="聚合次数"),
+        Column("last_seen", DateTime, nullable=True, comment="最近一次发生时间"),
+        Column("archived_at", DateTime, nullable=False, comment="归档时间"),
+    ]
+
+
+# 已处理的历史报警, 按报警时间分月归档: alarm_archive_YYYYMM
+alarm_archive = MonthlyTables(
+    "alarm_archive", _archive_columns,
+    indexes=[("timestamp", "id"), ("device_id", "timestamp"), ("fence_id", "timestamp")],
+)
@@ -1,10 +1,20 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 from datetime import datetime
 
 class AlarmRecord(Base):
     __tablename__ = "alarm_records"
+    # Newest-first listing, alone or behind one equality filter, walks a single
+    # index range ending in (timestamp, id): the keyset cursor position
+    __table_args__ = (
+        Index("ix_alarm_records_ts_id", "timestamp", "id"),
+        Index("ix_alarm_records_status_ts_id", "status", "timestamp", "id"),
+        Index("ix_alarm_records_type_ts_id", "alarm_type", "timestamp", "id"),
+        Index("ix_alarm_records_severity_ts_id", "severity", "timestamp", "id"),
+        Index("ix_alarm_records_device_ts_id", "device_id", "timestamp", "id"),
+        Index("ix_alarm_records_fence_ts_id", "fence_id", "timestamp", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     alarm_type = Column(String(50)) # e.g., "FENCE_ENTRY", "SOS", "HELMET_OFF"
@@ -18,9 +28,19 @@ class AlarmRecord(Base):
     recording_path = Column(String(255), nullable=True) 
     recording_status = Column(String(20), default="pending")
     recording_error = Column(String(255), nullable=True)
+
+    # 报警风暴聚合: 窗口内被合并到本条报警的次数 (含自身) 与最近一次发生时间
+    occurrences = Column(Integer, nullable=False, default=1, server_default="1")
+    last_seen = Column(DateTime, nullable=True)
     
     # Relationships
     device_id = Column(String(50), index=True)
     # device = relationship("Device", back_populates="alarms")
     
     fence_id = Column(Integer, ForeignKey("electronic_fences.id"), nullable=True)
+    # 报警时设备所属部门: 趋势统计按此记账, 设备之后换部门也不影响历史报警
+    department_id = Column(Integer, nullable=True)
+
+    # "device_id:fence_id" while a fence alarm is pending, NULL otherwise.
+    # The unique index allows only one pending alarm per (device, fence).
+    pending_key = Column(String(100), unique=True, nullable=True)
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint
+from app.core.database import Base
+
+
+class AlarmRollup(Base):
+    """Hourly alarm counts per (department, device, fence, type, severity), for trend charts."""
+    __tablename__ = "alarm_rollups"
+    __table_args__ = (
+        UniqueConstraint(
+            "bucket", "department_id", "device_id", "fence_id", "alarm_type", "severity",
+            name="uq_alarm_rollups_key",
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    bucket = Column(DateTime, nullable=False, index=True, comment="统计小时 (报警时间取整到小时)")
+    department_id = Column(Integer, nullable=False, default=0, comment="设备所属部门ID, 0 表示未知")
+    device_id = Column(String(50), nullable=False, comment="设备ID")
+    fence_id = Column(Integer, nullable=False, default=0, comment="围栏ID, 0 表示非围栏报警")
+    alarm_type = Column(String(50), nullable=False, default="", comment="报警类型")
+    severity = Column(String(20), nullable=False, default="", comment="报警级别")
+    alarm_count = Column(Integer, nullable=False, default=0, comment="报警数")
+    resolved_count = Column(Integer, nullable=False, default=0, comment="其中已处理数")
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, BigInteger, Integer, String, Float, DateTime
+from app.core.monthly_tables import MonthlyTables
+
+
+def _position_columns():
+    return [
+        Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+        Column("device_id", String(50), nullable=False, comment="设备ID"),
+        Column("latitude", Float, nullable=False, comment="纬度 (GCJ-02)"),
+        Column("longitude", Float, nullable=False, comment="经度 (GCJ-02)"),
+        Column("ts", DateTime, nullable=False, comment="定位时间"),
+    ]
+
+
+# 设备轨迹历史, 按月分表: device_positions_YYYYMM
+device_positions = MonthlyTables("device_positions", _position_columns, indexes=[("device_id", "ts"), ("ts",)])
@@ -36,6 +36,11 @@ class ElectronicFence(Base):
     coordinates_json = Column(Text, comment="坐标JSON: 多边形为点数组, 圆形为圆心坐标")
     radius = Column(Float, nullable=True, comment="半径(米), 仅圆形围栏有效")
 
+    # GPS jitter debouncing at the fence edge
+    edge_buffer = Column(Float, default=0, comment="边界缓冲距离(米), 越过边界超过该距离才切换进出状态")
+    dwell_seconds = Column(Integer, default=0, comment="状态切换需持续的最短时间(秒)")
+    warning_distance = Column(Float, default=0, comment="接近预警距离(米), 0为不预警, 仅禁入围栏有效")
+
     effective_time = Column(String(50), comment="生效时间,格式如5.00-23.00")
     worker_count = Column(Integer, default=0, comment="违规人数 (禁入时为区内人数，禁出时为区外人数)")
     remark = Column(String(255), comment="围栏备注")
@@ -18,6 +18,23 @@ class AlarmUpdate(BaseModel):
     description: str | None = None
     severity: str | None = None
 
+class AlarmFilter(BaseModel):
+    status: str | None = None
+    alarm_type: str | None = None
+    severity: str | None = None
+    device_id: str | None = None
+    fence_id: int | None = None
+    start: datetime | None = None  # timestamp >= start
+    end: datetime | None = None  # timestamp <= end
+
+class AlarmBulkStatus(BaseModel):
+    status: str  # 目标状态, 如 resolved
+    ids: list[int] | None = None  # 按报警ID批量处理
+    filters: AlarmFilter | None = None  # 或按筛选条件批量处理 (字段同 /alarms/page), 与 ids 二选一
+
+class AlarmBulkResult(BaseModel):
+    updated: int  # 实际变更状态的报警数 (已是目标状态的不计)
+
 class AlarmOut(AlarmCreate):
     id: int
     timestamp: datetime
@@ -25,6 +42,28 @@ class AlarmOut(AlarmCreate):
     recording_path: Optional[str] = None
     recording_status: str = "pending"
     recording_error: Optional[str] = None
+    occurrences: int = 1  # 聚合次数, 报警风暴时同一事件的重复报警计入父报警
+    last_seen: datetime | None = None  # 最近一次发生时间; 未聚合过为 None
     
     class Config:
         from_attributes=True
+
+class AlarmPage(BaseModel):
+    items: list[AlarmOut]
+    # Pass back as ?cursor= for the next (older) page; None on the last page
+    next_cursor: str | None = None
+
+class AlarmTrendPoint(BaseModel):
+    bucket: datetime  # 时间桶起点 (小时 / 日 / 月)
+    count: int
+    resolved: int
+
+class AlarmTrendSeries(BaseModel):
+    # group_by 对应的取值; 不分组时为 None, 按围栏分组时非围栏报警也为 None
+    group: str | int | None = None
+    points: list[AlarmTrendPoint]
+
+class AlarmAnalytics(BaseModel):
+    interval: str
+    group_by: str | None = None
+    series: list[AlarmTrendSeries]
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from datetime import datetime
 
 class DeviceBase(BaseModel):
     id: str
@@ -30,3 +31,8 @@ class DeviceOut(DeviceBase):
     
     class Config:
         from_attributes=True
+
+class TrackPoint(BaseModel):
+    lat: float
+    lng: float
+    ts: datetime
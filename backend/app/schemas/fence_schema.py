@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List
+from datetime import datetime
 from enum import Enum
 import json
 
@@ -49,6 +50,9 @@ class FenceBase(BaseModel):
     
     coordinates_json: str = Field(..., description="坐标数据。多边形: '[[lat,lng],...]', 圆形: '[lat,lng]'")
     radius: Optional[float] = Field(None, description="半径(米)，当 shape=circle 时必填")
+    edge_buffer: Optional[float] = Field(0, ge=0, description="边界缓冲距离(米), 用于抑制GPS漂移")
+    dwell_seconds: Optional[int] = Field(0, ge=0, description="进出状态切换需持续的最短时间(秒)")
+    warning_distance: Optional[float] = Field(0, ge=0, description="接近预警距离(米), 0为不预警, 仅禁入围栏有效")
     
     effective_time: str = Field(..., description="生效时间 (如 5.00-23.00)", example="5.00-23.00")
     remark: Optional[str] = Field(None, description="围栏备注")
@@ -76,6 +80,9 @@ class FenceUpdate(BaseModel):
     behavior: Optional[str] = None
     coordinates_json: Optional[str] = None
     radius: Optional[float] = None
+    edge_buffer: Optional[float] = Field(None, ge=0)
+    dwell_seconds: Optional[int] = Field(None, ge=0)
+    warning_distance: Optional[float] = Field(None, ge=0)
     effective_time: Optional[str] = None
     remark: Optional[str] = None
     alarm_type: Optional[AlarmLevel] = None
@@ -88,3 +95,64 @@ class FenceOut(FenceBase):
 
     class Config:
         from_attributes = True
+
+# --- Location Ping Schemas ---
+class LocationPing(BaseModel):
+    device_id: str = Field(..., description="设备ID")
+    lat: float = Field(..., ge=-90, le=90, description="纬度 (GCJ-02)")
+    lng: float = Field(..., ge=-180, le=180, description="经度 (GCJ-02)")
+    ts: Optional[datetime] = Field(None, description="定位时间, 为空时按接收顺序处理")
+
+class LocationBatch(BaseModel):
+    records: List[LocationPing] = Field(..., description="网关缓存的定位记录")
+
+class LocationPingResult(BaseModel):
+    device_id: str
+    status: str = Field(..., description="checked 或 device_not_found")
+    violations: List[int] = Field(default_factory=list, description="当前违规的围栏ID")
+    alarms: List[int] = Field(default_factory=list, description="本次新产生报警的围栏ID")
+    warnings: List[int] = Field(default_factory=list, description="本次新产生接近预警的围栏ID")
+
+class NearestFenceOut(BaseModel):
+    fence_id: int
+    name: str
+    behavior: str
+    distance: float = Field(..., description="到围栏边界的距离(米)")
+    inside: bool = Field(..., description="是否在围栏内")
+
+class LocationBatchResult(BaseModel):
+    total: int
+    checked: int
+    alarms: int
+    results: List[LocationPingResult]
+
+# --- Backtest Schemas ---
+class FenceBacktestRequest(BaseModel):
+    fence_id: Optional[int] = Field(None, description="回测已保存的围栏ID")
+    fence: Optional[FenceCreate] = Field(None, description="回测未保存的围栏草稿 (与 fence_id 二选一)")
+    start: datetime = Field(..., description="回放开始时间")
+    end: datetime = Field(..., description="回放结束时间")
+    device_ids: Optional[List[str]] = Field(None, description="只回放这些设备, 为空时回放全部")
+
+class DeviceBacktestSummary(BaseModel):
+    device_id: str
+    points: int
+    violating_points: int
+    crossings: int = Field(..., description="进入违规状态的次数")
+    alarms: int = Field(..., description="估算该设备会产生的报警数 (同一时段内待处理期间不重复报警)")
+    violation_seconds: float = Field(..., description="违规持续时长(秒)")
+    first_violation: Optional[datetime] = None
+    last_violation: Optional[datetime] = None
+
+class FenceBacktestResult(BaseModel):
+    fence_id: Optional[int]
+    start: datetime
+    end: datetime
+    points: int = Field(..., description="回放的定位点数")
+    devices: int
+    violating_devices: int
+    crossings: int = Field(..., description="所有设备进入违规状态的总次数")
+    alarms: int = Field(..., description="估算该围栏在时间段内会产生的报警数: 回放期间报警不被处理, 生效时段结束时自动解除")
+    correlated: int = Field(..., description="按报警聚合规则并入其他设备报警的越界次数")
+    first_violation: Optional[datetime] = None
+    device_summaries: List[DeviceBacktestSummary]
@@ -5,8 +5,9 @@ import os
 import uuid
 from datetime import datetime
 from app.services.ai_service import AIService
-from app.models.alarm_records import AlarmRecord
-from app.core.database import SessionLocal
+from app.schemas.alarm_schema import AlarmCreate
+from app.services.alarm_writer import alarm_writer
+from app.services.alarm_correlation import alarm_correlator
 # 务必保留此导入，防止数据库外键报错
 from app.models.fence import ElectronicFence 
 
@@ -86,8 +87,7 @@ class AIManager:
                 if "helmet" in active_algos:
                     is_alarm, details = self.ai_service.detect_safety_helmet(frame)
                     if is_alarm:
-                        img_path = self._save_alarm_image(frame, device_id, details)
-                        self._save_alarm_to_db(device_id, details, img_path)
+                        self._raise_alarm(frame, device_id, details)
 
                 # 👉 功能 2: 监护人离岗检测
                 if "off_post" in active_algos:
@@ -99,30 +99,24 @@ class AIManager:
                     else:
                         duration = time.time() - last_seen_person_time
                         if duration > OFF_POST_THRESHOLD and not is_already_alarmed:
-                            img_path = self._save_alarm_image(frame, device_id, details={
-                                "type": "监护人员离岗",
-                                "msg": f"监护人离岗超过 {int(OFF_POST_THRESHOLD)} 秒"
-                            })
                             details = {
                                 "type": "监护人员离岗",
                                 "msg": f"监护人离岗超过 {int(OFF_POST_THRESHOLD)} 秒"
                             }
-                            self._save_alarm_to_db(device_id, details, img_path)
+                            self._raise_alarm(frame, device_id, details)
                             is_already_alarmed = True
 
                 # 👉 功能 3: 孔口挡坎检测
                 if "hole_curb" in active_algos:
                     is_alarm, details = self.ai_service.detect_hole_curb(frame)
                     if is_alarm:
-                        img_path = self._save_alarm_image(frame, device_id, details)
-                        self._save_alarm_to_db(device_id, details, img_path)
+                        self._raise_alarm(frame, device_id, details)
 
                 # 👉 功能 4: 现场标识检测
                 if "signage" in active_algos:
                     is_alarm, details = self.ai_service.detect_site_signage(frame)
                     if is_alarm:
-                        img_path = self._save_alarm_image(frame, device_id, details)
-                        self._save_alarm_to_db(device_id, details, img_path)
+                        self._raise_alarm(frame, device_id, details)
 
             except Exception as logic_error:
                 print(f"⚠️ [逻辑错误] 循环中发生异常: {logic_error}")
@@ -133,6 +127,16 @@ class AIManager:
         cap.release()
         print(f"--- 监控线程已退出: {device_id} ---")
 
+    def _raise_alarm(self, frame, device_id, details):
+        if not details: return
+        alarm = self._build_alarm(device_id, details)
+        # 报警风暴聚合: 同一摄像头同类报警仍在聚合窗口内时只累加父报警的次数，不再存图、不再写库
+        incident, absorbed = alarm_correlator.correlate(alarm)
+        if absorbed:
+            return
+        img_path = self._save_alarm_image(frame, device_id, details)
+        self._save_alarm_to_db(device_id, details, img_path, alarm=alarm, incident=incident)
+
     # 修改 ai_manager.py 中的 _save_alarm_image 函数
     def _save_alarm_image(self, frame, device_id, details=None): # 👈 增加 details 参数
         try:
@@ -156,26 +160,19 @@ class AIManager:
             print(f"❌ 图片保存失败: {e}")
             return ""
 
-    def _save_alarm_to_db(self, device_id, details, image_path):
+    def _build_alarm(self, device_id, details):
+        return AlarmCreate(
+            device_id=str(device_id),
+            alarm_type=details.get('type', 'unknown'),
+            severity="HIGH",
+            description=details.get('msg', '检测到异常'),
+            status="pending",
+        )
+
+    def _save_alarm_to_db(self, device_id, details, image_path, alarm=None, incident=None):
         if not details: return
-        db = SessionLocal()
-        try:
-            record = AlarmRecord(
-                device_id=str(device_id),
-                alarm_type=details.get('type', 'unknown'),
-                severity="HIGH",
-                description=details.get('msg', '检测到异常'),
-                recording_path=image_path,
-                status="pending",
-                timestamp=datetime.now()
-            )
-            db.add(record)
-            db.commit()
-            print(f"✅ [数据库] 报警记录已保存 (ID: {record.id})")
-        except Exception as e:
-            print(f"❌ 数据库保存失败: {e}")
-            db.rollback()
-        finally:
-            db.close()
+        # 交给后台批量写入线程，报警风暴时不再每条报警单独开会话提交
+        alarm_writer.submit(alarm or self._build_alarm(device_id, details), recording_path=image_path,
+                            timestamp=datetime.now(), check_device=False, incident=incident)
 
 ai_manager = AIManager()
\ No newline at end of file
@@ -0,0 +1,279 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, and_, or_
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.core.monthly_tables import month_key
+from app.models.alarm_archive import alarm_archive
+from app.models.alarm_records import AlarmRecord
+from app.schemas.alarm_schema import AlarmFilter
+from app.services.alarm_service import encode_cursor, decode_cursor
+from app.utils.logger import get_logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except Exception:
+    pa = pc = ds = pq = None
+
+logger = get_logger("AlarmArchive")
+
+# Handled (non-pending) alarms older than this many days leave alarm_records; 0 disables archiving
+ALARM_RETENTION_DAYS = int(os.getenv("ALARM_RETENTION_DAYS", 180))
+# Alarms moved per transaction
+ALARM_ARCHIVE_BATCH = int(os.getenv("ALARM_ARCHIVE_BATCH", 5000))
+# Seconds between archive runs
+ALARM_ARCHIVE_INTERVAL = int(os.getenv("ALARM_ARCHIVE_INTERVAL", 3600))
+# "table": alarm_archive_YYYYMM tables in the same DB; "parquet": zstd Parquet files (needs pyarrow)
+ALARM_ARCHIVE_FORMAT = os.getenv("ALARM_ARCHIVE_FORMAT", "table")
+# Parquet files go to <dir>/YYYYMM/
+ALARM_ARCHIVE_DIR = os.getenv("ALARM_ARCHIVE_DIR", "archive/alarms")
+
+FILTER_FIELDS = ("status", "alarm_type", "severity", "device_id", "fence_id")
+ARCHIVE_FIELDS = (
+    "id", "device_id", "fence_id", "department_id", "alarm_type", "severity", "timestamp", "description", "status",
+    "handled_at", "location", "recording_path", "recording_status", "recording_error", "occurrences", "last_seen",
+)
+
+if pa is not None:
+    PARQUET_SCHEMA = pa.schema([
+        ("id", pa.int64()),
+        ("device_id", pa.string()),
+        ("fence_id", pa.int64()),
+        ("department_id", pa.int64()),
+        ("alarm_type", pa.string()),
+        ("severity", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+        ("description", pa.string()),
+        ("status", pa.string()),
+        ("handled_at", pa.timestamp("us")),
+        ("location", pa.string()),
+        ("recording_path", pa.string()),
+        ("recording_status", pa.string()),
+        ("recording_error", pa.string()),
+        ("occurrences", pa.int64()),
+        ("last_seen", pa.timestamp("us")),
+        ("archived_at", pa.timestamp("us")),
+    ])
+
+
+class AlarmArchiver:
+    """
+    Retention for alarm_records.
+    A background job moves every non-pending alarm (resolved, warnings, any other
+    handled status) older than ALARM_RETENTION_DAYS out of the hot table, oldest
+    first and ALARM_ARCHIVE_BATCH at a time. Each batch is
+    split by the month of the alarm and lands in alarm_archive_YYYYMM or in a
+    Parquet file under ALARM_ARCHIVE_DIR/YYYYMM, then is deleted from
+    alarm_records. Pending alarms are never moved. get_page reads both archive
+    forms with the same filters and keyset cursor as AlarmService.get_alarm_page.
+    A Parquet file is renamed into place only once complete, but the delete that
+    follows can still fail, so a later batch may archive the same alarm again:
+    readers keep one row per id.
+    """
+
+    def __init__(self):
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.archived = 0
+        self.parquet = ALARM_ARCHIVE_FORMAT == "parquet"
+        if self.parquet and pq is None:
+            logger.warning("ALARM_ARCHIVE_FORMAT=parquet but pyarrow is not installed, archiving to tables")
+            self.parquet = False
+
+    def start(self):
+        if ALARM_RETENTION_DAYS <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="alarm-archive", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Alarm archive run failed: {e}")
+            self._stop_event.wait(ALARM_ARCHIVE_INTERVAL)
+
+    def run_once(self, now: datetime = None) -> int:
+        """Archive everything currently due. Returns the number of alarms moved."""
+        cutoff = (now or datetime.now()) - timedelta(days=ALARM_RETENTION_DAYS)
+        moved = 0
+        db = SessionLocal()
+        try:
+            while not self._stop_event.is_set():
+                count = self._archive_batch(db, cutoff)
+                moved += count
+                if count < ALARM_ARCHIVE_BATCH:
+                    break
+        finally:
+            db.close()
+        if moved:
+            logger.info(f"Archived {moved} handled alarms older than {cutoff:%Y-%m-%d %H:%M}")
+        return moved
+
+    def _archive_batch(self, db: Session, cutoff: datetime) -> int:
+        hot = AlarmRecord.__table__
+        # Walks ix_alarm_records_ts_id from the oldest entry, stepping over pending alarms
+        rows = db.execute(
+            select(*(hot.c[f] for f in ARCHIVE_FIELDS))
+            .where(hot.c.status != "pending", hot.c.timestamp < cutoff)
+            .order_by(hot.c.timestamp, hot.c.id)
+            .limit(ALARM_ARCHIVE_BATCH)
+        ).mappings().all()
+        if not rows:
+            return 0
+
+        archived_at = datetime.now()
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(month_key(row["timestamp"]), []).append({**row, "archived_at": archived_at})
+        try:
+            for key, month_rows in by_month.items():
+                if self.parquet:
+                    self._write_parquet(key, month_rows)
+                else:
+                    db.execute(alarm_archive.table_for_write(key).insert(), month_rows)
+            db.execute(delete(AlarmRecord).where(AlarmRecord.id.in_([row["id"] for row in rows])))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        self.archived += len(rows)
+        return len(rows)
+
+    def _write_parquet(self, key: str, rows: list[dict]):
+        directory = os.path.join(ALARM_ARCHIVE_DIR, key)
+        os.makedirs(directory, exist_ok=True)
+        ids = [row["id"] for row in rows]
+        # Named by id range: a batch retried after a failed delete overwrites its own file
+        path = os.path.join(directory, f"alarms_{min(ids)}_{max(ids)}.parquet")
+        # Dot-prefixed while being written, so readers skip the partial file
+        tmp_path = os.path.join(directory, f".alarms_{min(ids)}_{max(ids)}.parquet.tmp")
+        pq.write_table(pa.Table.from_pylist(rows, schema=PARQUET_SCHEMA), tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+
+    # --- Read API ---
+
+    def get_page(self, db: Session, filters: AlarmFilter = None, cursor: str = None, limit: int = 100):
+        """Archived alarms newest first. Returns (rows, next_cursor), next_cursor is None on the last page."""
+        filters = filters or AlarmFilter()
+        after = decode_cursor(cursor) if cursor else None
+        keys = self.months()
+        if filters.start is not None:
+            keys = [k for k in keys if k >= month_key(filters.start)]
+        if filters.end is not None:
+            keys = [k for k in keys if k <= month_key(filters.end)]
+        if after is not None:
+            keys = [k for k in keys if k <= month_key(after[0])]
+
+        rows = []
+        for key in reversed(keys):
+            wanted = limit + 1 - len(rows)
+            found = self._table_rows(db, key, filters, after, wanted) + self._parquet_rows(key, filters, after, wanted)
+            # One row per id, should a month hold the same alarm in both forms
+            found = list({row["id"]: row for row in found}.values())
+            found.sort(key=lambda r: (r["timestamp"], r["id"]), reverse=True)
+            rows.extend(found[:wanted])
+            if len(rows) > limit:
+                break
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+
+    def months(self) -> list[str]:
+        """'YYYYMM' of every archived month, tables and Parquet, oldest first."""
+        keys = set(alarm_archive.existing_keys())
+        if pq is not None and os.path.isdir(ALARM_ARCHIVE_DIR):
+            keys.update(name for name in os.listdir(ALARM_ARCHIVE_DIR) if name.isdigit() and len(name) == 6)
+        return sorted(keys)
+
+    def _table_rows(self, db: Session, key: str, filters: AlarmFilter, after, limit: int) -> list[dict]:
+        tables = alarm_archive.existing_tables([key])
+        if not tables:
+            return []
+        table = tables[0]
+        stmt = select(*(table.c[f] for f in ARCHIVE_FIELDS))
+        for field in FILTER_FIELDS:
+            value = getattr(filters, field)
+            if value is not None:
+                stmt = stmt.where(table.c[field] == value)
+        if filters.start is not None:
+            stmt = stmt.where(table.c.timestamp >= filters.start)
+        if filters.end is not None:
+            stmt = stmt.where(table.c.timestamp <= filters.end)
+        if after is not None:
+            ts, alarm_id = after
+            stmt = stmt.where(or_(table.c.timestamp < ts, and_(table.c.timestamp == ts, table.c.id < alarm_id)))
+        stmt = stmt.order_by(table.c.timestamp.desc(), table.c.id.desc()).limit(limit)
+        return [dict(row) for row in db.execute(stmt).mappings()]
+
+    def _parquet_rows(self, key: str, filters: AlarmFilter, after, limit: int) -> list[dict]:
+        """
+        Newest `limit` rows of one month's Parquet files. Filters and the keyset
+        condition are pushed into the dataset scan (row groups are skipped by their
+        statistics); batches are folded into a running top-`limit`, de-duplicated by id.
+        """
+        directory = os.path.join(ALARM_ARCHIVE_DIR, key)
+        if ds is None or not os.path.isdir(directory):
+            return []
+        timestamp, alarm_id = ds.field("timestamp"), ds.field("id")
+        condition = None
+        for field in FILTER_FIELDS:
+            value = getattr(filters, field)
+            if value is not None:
+                condition = _and(condition, ds.field(field) == value)
+        if filters.start is not None:
+            condition = _and(condition, timestamp >= pa.scalar(filters.start, pa.timestamp("us")))
+        if filters.end is not None:
+            condition = _and(condition, timestamp <= pa.scalar(filters.end, pa.timestamp("us")))
+        if after is not None:
+            after_ts = pa.scalar(after[0], pa.timestamp("us"))
+            condition = _and(condition, (timestamp < after_ts) | ((timestamp == after_ts) & (alarm_id < after[1])))
+
+        # Files being written are dot-prefixed, which the dataset ignores
+        dataset = ds.dataset(directory, format="parquet", schema=PARQUET_SCHEMA)
+        order = [("timestamp", "descending"), ("id", "descending")]
+        top = None
+        for batch in dataset.to_batches(columns=list(ARCHIVE_FIELDS), filter=condition):
+            if batch.num_rows == 0:
+                continue
+            table = pa.Table.from_batches([batch])
+            if top is not None:
+                table = pa.concat_tables([top, table])
+            table = _unique_ids(table)
+            top = table.take(pc.select_k_unstable(table, k=min(limit, table.num_rows), sort_keys=order))
+        if top is None:
+            return []
+        return top.sort_by(order).to_pylist()
+
+    def stats(self) -> dict:
+        return {
+            "format": "parquet" if self.parquet else "table",
+            "retention_days": ALARM_RETENTION_DAYS,
+            "archived": self.archived,
+        }
+
+
+def _and(condition, term):
+    return term if condition is None else condition & term
+
+
+def _unique_ids(table):
+    """One row per id (a re-archived alarm is the same row twice)."""
+    if len(pc.unique(table.column("id"))) == table.num_rows:
+        return table
+    indexed = table.append_column("_row", pa.array(range(table.num_rows), pa.int64()))
+    first = indexed.group_by("id", use_threads=False).aggregate([("_row", "min")])
+    return table.take(first.column("_row_min"))
+
+
+alarm_archiver = AlarmArchiver()
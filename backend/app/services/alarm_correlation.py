@@ -0,0 +1,231 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import select, update
+from app.core.database import SessionLocal
+from app.models.alarm_records import AlarmRecord
+from app.schemas.alarm_schema import AlarmCreate
+from app.services.alarm_rollup import alarm_rollups, KEY_SOURCE_FIELDS
+from app.utils.logger import get_logger
+
+logger = get_logger("AlarmCorrelation")
+
+# First matching rule wins. match: field -> required value (null = field is empty);
+# key: fields that identify one incident; window: seconds of silence that close it.
+DEFAULT_CORRELATION_RULES = [
+    # AI camera detections: one incident per camera and alarm type
+    {"match": {"fence_id": None}, "key": ["device_id", "alarm_type"], "window": 60},
+    # Fence crossings: a team crossing together is one pending alarm per fence
+    {"match": {"status": "pending"}, "key": ["fence_id", "alarm_type"], "window": 60},
+    # Proximity warnings: one incident per fence, however many devices approach it
+    {"match": {"status": "warning"}, "key": ["fence_id", "alarm_type"], "window": 120},
+]
+# JSON list in the same format; "[]" disables correlation
+_rules_env = os.getenv("ALARM_CORRELATION_RULES")
+ALARM_CORRELATION_RULES = json.loads(_rules_env) if _rules_env else DEFAULT_CORRELATION_RULES
+# Seconds between writes of accumulated occurrence counts
+ALARM_CORRELATION_FLUSH = float(os.getenv("ALARM_CORRELATION_FLUSH", 1.0))
+
+
+class Incident:
+    __slots__ = ("key", "window", "alarm_id", "last_mono", "last_seen", "pending", "covered")
+
+    def __init__(self, key, window: float, now: datetime):
+        self.key = key
+        self.window = window
+        self.alarm_id = None  # parent AlarmRecord, set once it is written
+        self.last_mono = time.monotonic()
+        self.last_seen = now
+        self.pending = 0  # occurrences not yet added to the parent row
+        self.covered = set()  # (device_id, fence_id) of absorbed pending fence alarms
+
+
+class AlarmCorrelator:
+    """
+    Correlation stage in front of alarm persistence.
+    An alarm matching a rule either opens an incident (and is written as the
+    parent AlarmRecord) or, while that incident is open, is absorbed into it:
+    nothing is written for it except, batched every ALARM_CORRELATION_FLUSH
+    seconds, parent.occurrences += n and parent.last_seen. The window slides:
+    an incident closes after `window` seconds without a new occurrence, or
+    when its parent alarm is resolved or deleted.
+    A pending fence alarm absorbed into another device's parent leaves that
+    device "covered": covers() makes fence dedupe treat it as already alarmed
+    until the parent stops being pending, even after the window has closed.
+    Coverage is in memory only; after a restart a still-violating covered
+    device raises its own pending alarm.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = ALARM_CORRELATION_RULES if rules is None else rules
+        self._lock = threading.Lock()
+        self._open = {}  # key -> Incident
+        self._by_alarm = {}  # parent alarm id -> Incident
+        self._covering = {}  # (device_id, fence_id) -> Incident whose parent stands in for it
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.absorbed = 0
+
+    def start(self):
+        if not self.rules or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="alarm-correlation", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def _loop(self):
+        while not self._stop_event.wait(ALARM_CORRELATION_FLUSH):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Alarm correlation flush failed: {e}")
+
+    def _rule_key(self, alarm: AlarmCreate):
+        for i, rule in enumerate(self.rules):
+            if all(getattr(alarm, field, None) == value for field, value in rule.get("match", {}).items()):
+                if rule.get("window", 0) <= 0:
+                    return None, None
+                return (i,) + tuple(getattr(alarm, field, None) for field in rule["key"]), rule["window"]
+        return None, None
+
+    def correlate(self, alarm: AlarmCreate, now: datetime = None):
+        """
+        (incident, absorbed).
+        absorbed=True: counted into an open incident, do not persist the alarm.
+        Otherwise incident is the new incident this alarm opens (None when no
+        rule matches): persist the alarm, then attach() its id, or abandon() on failure.
+        """
+        key, window = self._rule_key(alarm)
+        if key is None:
+            return None, False
+        # Same clock as AlarmRecord.timestamp
+        now = now or datetime.utcnow()
+        mono = time.monotonic()
+        with self._lock:
+            incident = self._open.get(key)
+            if incident is not None and mono - incident.last_mono <= incident.window:
+                incident.pending += 1
+                incident.last_mono = mono
+                incident.last_seen = now
+                if alarm.status == "pending" and alarm.fence_id is not None:
+                    pair = (str(alarm.device_id), alarm.fence_id)
+                    incident.covered.add(pair)
+                    self._covering[pair] = incident
+                self.absorbed += 1
+                return incident, True
+            if incident is not None:
+                self._expire(incident)
+            incident = self._open[key] = Incident(key, window, now)
+            return incident, False
+
+    def covers(self, device_id, fence_id) -> bool:
+        """The device's crossing of the fence was absorbed into a parent alarm that is still pending."""
+        return (str(device_id), fence_id) in self._covering
+
+    def attach(self, incident: Incident, alarm_id: int):
+        if incident is None:
+            return
+        with self._lock:
+            incident.alarm_id = alarm_id
+            if self._open.get(incident.key) is incident or incident.covered:
+                self._by_alarm[alarm_id] = incident
+
+    def abandon(self, incident: Incident):
+        """The parent alarm was not written: the next alarm with this key opens a fresh incident."""
+        if incident is None:
+            return
+        with self._lock:
+            self._close(incident)
+
+    def close_alarm(self, alarm_id: int):
+        """Parent resolved, deleted or no longer pending: further occurrences start a new incident."""
+        with self._lock:
+            incident = self._by_alarm.get(alarm_id)
+            if incident is not None:
+                self._close(incident)
+
+    def discard_fence(self, fence_id: int):
+        """The fence was deleted: release the devices covered for it."""
+        with self._lock:
+            for incident in {i for pair, i in self._covering.items() if pair[1] == fence_id}:
+                self._close(incident)
+
+    def _expire(self, incident: Incident):
+        """Window passed: stop absorbing. A parent that covers devices stays reachable by id."""
+        if self._open.get(incident.key) is incident:
+            del self._open[incident.key]
+        if not incident.covered and incident.alarm_id is not None and self._by_alarm.get(incident.alarm_id) is incident:
+            del self._by_alarm[incident.alarm_id]
+
+    def _close(self, incident: Incident):
+        if self._open.get(incident.key) is incident:
+            del self._open[incident.key]
+        if incident.alarm_id is not None and self._by_alarm.get(incident.alarm_id) is incident:
+            del self._by_alarm[incident.alarm_id]
+        for pair in incident.covered:
+            if self._covering.get(pair) is incident:
+                del self._covering[pair]
+        incident.covered = set()
+
+    def flush(self):
+        """Add absorbed occurrences to their parent rows (and to the rollups) and drop expired incidents."""
+        mono = time.monotonic()
+        with self._lock:
+            due = []
+            for incident in list(self._open.values()):
+                if incident.pending and incident.alarm_id is not None:
+                    due.append((incident, incident.pending, incident.last_seen))
+                    incident.pending = 0
+                if mono - incident.last_mono > incident.window and not incident.pending:
+                    # Kept while its parent id is still unknown and occurrences are waiting
+                    self._expire(incident)
+        if not due:
+            return
+
+        table = AlarmRecord.__table__
+        db = SessionLocal()
+        try:
+            gone = []
+            added = {}
+            for incident, count, last_seen in due:
+                result = db.execute(
+                    update(table)
+                    .where(table.c.id == incident.alarm_id)
+                    .values(occurrences=table.c.occurrences + count, last_seen=last_seen)
+                )
+                if result.rowcount == 0:
+                    gone.append(incident)
+                else:
+                    added[incident.alarm_id] = count
+            if added:
+                # Read back after the UPDATE, which holds the row locks: counted under the parent's current status
+                parents = db.execute(
+                    select(table.c.id, *(table.c[field] for field in KEY_SOURCE_FIELDS)).where(table.c.id.in_(added))
+                ).mappings().all()
+                alarm_rollups.occurrences_added(db, [(parent, added[parent["id"]]) for parent in parents])
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for incident, count, _ in due:
+                    incident.pending += count
+            raise
+        finally:
+            db.close()
+        # Parent rolled back or deleted elsewhere: stop feeding it
+        for incident in gone:
+            self.abandon(incident)
+
+    def stats(self) -> dict:
+        return {"open_incidents": len(self._open), "covered": len(self._covering), "absorbed": self.absorbed}
+
+
+alarm_correlator = AlarmCorrelator()
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.utils.logger import get_logger
+
+logger = get_logger("AlarmEvents")
+
+# Recent events kept for replay, so a reconnecting console resumes instead of reloading
+ALARM_EVENT_BUFFER = int(os.getenv("ALARM_EVENT_BUFFER", 1000))
+# Undelivered events per subscriber before it is told to reload
+ALARM_EVENT_QUEUE = int(os.getenv("ALARM_EVENT_QUEUE", 500))
+# Seconds between keep-alives on an idle stream
+ALARM_EVENT_HEARTBEAT = 15
+
+PAYLOAD_FIELDS = (
+    "id", "device_id", "fence_id", "alarm_type", "severity", "description",
+    "location", "status", "timestamp", "recording_path",
+)
+
+# Queued instead of an event when the subscriber missed events: it must reload the list
+RESET = {"event": "reset"}
+
+
+def alarm_payload(alarm) -> dict:
+    """JSON-ready alarm fields from an AlarmRecord or an insert row dict (id may be None)."""
+    if isinstance(alarm, dict):
+        payload = {field: alarm.get(field) for field in PAYLOAD_FIELDS}
+    else:
+        payload = {field: getattr(alarm, field, None) for field in PAYLOAD_FIELDS}
+    if payload["timestamp"] is not None:
+        payload["timestamp"] = payload["timestamp"].isoformat()
+    return payload
+
+
+def visible_to(user: dict, department_id) -> bool:
+    """Same HQ / BRANCH rule as the dashboard: a branch only sees its own department."""
+    if user.get("role") != "BRANCH":
+        return True
+    return department_id is not None and department_id == user.get("department_id")
+
+
+class AlarmSubscription:
+    """One connected console. Events arrive on its asyncio queue via the broker."""
+
+    def __init__(self, user: dict, loop: asyncio.AbstractEventLoop):
+        self.user = user
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=ALARM_EVENT_QUEUE)
+
+    def _offer(self, events):
+        # Runs on the subscriber's event loop
+        for ev in events:
+            if not visible_to(self.user, ev["department_id"]):
+                continue
+            try:
+                self.queue.put_nowait(ev)
+            except asyncio.QueueFull:
+                # Too slow to keep up: drop what is queued and make it reload
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+                self.queue.put_nowait(RESET)
+                return
+
+    async def next(self, timeout: float = ALARM_EVENT_HEARTBEAT):
+        """Next event, or None after timeout seconds of silence."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class AlarmEventBroker:
+    """
+    In-process pub/sub for new alarms.
+    Publishers are plain threads (request workers, the alarm writer, AI monitors);
+    every event gets a sequence id and is kept in a ring buffer of the last
+    ALARM_EVENT_BUFFER events. A subscriber passing the last id it saw gets the
+    buffered events after it first, or RESET when they are no longer buffered
+    (or the id is from before a restart).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._buffer = deque(maxlen=ALARM_EVENT_BUFFER)
+        self._subscribers = set()
+        self.published = 0
+
+    def publish(self, alarms):
+        """alarms: [(payload, department_id)]"""
+        if not alarms:
+            return
+        with self._lock:
+            events = []
+            for payload, department_id in alarms:
+                self._seq += 1
+                events.append({"event": "alarm", "id": self._seq, "alarm": payload, "department_id": department_id})
+            self._buffer.extend(events)
+            subscribers = list(self._subscribers)
+            self.published += len(events)
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, events)
+            except RuntimeError:
+                # Event loop already closed
+                self.unsubscribe(sub)
+
+    def subscribe(self, user: dict, last_event_id: int = None) -> AlarmSubscription:
+        sub = AlarmSubscription(user, asyncio.get_running_loop())
+        with self._lock:
+            # Registered under the same lock as the replay snapshot: no gap, no duplicates
+            self._subscribers.add(sub)
+            if last_event_id is not None:
+                oldest = self._buffer[0]["id"] if self._buffer else self._seq + 1
+                if last_event_id > self._seq or last_event_id < oldest - 1:
+                    sub.queue.put_nowait(RESET)
+                else:
+                    sub._offer([ev for ev in self._buffer if ev["id"] > last_event_id])
+        return sub
+
+    def unsubscribe(self, sub: AlarmSubscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subscribers), "published": self.published, "last_id": self._seq}
+
+
+alarm_events = AlarmEventBroker()
+
+
+def publish_on_commit(db: Session, payload: dict, department_id):
+    """Publish once db's outermost transaction commits; dropped if it rolls back."""
+    db.info.setdefault("alarm_events", []).append((payload, department_id))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    # Savepoint releases fire this too; only the outermost commit makes alarms visible
+    if session.in_nested_transaction():
+        return
+    alarm_events.publish(session.info.pop("alarm_events", None))
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop("alarm_events", None)
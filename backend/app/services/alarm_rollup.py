@@ -0,0 +1,215 @@
+from collections.abc import Mapping
+from datetime import datetime
+from sqlalchemy import func, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.models.alarm_archive import alarm_archive
+from app.models.alarm_records import AlarmRecord
+from app.models.alarm_rollup import AlarmRollup
+from app.utils.logger import get_logger
+
+logger = get_logger("AlarmRollup")
+
+KEY_FIELDS = ("bucket", "department_id", "device_id", "fence_id", "alarm_type", "severity")
+# Alarm columns alarm_key() reads
+KEY_SOURCE_FIELDS = (
+    "timestamp", "department_id", "device_id", "fence_id", "alarm_type", "severity", "status", "occurrences",
+)
+# Rows per chunk when rebuilding from raw alarms
+REBUILD_CHUNK_ROWS = 50000
+
+
+def hour_bucket(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _truncate(bucket: datetime, interval: str) -> datetime:
+    if interval == "day":
+        return bucket.replace(hour=0)
+    if interval == "month":
+        return bucket.replace(day=1, hour=0)
+    return bucket
+
+
+def _field(alarm, name, default=None):
+    if isinstance(alarm, Mapping):
+        return alarm.get(name, default)
+    return getattr(alarm, name, default)
+
+
+def alarm_key(alarm):
+    """
+    (rollup key, is_resolved, occurrences) of an AlarmRecord or a row mapping, from
+    the row's stored values only; key is None without a timestamp. An alarm counts
+    once per occurrence, including those absorbed by alarm correlation.
+    """
+    timestamp = _field(alarm, "timestamp")
+    resolved = _field(alarm, "status") == "resolved"
+    # Insert rows that leave occurrences to the column default count once
+    occurrences = _field(alarm, "occurrences") or 1
+    if timestamp is None:
+        return None, resolved, occurrences
+    key = (
+        hour_bucket(timestamp),
+        _field(alarm, "department_id") or 0,
+        str(_field(alarm, "device_id")),
+        _field(alarm, "fence_id") or 0,
+        _field(alarm, "alarm_type") or "",
+        _field(alarm, "severity") or "",
+    )
+    return key, resolved, occurrences
+
+
+def _add(deltas: dict, alarm_key_value, sign: int = 1, occurrences: int = None):
+    """Add (sign=1) or remove (sign=-1) one alarm_key(); occurrences overrides its count."""
+    key, resolved, count = alarm_key_value
+    if key is None:
+        return
+    count = sign * (count if occurrences is None else occurrences)
+    c, r = deltas.get(key, (0, 0))
+    deltas[key] = (c + count, r + (count if resolved else 0))
+
+
+class AlarmRollups:
+    """
+    Hourly alarm counts in alarm_rollups, per department, device, fence, type and severity.
+    Changed in the same transaction as the alarms they count: new alarms
+    (create_alarm, the batched writer) add to alarm_count, occurrences absorbed
+    by alarm correlation add to their parent's row, status changes in
+    update_alarm move resolved_count, deletes subtract. Archiving leaves them
+    alone, so trends reach back past the hot table's retention, and day / month
+    series are folded from the hourly rows without touching raw alarms.
+    Keys come only from values stored on the alarm (its department is recorded
+    when it is raised), so a later change elsewhere never splits one alarm's
+    counts across rollup rows: the table always equals a rebuild from the alarms.
+    """
+
+    def alarms_created(self, db: Session, alarms):
+        """alarms: [AlarmRecord or insert row dict]. No commit."""
+        deltas = {}
+        for alarm in alarms:
+            _add(deltas, alarm_key(alarm))
+        self.apply(db, deltas)
+
+    def alarm_changed(self, db: Session, before, after):
+        """before / after: alarm_key() of one alarm around an update. No commit."""
+        self.alarms_changed(db, [(before, after)])
+
+    def alarms_changed(self, db: Session, changes):
+        """changes: [(before, after)] alarm_key() pairs, applied as one upsert. No commit."""
+        deltas = {}
+        for before, after in changes:
+            if before == after:
+                continue
+            _add(deltas, before, -1)
+            _add(deltas, after)
+        self.apply(db, deltas)
+
+    def alarm_deleted(self, db: Session, alarm):
+        deltas = {}
+        _add(deltas, alarm_key(alarm), -1)
+        self.apply(db, deltas)
+
+    def occurrences_added(self, db: Session, added):
+        """added: [(alarm row mapping as stored, occurrences added to it)]. No commit."""
+        deltas = {}
+        for alarm, count in added:
+            _add(deltas, alarm_key(alarm), occurrences=count)
+        self.apply(db, deltas)
+
+    def apply(self, db: Session, deltas: dict):
+        """deltas: {rollup key: (alarm_count delta, resolved_count delta)}, upserted in key order."""
+        rows = [
+            {**dict(zip(KEY_FIELDS, key)), "alarm_count": c, "resolved_count": r}
+            for key, (c, r) in sorted(deltas.items())
+            if c or r
+        ]
+        if rows:
+            db.execute(self._upsert(db), rows)
+
+    def _upsert(self, db: Session):
+        table = AlarmRollup.__table__
+        dialect = db.get_bind().dialect.name
+        if dialect == "mysql":
+            stmt = mysql.insert(table)
+            return stmt.on_duplicate_key_update(
+                alarm_count=table.c.alarm_count + stmt.inserted.alarm_count,
+                resolved_count=table.c.resolved_count + stmt.inserted.resolved_count,
+            )
+        stmt = (postgresql if dialect == "postgresql" else sqlite).insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=list(KEY_FIELDS),
+            set_={
+                "alarm_count": table.c.alarm_count + stmt.excluded.alarm_count,
+                "resolved_count": table.c.resolved_count + stmt.excluded.resolved_count,
+            },
+        )
+
+    def series(self, db: Session, start: datetime, end: datetime, interval: str = "day",
+               group_by: str = None, department_id: int = None, filters: dict = None) -> list[dict]:
+        """
+        [{"group", "points": [{"bucket", "count", "resolved"}]}] for alarms with
+        start <= timestamp <= end, hour-granular at the edges. One series when group_by is None.
+        filters: {alarm_type / severity / device_id / fence_id: value}, None values ignored.
+        """
+        t = AlarmRollup
+        group_col = getattr(t, group_by) if group_by else None
+        cols = [t.bucket] + ([group_col] if group_col is not None else [])
+        stmt = (
+            select(*cols, func.sum(t.alarm_count), func.sum(t.resolved_count))
+            .where(t.bucket >= hour_bucket(start), t.bucket <= end)
+            .group_by(*cols)
+        )
+        if department_id is not None:
+            stmt = stmt.where(t.department_id == department_id)
+        for field, value in (filters or {}).items():
+            if value is not None:
+                stmt = stmt.where(getattr(t, field) == value)
+
+        folded = {}
+        for row in db.execute(stmt):
+            group = row[1] if group_col is not None else None
+            if group_by == "fence_id" and group == 0:
+                group = None
+            points = folded.setdefault(group, {})
+            bucket = _truncate(row[0], interval)
+            c, r = points.get(bucket, (0, 0))
+            points[bucket] = (c + int(row[-2] or 0), r + int(row[-1] or 0))
+
+        return [
+            {
+                "group": group,
+                "points": [
+                    {"bucket": bucket, "count": c, "resolved": r}
+                    for bucket, (c, r) in sorted(points.items()) if c or r
+                ],
+            }
+            for group, points in sorted(folded.items(), key=lambda item: (item[0] is None, str(item[0])))
+        ]
+
+    def rebuild_if_empty(self, db: Session):
+        """
+        One-time backfill from alarm_records and the archive tables when the rollup
+        table is still empty (first start after upgrading).
+        """
+        if db.query(AlarmRollup.id).first() is not None:
+            return
+        sources = [AlarmRecord.__table__] + alarm_archive.existing_tables(alarm_archive.existing_keys())
+        deltas = {}
+        rows_seen = 0
+        for table in sources:
+            stmt = select(*(table.c[f] for f in KEY_SOURCE_FIELDS)).execution_options(
+                stream_results=True, yield_per=REBUILD_CHUNK_ROWS
+            )
+            for chunk in db.execute(stmt).mappings().partitions():
+                for row in chunk:
+                    _add(deltas, alarm_key(row))
+                rows_seen += len(chunk)
+        if not deltas:
+            return
+        self.apply(db, deltas)
+        db.commit()
+        logger.info(f"Alarm rollups rebuilt from {rows_seen} alarms into {len(deltas)} hourly rows")
+
+
+alarm_rollups = AlarmRollups()
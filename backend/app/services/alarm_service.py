@@ -1,68 +1,361 @@
+import base64
+import os
+import threading
+import time
+from sqlalchemy import String, and_, case, cast, or_
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException
 from app.models.alarm_records import AlarmRecord
+from app.models.admin_user import User
 from app.models.device import Device
 from app.models.fence import ElectronicFence
-from app.schemas.alarm_schema import AlarmCreate, AlarmUpdate
+from app.schemas.alarm_schema import AlarmCreate, AlarmUpdate, AlarmFilter
+from app.services.alarm_events import alarm_payload, publish_on_commit
+from app.services.alarm_rollup import alarm_rollups, alarm_key, KEY_SOURCE_FIELDS
+from app.services.dashboard_counters import dashboard_counters
+from app.services.alarm_correlation import alarm_correlator
 from app.utils.logger import get_logger
 from datetime import datetime
 
 logger = get_logger("AlarmService")
 
+# Seconds before cached device / fence ids are reloaded (rows deleted by other processes)
+ALARM_REF_CACHE_SECONDS = int(os.getenv("ALARM_REF_CACHE_SECONDS", 60))
+
+
+def pending_key(device_id, fence_id, status):
+    """Value of AlarmRecord.pending_key: only pending fence alarms hold a key."""
+    if status != "pending" or fence_id is None:
+        return None
+    return f"{device_id}:{fence_id}"
+
+
+class PendingFenceAlarms:
+    """
+    Warm in-memory set of (device_id, fence_id) pairs with a pending alarm.
+    Replaces the per-ping SELECT in FenceService; the unique pending_key
+    column still guards against races between processes.
+    """
+
+    def __init__(self):
+        self._keys = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self, db: Session):
+        rows = (
+            db.query(AlarmRecord.device_id, AlarmRecord.fence_id)
+            .filter(AlarmRecord.status == "pending", AlarmRecord.fence_id.isnot(None))
+            .all()
+        )
+        with self._lock:
+            self._keys = {(str(device_id), fence_id) for device_id, fence_id in rows}
+            self._loaded = True
+        logger.info(f"Loaded {len(rows)} pending fence alarms")
+
+    def invalidate(self):
+        """Force a reload from the DB on next use (e.g. after a failed commit)."""
+        self._loaded = False
+
+    def contains(self, db: Session, device_id, fence_id) -> bool:
+        if not self._loaded:
+            self.load(db)
+        return (str(device_id), fence_id) in self._keys
+
+    def add(self, device_id, fence_id):
+        with self._lock:
+            self._keys.add((str(device_id), fence_id))
+
+    def discard(self, device_id, fence_id):
+        with self._lock:
+            self._keys.discard((str(device_id), fence_id))
+
+    def discard_fence(self, fence_id):
+        with self._lock:
+            self._keys = {k for k in self._keys if k[1] != fence_id}
+
+
+pending_fence_alarms = PendingFenceAlarms()
+
+
+def encode_cursor(timestamp: datetime, alarm_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{alarm_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """(timestamp, id) from an encode_cursor string."""
+    try:
+        ts, alarm_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), int(alarm_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class AlarmReferenceCache:
+    """
+    Known device ids and fence names for validating alarms without a lookup per alarm.
+    Misses are resolved with one IN query for the whole set of unknown ids.
+    Devices also carry their owner's department_id, for routing alarm events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}  # device_id -> owner's department_id
+        self._fences = {}  # fence_id -> name
+        self._loaded_at = 0.0
+
+    def _expire(self):
+        if time.monotonic() - self._loaded_at > ALARM_REF_CACHE_SECONDS:
+            with self._lock:
+                self._devices = {}
+                self._fences = {}
+                self._loaded_at = time.monotonic()
+
+    def resolve(self, db: Session, device_ids, fence_ids):
+        """(existing device ids, {fence_id: name}) restricted to the given ids."""
+        self._expire()
+        device_ids = {str(d) for d in device_ids}
+        fence_ids = {f for f in fence_ids if f is not None}
+        missing_devices = device_ids - self._devices.keys()
+        missing_fences = fence_ids - self._fences.keys()
+        if missing_devices:
+            rows = (
+                db.query(Device.id, User.department_id)
+                .outerjoin(User, Device.owner_id == User.id)
+                .filter(Device.id.in_(missing_devices))
+                .all()
+            )
+            with self._lock:
+                self._devices.update({device_id: department_id for device_id, department_id in rows})
+        if missing_fences:
+            rows = db.query(ElectronicFence.id, ElectronicFence.name).filter(
+                ElectronicFence.id.in_(missing_fences)
+            ).all()
+            with self._lock:
+                self._fences.update({fence_id: name for fence_id, name in rows})
+        return device_ids & self._devices.keys(), {f: self._fences[f] for f in fence_ids if f in self._fences}
+
+    def department_of(self, device_id):
+        """Owner department of a device seen by resolve(), None if unknown or unowned."""
+        return self._devices.get(str(device_id))
+
+    def departments(self, db: Session, device_ids) -> dict:
+        """{device_id: owner department} for the given ids, resolving unknown ones."""
+        found, _ = self.resolve(db, device_ids, [])
+        return {device_id: self.department_of(device_id) for device_id in found}
+
+    def discard_device(self, device_id):
+        with self._lock:
+            self._devices.pop(str(device_id), None)
+
+    def discard_fence(self, fence_id):
+        with self._lock:
+            self._fences.pop(fence_id, None)
+
+
+alarm_refs = AlarmReferenceCache()
+
+
 class AlarmService:
-    def create_alarm(self, db: Session, alarm: AlarmCreate):
+    def create_alarm(self, db: Session, alarm: AlarmCreate, commit: bool = True):
+        """commit=False only flushes, so callers can batch several alarms into one transaction."""
         logger.warning(f"ALARM TRIGGERED: Device {alarm.device_id}, Type {alarm.alarm_type}")
-        device = db.query(Device).filter(Device.id == alarm.device_id).first()
-        if not device:
+        devices, fences = alarm_refs.resolve(db, [alarm.device_id], [alarm.fence_id])
+        if not devices:
             raise HTTPException(status_code=400, detail=f"Device not found: {alarm.device_id}")
         if alarm.fence_id is not None:
-            fence = db.query(ElectronicFence).filter(ElectronicFence.id == alarm.fence_id).first()
-            if not fence:
+            if alarm.fence_id not in fences:
                 raise HTTPException(status_code=400, detail=f"Fence not found: {alarm.fence_id}")
             # Prepend fence name to location coordinates
-            alarm.location = f"{fence.name} {alarm.location}"
+            alarm.location = f"{fences[alarm.fence_id]} {alarm.location}"
 
+        department_id = alarm_refs.department_of(alarm.device_id)
         new_alarm = AlarmRecord(
             device_id=alarm.device_id,
             fence_id=alarm.fence_id,
+            department_id=department_id,
             alarm_type=alarm.alarm_type,
             severity=alarm.severity,
             description=alarm.description,
             location=alarm.location,
-            status=alarm.status
+            status=alarm.status,
+            pending_key=pending_key(alarm.device_id, alarm.fence_id, alarm.status),
         )
-        db.add(new_alarm)
-        db.commit()
-        db.refresh(new_alarm)
+        try:
+            # Savepoint, so a duplicate only discards this row and not the caller's batch
+            with db.begin_nested():
+                db.add(new_alarm)
+        except IntegrityError:
+            if new_alarm.pending_key is None:
+                raise
+            pending_fence_alarms.add(alarm.device_id, alarm.fence_id)
+            raise HTTPException(
+                status_code=409,
+                detail=f"Pending alarm already exists for device {alarm.device_id} and fence {alarm.fence_id}",
+            )
+        alarm_rollups.alarms_created(db, [new_alarm])
+        # Pushed to live consoles once the caller's transaction commits
+        publish_on_commit(db, alarm_payload(new_alarm), department_id)
+        if commit:
+            db.commit()
+            db.refresh(new_alarm)
+        if new_alarm.pending_key is not None:
+            pending_fence_alarms.add(alarm.device_id, alarm.fence_id)
+        dashboard_counters.alarms_added([new_alarm.timestamp])
         return new_alarm
 
-    def get_alarms(self, db: Session, skip: int = 0, limit: int = 100):
-        return db.query(AlarmRecord).order_by(AlarmRecord.timestamp.desc()).offset(skip).limit(limit).all()
+    def get_alarms(self, db: Session, skip: int = 0, limit: int = 100, filters: AlarmFilter = None):
+        return (
+            self._filtered(db, filters)
+            .order_by(AlarmRecord.timestamp.desc(), AlarmRecord.id.desc())
+            .offset(skip).limit(limit).all()
+        )
+
+    def get_alarm_page(self, db: Session, filters: AlarmFilter = None, cursor: str = None, limit: int = 100):
+        """
+        Keyset pagination, newest first: a page starts right after the (timestamp, id)
+        of the previous page's last row, so every page costs one index range seek
+        instead of skipping over all earlier rows.
+        Returns (alarms, next_cursor), next_cursor is None on the last page.
+        """
+        query = self._filtered(db, filters)
+        if cursor:
+            ts, alarm_id = decode_cursor(cursor)
+            query = query.filter(or_(
+                AlarmRecord.timestamp < ts,
+                and_(AlarmRecord.timestamp == ts, AlarmRecord.id < alarm_id),
+            ))
+        rows = (
+            query.order_by(AlarmRecord.timestamp.desc(), AlarmRecord.id.desc())
+            .limit(limit + 1).all()
+        )
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+    def _filtered(self, db: Session, filters: AlarmFilter = None):
+        query = db.query(AlarmRecord)
+        if filters is None:
+            return query
+        for field in ("status", "alarm_type", "severity", "device_id", "fence_id"):
+            value = getattr(filters, field)
+            if value is not None:
+                query = query.filter(getattr(AlarmRecord, field) == value)
+        if filters.start is not None:
+            query = query.filter(AlarmRecord.timestamp >= filters.start)
+        if filters.end is not None:
+            query = query.filter(AlarmRecord.timestamp <= filters.end)
+        return query
 
     def update_alarm(self, db: Session, alarm_id: int, update_data: AlarmUpdate):
-        db_alarm = db.query(AlarmRecord).filter(AlarmRecord.id == alarm_id).first()
+        # Locked, so occurrences counted by a concurrent correlation flush land on the row's current status
+        db_alarm = db.query(AlarmRecord).filter(AlarmRecord.id == alarm_id).with_for_update().first()
         if not db_alarm:
             return None
-        
+        before = alarm_key(db_alarm)
+        was_pending = db_alarm.pending_key is not None
+
         if update_data.status:
             db_alarm.status = update_data.status
+            db_alarm.pending_key = pending_key(db_alarm.device_id, db_alarm.fence_id, db_alarm.status)
             if update_data.status == "resolved":
                 db_alarm.handled_at = datetime.now()
-        
+
         if update_data.description:
             db_alarm.description = update_data.description
-            
+
         if update_data.severity:
             db_alarm.severity = update_data.severity
-            
-        db.commit()
+
+        try:
+            # Moves the alarm between rollup rows when its status or severity changed
+            alarm_rollups.alarm_changed(db, before, alarm_key(db_alarm))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Another pending alarm exists for this device and fence")
         db.refresh(db_alarm)
+        if db_alarm.status == "resolved" or (was_pending and db_alarm.pending_key is None):
+            # Later occurrences open a new incident instead of counting on a handled alarm,
+            # and devices covered by a pending fence alarm can alarm again
+            alarm_correlator.close_alarm(db_alarm.id)
+        if db_alarm.fence_id is not None:
+            if db_alarm.pending_key is None:
+                pending_fence_alarms.discard(db_alarm.device_id, db_alarm.fence_id)
+            else:
+                pending_fence_alarms.add(db_alarm.device_id, db_alarm.fence_id)
         return db_alarm
 
+    def bulk_update_status(self, db: Session, status: str, ids: list[int] = None, filters: AlarmFilter = None) -> int:
+        """
+        Set status on many alarms with one set-based UPDATE: the given ids, or every
+        alarm matching filters. Alarms already in that status are left alone.
+        Returns the number of alarms changed.
+        """
+        query = self._filtered(db, filters)
+        if ids is not None:
+            query = query.filter(AlarmRecord.id.in_(ids))
+        query = query.filter(AlarmRecord.status != status)
+        # Key columns of the rows about to change, locked so the UPDATE below hits the same set
+        rows = query.with_entities(
+            AlarmRecord.id, *(getattr(AlarmRecord, field) for field in KEY_SOURCE_FIELDS),
+        ).with_for_update().all()
+        if not rows:
+            db.rollback()
+            return 0
+
+        values = {"status": status, "pending_key": None}
+        if status == "pending":
+            # Same value as pending_key() for fence alarms, NULL for the rest
+            values["pending_key"] = case(
+                (AlarmRecord.fence_id.isnot(None), AlarmRecord.device_id + ":" + cast(AlarmRecord.fence_id, String)),
+                else_=None,
+            )
+        if status == "resolved":
+            values["handled_at"] = datetime.now()
+
+        changes = []
+        for row in rows:
+            alarm = row._mapping
+            changes.append((alarm_key(alarm), alarm_key({**alarm, "status": status})))
+        try:
+            updated = query.update(values, synchronize_session=False)
+            alarm_rollups.alarms_changed(db, changes)
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Another pending alarm exists for one of these devices and fences")
+
+        # Status does not move the dashboard counts (alarms today counts every status)
+        for row in rows:
+            if row.fence_id is not None:
+                if status == "pending":
+                    pending_fence_alarms.add(row.device_id, row.fence_id)
+                else:
+                    pending_fence_alarms.discard(row.device_id, row.fence_id)
+            if status == "resolved" or (row.status == "pending" and row.fence_id is not None):
+                alarm_correlator.close_alarm(row.id)
+        return updated
+
+    def resolve_fence_alarms(self, db: Session, fence_id: int) -> int:
+        """Resolve every pending alarm of a fence in one UPDATE. Returns the number resolved."""
+        return self.bulk_update_status(db, "resolved", filters=AlarmFilter(fence_id=fence_id, status="pending"))
+
     def delete_alarm(self, db: Session, alarm_id: int):
-        db_alarm = db.query(AlarmRecord).filter(AlarmRecord.id == alarm_id).first()
+        db_alarm = db.query(AlarmRecord).filter(AlarmRecord.id == alarm_id).with_for_update().first()
         if db_alarm:
+            key = db_alarm.pending_key
+            device_id, fence_id = db_alarm.device_id, db_alarm.fence_id
+            timestamp = db_alarm.timestamp
+            alarm_rollups.alarm_deleted(db, db_alarm)
             db.delete(db_alarm)
             db.commit()
+            dashboard_counters.alarm_removed(timestamp)
+            alarm_correlator.close_alarm(alarm_id)
+            if key is not None:
+                pending_fence_alarms.discard(device_id, fence_id)
             return True
         return False
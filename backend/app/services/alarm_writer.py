@@ -0,0 +1,238 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from app.core.database import SessionLocal
+from app.models.alarm_records import AlarmRecord
+from app.schemas.alarm_schema import AlarmCreate
+from app.services.alarm_service import alarm_refs, pending_fence_alarms, pending_key
+from app.services.alarm_correlation import alarm_correlator
+from app.services.alarm_events import alarm_events, alarm_payload
+from app.services.alarm_rollup import alarm_rollups
+from app.services.dashboard_counters import dashboard_counters
+from app.utils.logger import get_logger
+
+logger = get_logger("AlarmWriter")
+
+# Flush queued alarms every N seconds ...
+ALARM_FLUSH_INTERVAL = float(os.getenv("ALARM_FLUSH_INTERVAL", 0.2))
+# ... writing at most M per transaction
+ALARM_FLUSH_BATCH = int(os.getenv("ALARM_FLUSH_BATCH", 500))
+# Producers block (backpressure) once this many alarms are waiting
+ALARM_QUEUE_SIZE = int(os.getenv("ALARM_QUEUE_SIZE", 20000))
+
+
+class _QueuedAlarm:
+    __slots__ = ("alarm", "recording_path", "timestamp", "need_id", "check_device", "incident", "future", "alarm_id")
+
+    def __init__(self, alarm: AlarmCreate, recording_path, timestamp, need_id: bool, check_device: bool, incident):
+        self.alarm = alarm
+        self.recording_path = recording_path
+        self.timestamp = timestamp
+        self.need_id = need_id
+        self.check_device = check_device
+        self.incident = incident
+        self.future = Future()
+        self.alarm_id = None
+
+
+class AlarmWriter:
+    """
+    Background writer for alarm storms.
+    Producers enqueue alarms and get a Future; a flusher thread validates device
+    and fence ids against AlarmReferenceCache and inserts a whole batch in one
+    transaction. Rows nobody needs the id of go in as one multi-row INSERT.
+    The Future resolves to the new alarm id (None when need_id is False) or
+    fails with the same HTTPException create_alarm would raise. Alarms absorbed
+    by AlarmCorrelator are not queued; their Future resolves right away to the
+    parent alarm's id, if it is already known.
+    Fence alarms do not come through here: they are inserted in the ping batch's
+    own transaction, together with the count changes they belong to.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=ALARM_QUEUE_SIZE)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="alarm-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        # Whatever is still queued is written synchronously
+        while self._flush_once():
+            pass
+
+    def submit(self, alarm: AlarmCreate, recording_path: str = None, timestamp: datetime = None,
+               need_id: bool = False, check_device: bool = True, incident=None) -> Future:
+        """
+        check_device=False skips the devices-table check, for sources whose
+        device_id is not a tracked Device (AI camera streams).
+        incident: the caller already ran alarm_correlator.correlate() and this
+        alarm opens that incident.
+        """
+        if incident is None:
+            incident, absorbed = alarm_correlator.correlate(alarm)
+            if absorbed:
+                future = Future()
+                future.set_result(incident.alarm_id if need_id else None)
+                return future
+        # Same default as AlarmRecord.timestamp; a multi-row INSERT would write NULL instead
+        item = _QueuedAlarm(alarm, recording_path, timestamp or datetime.utcnow(), need_id, check_device, incident)
+        if self._thread is None or not self._thread.is_alive():
+            # Writer not running (scripts, tests): write inline
+            self._write([item])
+            return item.future
+        self._queue.put(item)
+        return item.future
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "written": self.written, "rejected": self.rejected}
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            self._flush_once(timeout=ALARM_FLUSH_INTERVAL)
+
+    def _flush_once(self, timeout: float = None) -> bool:
+        """Write up to ALARM_FLUSH_BATCH queued alarms. Returns False when nothing was queued."""
+        try:
+            first = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+        except queue.Empty:
+            return False
+        batch = [first]
+        while len(batch) < ALARM_FLUSH_BATCH:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._write(batch)
+        return True
+
+    def _write(self, batch):
+        db = SessionLocal()
+        try:
+            # Unchecked ids are looked up too: known ones get their department for alarm events
+            devices, fences = alarm_refs.resolve(
+                db, [i.alarm.device_id for i in batch], [i.alarm.fence_id for i in batch]
+            )
+            valid = []
+            for item in batch:
+                alarm = item.alarm
+                if item.check_device and str(alarm.device_id) not in devices:
+                    self._reject(item, f"Device not found: {alarm.device_id}")
+                elif alarm.fence_id is not None and alarm.fence_id not in fences:
+                    self._reject(item, f"Fence not found: {alarm.fence_id}")
+                else:
+                    valid.append((item, self._row(item, fences)))
+            if not valid:
+                return
+
+            try:
+                self._insert(db, valid)
+                self._roll_up(db, valid)
+                db.commit()
+            except IntegrityError:
+                # A duplicate pending fence alarm in the batch: isolate it row by row
+                db.rollback()
+                self._insert_one_by_one(db, valid)
+                self._roll_up(db, valid)
+                db.commit()
+            self._resolve(valid)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Alarm flush of {len(batch)} alarms failed: {e}")
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+        finally:
+            db.close()
+            for item in batch:
+                if item.incident is not None and item.future.done() and item.future.exception() is not None:
+                    alarm_correlator.abandon(item.incident)
+
+    def _row(self, item: _QueuedAlarm, fences: dict) -> dict:
+        alarm = item.alarm
+        location = alarm.location
+        if alarm.fence_id is not None:
+            # Same location format as AlarmService.create_alarm
+            location = f"{fences[alarm.fence_id]} {alarm.location}"
+        return {
+            "device_id": str(alarm.device_id),
+            "fence_id": alarm.fence_id,
+            "department_id": alarm_refs.department_of(alarm.device_id),
+            "alarm_type": alarm.alarm_type,
+            "severity": alarm.severity,
+            "description": alarm.description,
+            "location": location,
+            "status": alarm.status,
+            "timestamp": item.timestamp,
+            "recording_path": item.recording_path,
+            "pending_key": pending_key(alarm.device_id, alarm.fence_id, alarm.status),
+        }
+
+    def _insert(self, db, valid):
+        # Incident parents need their id too: absorbed occurrences are counted on it
+        bulk = [row for item, row in valid if not item.need_id and item.incident is None]
+        if bulk:
+            db.execute(insert(AlarmRecord), bulk)
+        records = [(item, AlarmRecord(**row)) for item, row in valid if item.need_id or item.incident is not None]
+        if records:
+            db.add_all([record for _, record in records])
+            db.flush()
+            for item, record in records:
+                item.alarm_id = record.id
+
+    def _insert_one_by_one(self, db, valid):
+        for item, row in valid:
+            try:
+                with db.begin_nested():
+                    record = AlarmRecord(**row)
+                    db.add(record)
+                item.alarm_id = record.id
+            except IntegrityError:
+                pending_fence_alarms.add(row["device_id"], row["fence_id"])
+                self.rejected += 1
+                item.future.set_exception(HTTPException(
+                    status_code=409,
+                    detail=f"Pending alarm already exists for device {row['device_id']} and fence {row['fence_id']}",
+                ))
+
+    def _roll_up(self, db, valid):
+        alarm_rollups.alarms_created(db, [row for item, row in valid if not item.future.done()])
+
+    def _resolve(self, valid):
+        written = [(item, row) for item, row in valid if not item.future.done()]
+        dashboard_counters.alarms_added([item.timestamp for item, _ in written])
+        alarm_events.publish([
+            (alarm_payload({**row, "id": item.alarm_id}), row["department_id"])
+            for item, row in written
+        ])
+        for item, row in valid:
+            if item.future.done():
+                continue
+            if row["pending_key"] is not None:
+                pending_fence_alarms.add(row["device_id"], row["fence_id"])
+            self.written += 1
+            alarm_correlator.attach(item.incident, item.alarm_id)
+            item.future.set_result(item.alarm_id if item.need_id else None)
+
+    def _reject(self, item: _QueuedAlarm, detail: str):
+        self.rejected += 1
+        logger.warning(f"Dropped alarm: {detail}")
+        item.future.set_exception(HTTPException(status_code=400, detail=detail))
+
+
+alarm_writer = AlarmWriter()
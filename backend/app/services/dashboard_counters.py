@@ -0,0 +1,118 @@
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.models.alarm_records import AlarmRecord
+from app.models.device import Device
+from app.models.fence import ElectronicFence
+from app.utils.logger import get_logger
+
+logger = get_logger("DashboardCounters")
+
+# Recount from the DB every N seconds, correcting drift (rolled-back alarms, rows written by other processes)
+DASHBOARD_RECONCILE_SECONDS = int(os.getenv("DASHBOARD_RECONCILE_SECONDS", 300))
+
+
+class DashboardCounters:
+    """
+    Device, fence and today's-alarm counts for the dashboard summary, kept in memory.
+    Create / delete paths adjust them as they commit, a background thread
+    reconciles them against the DB periodically, and the alarm count rolls over
+    to 0 at local midnight. "Today" is the same as the previous
+    DATE(timestamp) = CURDATE() query: the timestamp's calendar date.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.devices = 0
+        self.fences = 0
+        self.alarms_today = 0
+        self._day = None  # date alarms_today counts; None until the first reconcile
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="dashboard-counters", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            db = SessionLocal()
+            try:
+                self.reconcile(db)
+            except Exception as e:
+                logger.error(f"Dashboard counter reconcile failed: {e}")
+            finally:
+                db.close()
+            # Wake at midnight too, so the first poll of the day is already exact
+            tomorrow = datetime.combine(date.today() + timedelta(days=1), time.min)
+            wait = min(DASHBOARD_RECONCILE_SECONDS, (tomorrow - datetime.now()).total_seconds() + 1)
+            self._stop_event.wait(max(1.0, wait))
+
+    def reconcile(self, db: Session):
+        today = date.today()
+        start = datetime.combine(today, time.min)
+        devices = db.query(func.count(Device.id)).scalar() or 0
+        fences = db.query(func.count(ElectronicFence.id)).scalar() or 0
+        # Range on the raw column (not DATE(timestamp)), so it is an index range scan
+        alarms = db.query(func.count(AlarmRecord.id)).filter(
+            AlarmRecord.timestamp >= start, AlarmRecord.timestamp < start + timedelta(days=1)
+        ).scalar() or 0
+        with self._lock:
+            self.devices, self.fences, self.alarms_today = devices, fences, alarms
+            self._day = today
+
+    def summary(self, db: Session) -> dict:
+        if self._day is None:
+            self.reconcile(db)
+        with self._lock:
+            self._roll_over()
+            return {
+                "fenceCount": self.fences,
+                "alarmCount": self.alarms_today,
+                "deviceCount": self.devices,
+            }
+
+    def _roll_over(self):
+        today = date.today()
+        if self._day is not None and self._day != today:
+            self.alarms_today = 0
+            self._day = today
+
+    def device_added(self):
+        with self._lock:
+            self.devices += 1
+
+    def device_removed(self):
+        with self._lock:
+            self.devices = max(0, self.devices - 1)
+
+    def fence_added(self):
+        with self._lock:
+            self.fences += 1
+
+    def fence_removed(self):
+        with self._lock:
+            self.fences = max(0, self.fences - 1)
+
+    def alarms_added(self, timestamps):
+        with self._lock:
+            self._roll_over()
+            self.alarms_today += sum(1 for ts in timestamps if ts is not None and ts.date() == self._day)
+
+    def alarm_removed(self, timestamp):
+        with self._lock:
+            self._roll_over()
+            if timestamp is not None and timestamp.date() == self._day:
+                self.alarms_today = max(0, self.alarms_today - 1)
+
+
+dashboard_counters = DashboardCounters()
@@ -0,0 +1,332 @@
+import os
+import numpy as np
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+from app.core.monthly_tables import months_between
+from app.models.device_position import device_positions
+from app.models.fence import ElectronicFence
+from app.schemas.alarm_schema import AlarmCreate
+from app.schemas.fence_schema import FenceCreate
+from app.services.alarm_correlation import alarm_correlator
+from app.services.fence_cache import fence_cache
+from app.services.fence_debounce import FenceDebouncer
+from app.services.fence_service import FenceService
+from app.utils.logger import get_logger
+
+logger = get_logger("FenceBacktest")
+
+# Position rows evaluated per vectorized chunk
+BACKTEST_CHUNK_ROWS = int(os.getenv("BACKTEST_CHUNK_ROWS", 200000))
+
+
+class _DeviceTally:
+    __slots__ = (
+        "points", "violating_points", "crossings", "alarms", "violation_seconds",
+        "first_violation", "last_violation", "last_ts", "last_violating",
+    )
+
+    def __init__(self):
+        self.points = 0
+        self.violating_points = 0
+        self.crossings = 0
+        self.alarms = 0
+        self.violation_seconds = 0.0
+        self.first_violation = None  # epoch microseconds
+        self.last_violation = None
+        self.last_ts = None
+        self.last_violating = False
+
+
+class _AlarmEstimate:
+    """
+    Alarm rows the live path would write for the replayed violations.
+    _raise_fence_alarm runs on every violating ping, but skips a device with a
+    pending alarm for the fence or covered by another device's (AlarmCorrelator.covers),
+    and alarm_correlator folds crossings matching a rule into the incident opened by
+    the first one. Nobody resolves alarms during a replay, so a device raises at
+    most once per opening of the effective-time window, whose closing resolves
+    the fence's alarms (apply_window_boundary).
+    """
+
+    def __init__(self, fence_service, fence, compiled):
+        self.window = compiled.window
+        alarm_type, severity = fence_service._fence_alarm_kind(fence)
+        self.alarm = {
+            # A draft has no id yet; any id makes it match the fence rules as a saved fence would
+            "fence_id": fence.id if fence.id is not None else 0,
+            "alarm_type": alarm_type, "severity": severity, "description": "", "status": "pending",
+        }
+        self.alarmed = {}  # device_id -> window opening it has a pending / covered alarm in
+        self.incidents = {}  # rule key -> (window opening, last occurrence in epoch microseconds)
+        self.absorbed = 0
+
+    def feed(self, tallies: dict, ids, ts, violating):
+        """Fold the violating points of one time-ordered chunk (after _tally created the devices)."""
+        idx = np.flatnonzero(violating)
+        if idx.size == 0:
+            return
+        periods = _window_periods(self.window, ts[idx])
+        us = ts[idx].astype(np.int64)
+        # Only a device's first violating point in a window opening can raise
+        _, codes = np.unique(ids[idx], return_inverse=True)
+        span = int(periods.max() - periods.min()) + 1
+        _, first = np.unique(codes.astype(np.int64) * span + (periods - periods.min()), return_index=True)
+        for j in np.sort(first).tolist():
+            device_id, period, at = ids[idx[j]], int(periods[j]), int(us[j])
+            if self.alarmed.get(device_id) == period:
+                continue
+            self.alarmed[device_id] = period
+            key, window = alarm_correlator._rule_key(AlarmCreate(device_id=str(device_id), **self.alarm))
+            incident = self.incidents.get(key) if key is not None else None
+            if key is not None:
+                self.incidents[key] = (period, at)
+            # Same sliding window as AlarmCorrelator.correlate
+            if incident is not None and incident[0] == period and at - incident[1] <= window * 1000000:
+                self.absorbed += 1
+            else:
+                tallies[device_id].alarms += 1
+
+
+class _EdgeReplay:
+    """
+    Debounced inside state of replayed points, through the same FenceDebouncer.settle
+    the live pings go through (_ping_violation), on a private debouncer so the live
+    states are never touched. Every opening of the effective-time window starts with
+    fresh states, as apply_window_boundary drops them; a device's first point in it
+    is taken as is, the side the boundary recount would have counted it on.
+    """
+
+    def __init__(self, fence_service, compiled):
+        self.fence_service = fence_service
+        self.compiled = compiled
+        self.debouncer = FenceDebouncer()
+        self.period = None
+
+    def settle(self, ids, lats, lngs, ts, in_window, raw_inside) -> np.ndarray:
+        """Debounced inside mask of one time-ordered chunk; points outside the window keep their raw state."""
+        compiled = self.compiled
+        inside = raw_inside.copy()
+        periods = _window_periods(compiled.window, ts)
+        stamps = ts.tolist()
+        for i in np.flatnonzero(in_window).tolist():
+            period = int(periods[i])
+            if period != self.period:
+                if self.period is not None:
+                    self.debouncer.drop_fence(self.period)
+                self.period = period
+            raw = bool(raw_inside[i])
+            edge_distance = 0.0
+            if compiled.edge_buffer:
+                edge_distance = self.fence_service._edge_distance(compiled, float(lats[i]), float(lngs[i]))
+            inside[i] = self.debouncer.settle(
+                period, ids[i], raw, edge_distance,
+                compiled.edge_buffer, compiled.dwell_seconds, stamps[i], seed_inside=raw,
+            )
+        return inside
+
+
+class FenceBacktester:
+    """
+    Replays stored position history (device_positions_YYYYMM) through a fence in
+    time order, without writing alarm rows. Uses the vectorized recount logic of
+    FenceService, so a point violates exactly when check_device_violation would
+    say so, gated by the fence's effective-time window at the point's timestamp.
+    Fences with edge_buffer / dwell_seconds debounce each device's points like
+    live pings (_EdgeReplay). Draft fences are compiled for the run only.
+    A crossing is one entry into violation: each device's first violating point,
+    and every violating point after a non-violating one. The alarm count is an
+    estimate of the rows those crossings would write (_AlarmEstimate).
+    """
+
+    def __init__(self):
+        self.fence_service = FenceService()
+
+    def draft_fence(self, fence_data: FenceCreate) -> ElectronicFence:
+        """Unsaved fence built from a FenceCreate, for testing a fence before drawing it for real."""
+        if fence_data.shape == "circle" and not fence_data.radius:
+            raise HTTPException(status_code=400, detail="Radius is required for circular fences")
+        return ElectronicFence(
+            name=fence_data.name,
+            project_region_id=fence_data.project_region_id,
+            shape=fence_data.shape,
+            behavior=fence_data.behavior,
+            coordinates_json=fence_data.coordinates_json,
+            radius=fence_data.radius,
+            edge_buffer=fence_data.edge_buffer or 0,
+            dwell_seconds=fence_data.dwell_seconds or 0,
+            effective_time=fence_data.effective_time,
+            alarm_type=fence_data.alarm_type,
+            is_active=1,
+        )
+
+    def run(self, db: Session, fence: ElectronicFence, start: datetime, end: datetime,
+            device_ids: list[str] = None) -> dict:
+        if end < start:
+            raise HTTPException(status_code=400, detail="end must not be before start")
+
+        # Drafts have no id and are never cached
+        compiled = fence_cache.get_fence(fence)
+        replay = None
+        if compiled.edge_buffer or compiled.dwell_seconds:
+            replay = _EdgeReplay(self.fence_service, compiled)
+        estimate = _AlarmEstimate(self.fence_service, fence, compiled)
+        tallies = {}
+        points = 0
+        for ids, lats, lngs, ts in self._chunks(db, start, end, device_ids):
+            points += len(ids)
+            if fence.is_active:
+                in_window = self._window_mask(compiled.window, ts)
+                inside = self.fence_service._inside_fence_mask(fence, lats, lngs, compiled)
+                if replay is not None:
+                    inside = replay.settle(ids, lats, lngs, ts, in_window, inside)
+                violating = self.fence_service._violation_mask(db, fence, lats, lngs, inside)
+                violating &= in_window
+            else:
+                violating = np.zeros(len(ids), dtype=bool)
+            self._tally(tallies, ids, ts, violating)
+            estimate.feed(tallies, ids, ts, violating)
+
+        summaries = [
+            {
+                "device_id": device_id,
+                "points": t.points,
+                "violating_points": t.violating_points,
+                "crossings": t.crossings,
+                "alarms": t.alarms,
+                "violation_seconds": round(t.violation_seconds, 3),
+                "first_violation": _from_us(t.first_violation),
+                "last_violation": _from_us(t.last_violation),
+            }
+            for device_id, t in sorted(tallies.items())
+        ]
+        firsts = [t.first_violation for t in tallies.values() if t.first_violation is not None]
+        logger.info(f"Backtested fence {fence.name}: {points} points, {len(tallies)} devices")
+        return {
+            "fence_id": fence.id,
+            "start": start,
+            "end": end,
+            "points": points,
+            "devices": len(tallies),
+            "violating_devices": sum(1 for t in tallies.values() if t.violating_points),
+            "crossings": sum(t.crossings for t in tallies.values()),
+            "alarms": sum(t.alarms for t in tallies.values()),
+            "correlated": estimate.absorbed,
+            "first_violation": _from_us(min(firsts)) if firsts else None,
+            "device_summaries": summaries,
+        }
+
+    def _chunks(self, db: Session, start: datetime, end: datetime, device_ids):
+        """
+        Stream positions with start <= ts <= end in time order, BACKTEST_CHUNK_ROWS at a time.
+        Yields (device ids, lats, lngs, timestamps as datetime64[us]).
+        """
+        for table in device_positions.existing_tables(months_between(start, end)):
+            stmt = (
+                select(table.c.device_id, table.c.latitude, table.c.longitude, table.c.ts)
+                .where(table.c.ts >= start, table.c.ts <= end)
+                .order_by(table.c.ts, table.c.id)
+                .execution_options(stream_results=True, yield_per=BACKTEST_CHUNK_ROWS)
+            )
+            if device_ids:
+                stmt = stmt.where(table.c.device_id.in_(device_ids))
+            for rows in db.execute(stmt).partitions():
+                ids, lats, lngs, ts = zip(*rows)
+                yield (
+                    np.array(ids, dtype=object),
+                    np.array(lats, dtype=np.float64),
+                    np.array(lngs, dtype=np.float64),
+                    np.array(ts, dtype="datetime64[us]"),
+                )
+
+    def _window_mask(self, window, ts) -> np.ndarray:
+        """Vectorized effective-time check: same closed [start, end] window as window_state."""
+        if window is None:
+            return np.ones(ts.shape, dtype=bool)
+        tod = _time_of_day_us(ts)
+        start_us, end_us = _window_us(window)
+        if start_us <= end_us:
+            return (tod >= start_us) & (tod <= end_us)
+        # Overnight range
+        return (tod >= start_us) | (tod <= end_us)
+
+    def _tally(self, tallies: dict, ids, ts, violating):
+        """Fold one time-ordered chunk into the per-device tallies, continuing each device's previous state."""
+        uniq, inv = np.unique(ids, return_inverse=True)
+        us = ts.astype(np.int64)
+        # Group by device, keeping time order inside each group
+        order = np.lexsort((np.arange(len(ids)), inv))
+        inv, us, violating = inv[order], us[order], violating[order]
+        starts = np.flatnonzero(np.r_[True, inv[1:] != inv[:-1]])
+
+        prev_violating = np.r_[False, violating[:-1]]
+        prev_us = np.r_[0, us[:-1]]
+        has_prev = np.ones(len(us), dtype=bool)
+        groups = uniq[inv[starts]]
+        for k, device_id in enumerate(groups):
+            tally = tallies.get(device_id)
+            if tally is None:
+                tally = tallies[device_id] = _DeviceTally()
+            g = starts[k]
+            prev_violating[g] = tally.last_violating
+            if tally.last_ts is None:
+                has_prev[g] = False
+            else:
+                prev_us[g] = tally.last_ts
+
+        entries = violating & ~prev_violating
+        held = np.where(prev_violating & has_prev, us - prev_us, 0)
+        viol_us = np.where(violating, us, np.iinfo(np.int64).max)
+
+        counts = np.diff(np.r_[starts, len(us)])
+        violating_counts = np.add.reduceat(violating.astype(np.int64), starts)
+        entry_counts = np.add.reduceat(entries.astype(np.int64), starts)
+        held_us = np.add.reduceat(held, starts)
+        first_us = np.minimum.reduceat(viol_us, starts)
+        last_us = np.maximum.reduceat(np.where(violating, us, np.iinfo(np.int64).min), starts)
+        ends = np.r_[starts[1:], len(us)] - 1
+
+        for k, device_id in enumerate(groups):
+            tally = tallies[device_id]
+            tally.points += int(counts[k])
+            tally.crossings += int(entry_counts[k])
+            tally.violation_seconds += held_us[k] / 1e6
+            if violating_counts[k]:
+                tally.violating_points += int(violating_counts[k])
+                if tally.first_violation is None:
+                    tally.first_violation = int(first_us[k])
+                tally.last_violation = int(last_us[k])
+            tally.last_ts = int(us[ends[k]])
+            tally.last_violating = bool(violating[ends[k]])
+
+
+def _window_us(window):
+    """(start, end) of an effective-time window in microseconds since midnight."""
+    return tuple(
+        (t.hour * 3600 + t.minute * 60 + t.second) * 1000000 + t.microsecond for t in window
+    )
+
+
+def _time_of_day_us(ts) -> np.ndarray:
+    return (ts - ts.astype("datetime64[D]")).astype(np.int64)
+
+
+def _window_periods(window, ts) -> np.ndarray:
+    """Which opening of the window each timestamp falls in: the day it opened (overnight windows open the day before)."""
+    if window is None:
+        return np.zeros(ts.shape, dtype=np.int64)
+    days = ts.astype("datetime64[D]").astype(np.int64)
+    start_us, end_us = _window_us(window)
+    if start_us > end_us:
+        days = days - (_time_of_day_us(ts) < start_us)
+    return days
+
+
+def _from_us(value):
+    if value is None:
+        return None
+    return np.datetime64(value, "us").astype(datetime)
+
+
+fence_backtester = FenceBacktester()
@@ -0,0 +1,260 @@
+import json
+import math
+import threading
+import time as _time
+from datetime import datetime, time, timedelta
+from app.utils.logger import get_logger
+from app.utils.geo_vector import haversine, polygon_boundary_distance
+from app.utils.prepared_polygon import prepare_polygon
+
+logger = get_logger("FenceCache")
+
+
+def parse_polygon(coordinates_json: str):
+    """
+    Parse '[[lat,lng],...]' or '[{"lat":..,"lng":..},...]' into a list of (lng, lat).
+    Raises on malformed input, the caller decides what a broken polygon means.
+    """
+    poly = []
+    for p in json.loads(coordinates_json):
+        if isinstance(p, list) and len(p) >= 2:
+            poly.append((float(p[1]), float(p[0])))
+        elif isinstance(p, dict):
+            poly.append((float(p.get("lng")), float(p.get("lat"))))
+    return poly
+
+
+def parse_circle_center(coordinates_json: str):
+    """Parse '[lat,lng]' or '{"lat":..,"lng":..}' into (lat, lng)."""
+    center = json.loads(coordinates_json)
+    if isinstance(center, list) and len(center) >= 2:
+        return float(center[0]), float(center[1])
+    if isinstance(center, dict):
+        return float(center.get("lat", 0)), float(center.get("lng", 0))
+    return 0.0, 0.0
+
+
+def parse_time_str(time_str: str) -> time:
+    """Parse 'HH:mm' or 'HH.mm' style strings."""
+    ts = time_str.strip().replace('.', ':')
+    parts = ts.split(':')
+    h = int(parts[0])
+    m = int(parts[1]) if len(parts) > 1 else 0
+    return time(h, m)
+
+
+def parse_effective_time(effective_time: str):
+    """
+    Parse '5.00-23.00' into (start, end).
+    Returns None when the fence is always active (empty / no range given).
+    """
+    if not effective_time or '-' not in effective_time:
+        return None
+    start_str, end_str = effective_time.split('-')
+    return parse_time_str(start_str), parse_time_str(end_str)
+
+
+def window_state(window, now: datetime):
+    """
+    (active, next_boundary) of an effective-time window at `now`.
+    The window is closed, [start, end], overnight when start > end;
+    next_boundary is the epoch second at which `active` can next change.
+    """
+    start_t, end_t = window
+    t = now.time()
+    if start_t <= end_t:
+        active = start_t <= t <= end_t
+    else: # Overnight range
+        active = t >= start_t or t <= end_t
+
+    boundaries = []
+    for day in (now.date(), now.date() + timedelta(days=1)):
+        boundaries.append(datetime.combine(day, start_t))
+        # Still active at exactly `end`, inactive right after
+        boundaries.append(datetime.combine(day, end_t) + timedelta(microseconds=1))
+    next_boundary = min(b for b in boundaries if b > now)
+    return active, next_boundary.timestamp()
+
+
+def polygon_bbox(poly):
+    """(min_lng, min_lat, max_lng, max_lat) of a (lng, lat) point list."""
+    lngs = [p[0] for p in poly]
+    lats = [p[1] for p in poly]
+    return min(lngs), min(lats), max(lngs), max(lats)
+
+
+def circle_bbox(center_lat: float, center_lng: float, radius: float):
+    """Conservative (min_lng, min_lat, max_lng, max_lat) around a haversine circle."""
+    half = radius / (2 * 6371000)
+    # Great-circle distance is never shorter than the latitude difference
+    dlat = math.degrees(2 * half)
+    # sin(d/2) >= cos(lat_max) * sin(dlng/2), with lat_max the most poleward latitude of the box
+    max_abs_lat = abs(center_lat) + dlat
+    ratio = math.sin(half) / math.cos(math.radians(max_abs_lat)) if max_abs_lat < 90 else 2
+    dlng = 180.0 if ratio >= 1 else math.degrees(2 * math.asin(ratio))
+    # Small margin against rounding differences with the haversine test
+    dlat += 1e-9
+    dlng += 1e-9
+    return center_lng - dlng, center_lat - dlat, center_lng + dlng, center_lat + dlat
+
+
+class CompiledRegion:
+    """Pre-parsed ProjectRegion geometry; prepared: PreparedPolygon for large outlines."""
+    __slots__ = ("id", "source", "polygon", "bbox", "prepared")
+
+    def __init__(self, region):
+        self.id = region.id
+        self.source = region.coordinates_json
+        self.polygon = None
+        self.bbox = None
+        self.prepared = None
+        try:
+            self.polygon = parse_polygon(region.coordinates_json)
+            if self.polygon:
+                self.bbox = polygon_bbox(self.polygon)
+                self.prepared = prepare_polygon(self.polygon)
+        except Exception:
+            self.polygon = None
+            self.prepared = None
+
+
+class CompiledFence:
+    """
+    Pre-parsed ElectronicFence geometry and effective time window.
+    polygon: list of (lng, lat); center: (lat, lng); window: (start, end) or None
+    """
+    __slots__ = (
+        "id", "source", "shape", "behavior", "project_region_id",
+        "polygon", "prepared", "center", "radius", "bbox", "window",
+        "window_active", "next_boundary", "edge_buffer", "dwell_seconds", "warning_distance",
+    )
+
+    def __init__(self, fence):
+        self.id = fence.id
+        self.source = _fence_source(fence)
+        shape = fence.shape
+        self.shape = shape.value if hasattr(shape, "value") else shape
+        self.behavior = fence.behavior
+        self.project_region_id = fence.project_region_id
+        self.polygon = None
+        self.prepared = None
+        self.center = None
+        self.radius = fence.radius or 0
+        self.edge_buffer = fence.edge_buffer or 0
+        self.dwell_seconds = fence.dwell_seconds or 0
+        self.warning_distance = fence.warning_distance or 0
+        self.bbox = None
+        self.window = None
+        # Cached window state, valid until next_boundary (epoch seconds)
+        self.window_active = True
+        self.next_boundary = 0.0
+
+        try:
+            if self.shape == "circle":
+                self.center = parse_circle_center(fence.coordinates_json)
+                self.bbox = circle_bbox(self.center[0], self.center[1], self.radius)
+            elif self.shape == "polygon":
+                self.polygon = parse_polygon(fence.coordinates_json)
+                if self.polygon:
+                    self.bbox = polygon_bbox(self.polygon)
+                    self.prepared = prepare_polygon(self.polygon)
+        except Exception:
+            self.polygon = None
+            self.prepared = None
+            self.center = None
+            self.bbox = None
+
+        try:
+            self.window = parse_effective_time(fence.effective_time)
+        except Exception as e:
+            # Same behaviour as before: an unparsable window means always active
+            logger.error(f"Error parsing effective_time of fence {fence.id}: {e}")
+            self.window = None
+
+    def active_now(self) -> bool:
+        """Whether the effective time window is open; recomputed only after a boundary passes."""
+        if self.window is None:
+            return True
+        if _time.time() >= self.next_boundary:
+            self.window_active, self.next_boundary = window_state(self.window, datetime.now())
+        return self.window_active
+
+
+def _fence_source(fence):
+    """Everything CompiledFence is derived from; a mismatch means the entry is stale."""
+    return (
+        fence.shape, fence.behavior, fence.project_region_id,
+        fence.coordinates_json, fence.radius, fence.effective_time,
+        fence.edge_buffer, fence.dwell_seconds, fence.warning_distance,
+    )
+
+
+def boundary_distance(compiled, lat: float, lng: float, max_distance: float = math.inf) -> float:
+    """
+    Meters from a point to a compiled fence's boundary (inf for broken geometry).
+    Exact up to max_distance; beyond it large polygons may only report "farther".
+    """
+    if compiled.shape == "circle" and compiled.center is not None:
+        center_lat, center_lng = compiled.center
+        return abs(haversine(lat, lng, center_lat, center_lng) - compiled.radius)
+    if compiled.shape == "polygon" and compiled.polygon:
+        if compiled.prepared is not None:
+            return compiled.prepared.boundary_distance(lng, lat, max_distance)
+        return polygon_boundary_distance(lng, lat, compiled.polygon)
+    return math.inf
+
+
+class FenceGeometryCache:
+    """
+    Process-wide cache of compiled fences / regions keyed by id.
+    Entries are dropped by the FenceService CRUD methods, and are additionally
+    checked against the raw columns so rows edited outside this process never
+    serve stale geometry.
+    """
+
+    def __init__(self):
+        self._fences = {}
+        self._regions = {}
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so derived structures know when to rebuild
+        self.version = 0
+
+    def get_fence(self, fence) -> CompiledFence:
+        if fence.id is None:
+            # Unsaved draft (fence backtest): compiled for the caller only, never cached
+            return CompiledFence(fence)
+        compiled = self._fences.get(fence.id)
+        if compiled is None or compiled.source != _fence_source(fence):
+            compiled = CompiledFence(fence)
+            with self._lock:
+                self._fences[fence.id] = compiled
+        return compiled
+
+    def get_region(self, region) -> CompiledRegion:
+        compiled = self._regions.get(region.id)
+        if compiled is None or compiled.source != region.coordinates_json:
+            compiled = CompiledRegion(region)
+            with self._lock:
+                self._regions[region.id] = compiled
+        return compiled
+
+    def invalidate_fence(self, fence_id: int = None):
+        """Drop one fence, or every fence when fence_id is None."""
+        with self._lock:
+            if fence_id is None:
+                self._fences.clear()
+            else:
+                self._fences.pop(fence_id, None)
+            self.version += 1
+
+    def invalidate_region(self, region_id: int = None):
+        """Drop one region, or every region when region_id is None."""
+        with self._lock:
+            if region_id is None:
+                self._regions.clear()
+            else:
+                self._regions.pop(region_id, None)
+            self.version += 1
+
+
+fence_cache = FenceGeometryCache()
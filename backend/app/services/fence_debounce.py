@@ -0,0 +1,82 @@
+import threading
+from datetime import datetime
+
+
+class _EdgeState:
+    __slots__ = ("inside", "pending_since")
+
+    def __init__(self, inside: bool):
+        self.inside = inside
+        self.pending_since = None
+
+
+class FenceDebouncer:
+    """
+    Per (fence, device) inside/outside state with hysteresis and dwell time.
+    A change is only accepted once the device is more than edge_buffer meters
+    past the boundary and has stayed there for dwell_seconds, so GPS jitter at
+    the edge no longer flips counts and raises alarms on every ping.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}  # fence_id -> {device_id: _EdgeState}
+        self._pending = {}  # device_id -> fence ids with a crossing waiting out its dwell
+
+    def settle(self, fence_id: int, device_id: str, raw_inside: bool, edge_distance: float,
+               edge_buffer: float, dwell_seconds: int, ts: datetime, seed_inside: bool) -> bool:
+        """
+        Debounced inside state for this ping. edge_distance: meters to the fence boundary.
+        seed_inside: state to debounce against on a first sighting, i.e. the side the
+        device is currently counted on, so even the very first crossing needs the buffer and dwell.
+        """
+        with self._lock:
+            states = self._states.setdefault(fence_id, {})
+            state = states.get(device_id)
+            if state is None:
+                state = states[device_id] = _EdgeState(seed_inside)
+
+            if raw_inside == state.inside or edge_distance < edge_buffer:
+                # Unchanged, or still inside the hysteresis band around the edge
+                state.pending_since = None
+            else:
+                if state.pending_since is None:
+                    state.pending_since = ts
+                if (ts - state.pending_since).total_seconds() >= dwell_seconds:
+                    state.inside = raw_inside
+                    state.pending_since = None
+            self._track_pending(fence_id, device_id, state.pending_since is not None)
+            return state.inside
+
+    def _track_pending(self, fence_id: int, device_id: str, pending: bool):
+        fences = self._pending.get(device_id)
+        if pending:
+            if fences is None:
+                fences = self._pending[device_id] = set()
+            fences.add(fence_id)
+        elif fences is not None:
+            fences.discard(fence_id)
+            if not fences:
+                del self._pending[device_id]
+
+    def pending_of(self, device_id: str) -> set:
+        """
+        Fences the device has a crossing pending on. They must see its next ping even
+        outside their trigger area, or the dwell timer would survive the device leaving.
+        """
+        with self._lock:
+            return set(self._pending.get(device_id, ()))
+
+    def devices(self, fence_id: int) -> set:
+        """Devices with a debounced state for the fence."""
+        with self._lock:
+            return set(self._states.get(fence_id, ()))
+
+    def drop_fence(self, fence_id: int):
+        """Forget a fence's states (fence deleted, its geometry / rules edited, or a window boundary)."""
+        with self._lock:
+            for device_id in self._states.pop(fence_id, {}):
+                self._track_pending(fence_id, device_id, False)
+
+
+fence_debouncer = FenceDebouncer()
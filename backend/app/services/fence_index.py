@@ -0,0 +1,180 @@
+import math
+import threading
+import time
+from sqlalchemy.orm import Session
+from app.models.fence import ElectronicFence, ProjectRegion
+from app.services.fence_cache import fence_cache, circle_bbox
+from app.utils.logger import get_logger
+
+try:
+    from rtree import index as rtree_index
+except Exception:
+    rtree_index = None
+
+logger = get_logger("FenceIndex")
+
+# Rebuild at least this often even without local invalidation (rows edited by other processes)
+INDEX_REFRESH_SECONDS = 60
+# Uniform-grid fallback cell size in degrees (~1km)
+GRID_CELL_DEG = 0.01
+# Boxes spanning more cells than this are kept in a flat list instead of the grid
+GRID_MAX_CELLS = 400
+
+
+def trigger_bbox(compiled, region_bbox):
+    """
+    Area in which a device can possibly violate the fence, widened by edge_buffer so
+    a device approaching the edge is already tracked by the debouncer before it crosses.
+    Returns a bbox, "global" when the fence can fire anywhere, or None when it never fires.
+    """
+    if compiled.behavior == "No Exit":
+        if compiled.project_region_id:
+            # Violation requires being inside the region, so the region bbox bounds it
+            return expand_bbox(region_bbox, compiled.edge_buffer)
+        # Outside the fence is everywhere else on the map
+        return "global"
+    return expand_bbox(compiled.bbox, compiled.edge_buffer)
+
+
+def expand_bbox(bbox, meters: float):
+    """bbox grown by at least meters on every side (None stays None)."""
+    if bbox is None or not meters:
+        return bbox
+    min_lng, min_lat, max_lng, max_lat = bbox
+    # Longitude degrees per meter are largest at the more poleward edge
+    lat = max(abs(min_lat), abs(max_lat))
+    margin = circle_bbox(lat, 0.0, meters)
+    dlng, dlat = margin[2], margin[3] - lat
+    return min_lng - dlng, min_lat - dlat, max_lng + dlng, max_lat + dlat
+
+
+class _GridIndex:
+    """Uniform-grid fallback used when the rtree package is unavailable."""
+
+    def __init__(self, entries):
+        self.cells = {}
+        self.large = []
+        for fence_id, bbox in entries:
+            min_x, min_y, max_x, max_y = bbox
+            ix0, iy0 = self._cell(min_x, min_y)
+            ix1, iy1 = self._cell(max_x, max_y)
+            if (ix1 - ix0 + 1) * (iy1 - iy0 + 1) > GRID_MAX_CELLS:
+                self.large.append((fence_id, bbox))
+                continue
+            for ix in range(ix0, ix1 + 1):
+                for iy in range(iy0, iy1 + 1):
+                    self.cells.setdefault((ix, iy), []).append((fence_id, bbox))
+
+    @staticmethod
+    def _cell(x, y):
+        return math.floor(x / GRID_CELL_DEG), math.floor(y / GRID_CELL_DEG)
+
+    def intersection(self, box):
+        min_x, min_y, max_x, max_y = box
+        ix0, iy0 = self._cell(min_x, min_y)
+        ix1, iy1 = self._cell(max_x, max_y)
+        result = set()
+        buckets = [self.large]
+        for ix in range(ix0, ix1 + 1):
+            for iy in range(iy0, iy1 + 1):
+                bucket = self.cells.get((ix, iy))
+                if bucket:
+                    buckets.append(bucket)
+        for bucket in buckets:
+            for fence_id, (bx0, by0, bx1, by1) in bucket:
+                if bx0 <= max_x and min_x <= bx1 and by0 <= max_y and min_y <= by1:
+                    result.add(fence_id)
+        return result
+
+
+class FenceSpatialIndex:
+    """
+    Bounding-box index over active fences.
+    Each fence is indexed by the area in which it can fire ("No Exit" fences by
+    their project region), so a ping only needs the exact test for fences whose
+    box contains it plus the global "No Exit" fences without a region.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (tree, global_ids, shape_tree, warning_reach) swapped as one reference
+        # so readers never see a half-built index
+        self._snapshot = (None, frozenset(), None, 0.0)
+        self._version = None
+        self._built_at = 0.0
+
+    def _is_stale(self):
+        return (
+            self._version != fence_cache.version
+            or time.monotonic() - self._built_at > INDEX_REFRESH_SECONDS
+        )
+
+    def ensure_fresh(self, db: Session):
+        if not self._is_stale():
+            return
+        with self._lock:
+            if self._is_stale():
+                self._build(db)
+
+    def _build(self, db: Session):
+        version = fence_cache.version
+        regions = {r.id: fence_cache.get_region(r).bbox for r in db.query(ProjectRegion).all()}
+        fences = db.query(ElectronicFence).filter(ElectronicFence.is_active == 1).all()
+
+        entries = []
+        shape_entries = []
+        global_ids = set()
+        warning_reach = 0.0
+        for fence in fences:
+            compiled = fence_cache.get_fence(fence)
+            bbox = trigger_bbox(compiled, regions.get(compiled.project_region_id))
+            if bbox == "global":
+                global_ids.add(fence.id)
+            elif bbox is not None:
+                entries.append((fence.id, bbox))
+            if compiled.bbox is not None:
+                shape_entries.append((fence.id, compiled.bbox))
+                if compiled.behavior == "No Entry":
+                    warning_reach = max(warning_reach, compiled.warning_distance)
+
+        self._snapshot = (_make_tree(entries), frozenset(global_ids), _make_tree(shape_entries), warning_reach)
+        self._version = version
+        self._built_at = time.monotonic()
+        logger.info(f"Fence index rebuilt: {len(entries)} boxed, {len(global_ids)} global")
+
+    def query_bbox(self, db: Session, box):
+        """Ids of active fences whose trigger area intersects box (min_lng, min_lat, max_lng, max_lat)."""
+        self.ensure_fresh(db)
+        tree, global_ids, _, _ = self._snapshot
+        result = set(global_ids)
+        if tree is not None:
+            result.update(tree.intersection(box))
+        return result
+
+    def query_point(self, db: Session, lat: float, lng: float):
+        """Ids of active fences a device at (lat, lng) could possibly violate."""
+        return self.query_bbox(db, (lng, lat, lng, lat))
+
+    def query_near(self, db: Session, lat: float, lng: float, distance: float):
+        """Ids of active fences whose own outline may lie within distance meters of (lat, lng)."""
+        self.ensure_fresh(db)
+        shape_tree = self._snapshot[2]
+        if shape_tree is None:
+            return set()
+        return set(shape_tree.intersection(circle_bbox(lat, lng, distance)))
+
+    def warning_reach(self, db: Session) -> float:
+        """Largest warning_distance of any active "No Entry" fence (0: no proximity warnings)."""
+        self.ensure_fresh(db)
+        return self._snapshot[3]
+
+
+def _make_tree(entries):
+    if not entries:
+        return None
+    if rtree_index is not None:
+        return rtree_index.Index(((fid, bbox, None) for fid, bbox in entries))
+    return _GridIndex(entries)
+
+
+fence_index = FenceSpatialIndex()
@@ -0,0 +1,89 @@
+import threading
+
+
+class FenceMembership:
+    """
+    In-memory device x fence violation state behind ElectronicFence.worker_count.
+    A fence is "seeded" by a full recount; afterwards only the pinging device's
+    flips change its violator set, so a ping no longer rescans every device.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._violators = {}  # fence_id -> set(device_id)
+        self._by_device = {}  # device_id -> set(fence_id)
+        self._seeded = {}     # fence_id -> fence active flag at the time of the full recount
+        self._windows = {}    # fence_id -> effective-window state the last boundary was applied for
+
+    def seeded_state(self, fence_id: int):
+        """Active flag the fence was last recounted with, or None if never recounted."""
+        return self._seeded.get(fence_id)
+
+    def reset_fence(self, fence_id: int, device_ids, active: bool):
+        """Replace a fence's violator set with the result of a full recount."""
+        with self._lock:
+            self._drop(fence_id)
+            members = set(device_ids)
+            self._violators[fence_id] = members
+            for device_id in members:
+                self._by_device.setdefault(device_id, set()).add(fence_id)
+            self._seeded[fence_id] = active
+
+    def window_flipped(self, fence_id: int, in_window: bool) -> bool:
+        """
+        Record the fence's effective-window state. True exactly once per flip, for
+        whichever caller (ping batch or scheduler) sees it first; the first call only records.
+        Kept apart from the seeded state, which every recount overwrites.
+        """
+        with self._lock:
+            previous = self._windows.get(fence_id)
+            self._windows[fence_id] = in_window
+            return previous is not None and previous != in_window
+
+    def drop_fence(self, fence_id: int):
+        with self._lock:
+            self._drop(fence_id)
+            self._windows.pop(fence_id, None)
+
+    def _drop(self, fence_id: int):
+        for device_id in self._violators.pop(fence_id, ()):
+            fences = self._by_device.get(device_id)
+            if fences is not None:
+                fences.discard(fence_id)
+                if not fences:
+                    del self._by_device[device_id]
+        self._seeded.pop(fence_id, None)
+
+    def fences_of(self, device_id: str):
+        """Fences the device is currently counted as violating."""
+        with self._lock:
+            return set(self._by_device.get(device_id, ()))
+
+    def set_violation(self, fence_id: int, device_id: str, violating: bool) -> bool:
+        """Record the device's state for one fence. Returns True if it flipped."""
+        with self._lock:
+            members = self._violators.setdefault(fence_id, set())
+            if violating == (device_id in members):
+                return False
+            if violating:
+                members.add(device_id)
+                self._by_device.setdefault(device_id, set()).add(fence_id)
+            else:
+                members.discard(device_id)
+                fences = self._by_device.get(device_id)
+                if fences is not None:
+                    fences.discard(fence_id)
+                    if not fences:
+                        del self._by_device[device_id]
+            return True
+
+    def members(self, fence_id: int) -> set:
+        """Devices currently counted as violating the fence."""
+        with self._lock:
+            return set(self._violators.get(fence_id, ()))
+
+    def count(self, fence_id: int) -> int:
+        return len(self._violators.get(fence_id, ()))
+
+
+fence_membership = FenceMembership()
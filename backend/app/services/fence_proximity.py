@@ -0,0 +1,42 @@
+import threading
+
+
+class FenceProximity:
+    """
+    (fence, device) pairs currently inside a fence's warning band.
+    A warning is only raised when a device enters the band, not on every ping inside it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_device = {}  # device_id -> set(fence_id)
+
+    def fences_of(self, device_id: str):
+        """Fences whose warning band the device was last seen in."""
+        with self._lock:
+            return set(self._by_device.get(device_id, ()))
+
+    def update(self, fence_id: int, device_id: str, close: bool) -> bool:
+        """Record whether the device is in the fence's warning band. Returns True if that changed."""
+        with self._lock:
+            fences = self._by_device.get(device_id)
+            if close == (fences is not None and fence_id in fences):
+                return False
+            if close:
+                self._by_device.setdefault(device_id, set()).add(fence_id)
+            else:
+                fences.discard(fence_id)
+                if not fences:
+                    del self._by_device[device_id]
+            return True
+
+    def drop_fence(self, fence_id: int):
+        with self._lock:
+            for device_id in list(self._by_device):
+                fences = self._by_device[device_id]
+                fences.discard(fence_id)
+                if not fences:
+                    del self._by_device[device_id]
+
+
+fence_proximity = FenceProximity()
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from app.core.database import SessionLocal
+from app.models.fence import ElectronicFence
+from app.services.fence_cache import fence_cache
+from app.services.fence_service import FenceService
+from app.services.alarm_service import pending_fence_alarms
+from app.utils.logger import get_logger
+
+logger = get_logger("FenceScheduler")
+
+# Full worker_count reconciliation interval in seconds
+FENCE_RECOUNT_INTERVAL = int(os.getenv("FENCE_RECOUNT_INTERVAL", 600))
+# Max sleep between boundary plans, so created / edited fences are picked up
+FENCE_PLAN_INTERVAL = 30
+
+
+class FenceScheduler:
+    """
+    Background thread for fence work that must not run on the ping path.
+    - Sleeps until the next effective-time boundary of any fence, then
+      recounts that fence and raises / clears its alarms exactly once.
+    - Periodically re-seeds every fence's violator set with a full recount and
+      reloads the pending-alarm set, so drift in the in-memory state is
+      corrected on a schedule.
+    """
+
+    def __init__(self):
+        self.fence_service = FenceService()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="fence-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _loop(self):
+        next_recount = 0.0
+        while not self._stop_event.is_set():
+            # Boundaries first: a recount must not reseed a fence before its boundary is applied
+            next_boundary = self._apply_boundaries()
+            # Seed immediately so the first pings after startup are already incremental
+            if time.time() >= next_recount:
+                self._recount()
+                next_recount = time.time() + FENCE_RECOUNT_INTERVAL
+
+            wake_at = min(next_recount, time.time() + FENCE_PLAN_INTERVAL)
+            if next_boundary is not None:
+                wake_at = min(wake_at, next_boundary)
+            self._stop_event.wait(max(0.0, wake_at - time.time()))
+
+    def _recount(self):
+        db = SessionLocal()
+        try:
+            pending_fence_alarms.load(db)
+            self.fence_service.recount_all_fences(db)
+        except Exception as e:
+            logger.error(f"Scheduled fence recount failed: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _apply_boundaries(self):
+        """
+        Handle every fence whose window flipped since its last boundary was applied.
+        Returns the earliest upcoming boundary (epoch seconds), or None.
+        """
+        db = SessionLocal()
+        next_boundary = None
+        try:
+            fences = db.query(ElectronicFence).filter(ElectronicFence.is_active == 1).all()
+            for fence in fences:
+                compiled = fence_cache.get_fence(fence)
+                if compiled.window is None:
+                    continue
+                flipped, active = self.fence_service.window_flip(fence)
+                if flipped:
+                    self.fence_service.apply_window_boundary(db, fence, active)
+                if next_boundary is None or compiled.next_boundary < next_boundary:
+                    next_boundary = compiled.next_boundary
+        except Exception as e:
+            logger.error(f"Fence window boundary handling failed: {e}")
+            db.rollback()
+        finally:
+            db.close()
+        return next_boundary
+
+
+fence_scheduler = FenceScheduler()
@@ -1,17 +1,54 @@
 import json
-import math
+import os
+import numpy as np
 from datetime import datetime, time
+from types import SimpleNamespace
+from sqlalchemy import bindparam, update
 from sqlalchemy.orm import Session
 from app.models.fence import ElectronicFence, ProjectRegion
 from app.models.device import Device
-from app.schemas.fence_schema import FenceCreate, FenceUpdate, ProjectRegionCreate, ProjectRegionUpdate
+from app.schemas.fence_schema import (
+    FenceCreate, FenceUpdate, ProjectRegionCreate, ProjectRegionUpdate, LocationPing
+)
 from app.schemas.alarm_schema import AlarmCreate
-from app.services.alarm_service import AlarmService
+from fastapi import HTTPException
+from app.services.alarm_service import AlarmService, alarm_refs, pending_fence_alarms
+from app.services.alarm_correlation import alarm_correlator
+from app.services.alarm_rollup import alarm_rollups, alarm_key, KEY_SOURCE_FIELDS
 from app.utils.logger import get_logger
 from app.models.alarm_records import AlarmRecord
+from app.services.fence_cache import fence_cache, boundary_distance, parse_polygon, parse_time_str
+from app.services.fence_index import fence_index, trigger_bbox
+from app.services.fence_membership import fence_membership
+from app.services.fence_debounce import fence_debouncer
+from app.services.position_history import position_history
+from app.services.fence_shards import fence_shards
+from app.services.fence_proximity import fence_proximity
+from app.services.dashboard_counters import dashboard_counters
+from app.utils.geo_vector import haversine, points_in_circle, points_in_polygon
+from app.utils.prepared_polygon import simplify_polygon
 
 logger = get_logger("FenceService")
 
+# Douglas-Peucker tolerance in meters applied to polygon outlines on save, 0 disables
+FENCE_SIMPLIFY_TOLERANCE = float(os.getenv("FENCE_SIMPLIFY_TOLERANCE", 0))
+
+# Fence columns that decide which devices violate it; edits to anything else skip re-evaluation
+VIOLATION_FIELDS = frozenset({
+    "shape", "behavior", "project_region_id", "coordinates_json", "radius", "effective_time", "is_active",
+})
+
+
+class _PingPosition:
+    """Device stand-in carrying one ping's coordinates, so evaluation never dirties the ORM row."""
+    __slots__ = ("id", "device_name", "last_latitude", "last_longitude")
+
+    def __init__(self, device: Device, lat: float, lng: float):
+        self.id = device.id
+        self.device_name = device.device_name
+        self.last_latitude = lat
+        self.last_longitude = lng
+
 
 class FenceService:
     # --- Project Region CRUD ---
@@ -19,12 +56,13 @@ class FenceService:
         logger.info(f"Creating new project region: {region_data.name}")
         new_region = ProjectRegion(
             name=region_data.name,
-            coordinates_json=region_data.coordinates_json,
+            coordinates_json=self._simplify_coordinates(region_data.coordinates_json),
             remark=region_data.remark
         )
         db.add(new_region)
         db.commit()
         db.refresh(new_region)
+        fence_cache.invalidate_region(new_region.id)
         return new_region
 
     def get_project_regions(self, db: Session, skip: int = 0, limit: int = 100):
@@ -36,37 +74,41 @@ class FenceService:
             return None
         
         update_data = region_data.model_dump(exclude_unset=True)
+        if update_data.get("coordinates_json"):
+            update_data["coordinates_json"] = self._simplify_coordinates(update_data["coordinates_json"])
         for key, value in update_data.items():
             setattr(db_region, key, value)
         
         db.commit()
         db.refresh(db_region)
+        fence_cache.invalidate_region(region_id)
+        # "No Exit" fences of this region depend on its outline
+        for fence in db_region.fences:
+            self._update_fence_count(db, fence)
         return db_region
 
     def delete_project_region(self, db: Session, region_id: int):
         db_region = db.query(ProjectRegion).filter(ProjectRegion.id == region_id).first()
         if db_region:
+            fence_ids = [f.id for f in db_region.fences]
             # Set project_region_id to NULL for associated fences
             db.query(ElectronicFence).filter(ElectronicFence.project_region_id == region_id).update({"project_region_id": None})
             db.delete(db_region)
             db.commit()
+            fence_cache.invalidate_region(region_id)
+            fence_cache.invalidate_fence()
+            for fence in db.query(ElectronicFence).filter(ElectronicFence.id.in_(fence_ids)).all():
+                self._update_fence_count(db, fence)
             return True
         return False
 
     def is_device_inside_project_region(self, region: ProjectRegion, device: Device) -> bool:
         if not device.last_latitude or not device.last_longitude:
             return False
-        try:
-            poly_points = json.loads(region.coordinates_json)
-            poly = []
-            for p in poly_points:
-                if isinstance(p, list) and len(p) >= 2:
-                    poly.append((float(p[1]), float(p[0])))
-                elif isinstance(p, dict):
-                    poly.append((float(p.get("lng")), float(p.get("lat"))))
-            return self._is_inside_polygon((device.last_longitude, device.last_latitude), poly)
-        except Exception:
+        compiled = fence_cache.get_region(region)
+        if compiled.polygon is None:
             return False
+        return self._inside_compiled_polygon(compiled, device.last_longitude, device.last_latitude)
 
     def create_fence(self, db: Session, fence_data: FenceCreate):
         logger.info(f"Creating new fence: {fence_data.name} ({fence_data.shape})")
@@ -75,13 +117,20 @@ class FenceService:
         if fence_data.shape == "circle" and not fence_data.radius:
             raise ValueError("Radius is required for circular fences")
 
+        coordinates_json = fence_data.coordinates_json
+        if fence_data.shape == "polygon":
+            coordinates_json = self._simplify_coordinates(coordinates_json)
+
         new_fence = ElectronicFence(
             name=fence_data.name,
             project_region_id=fence_data.project_region_id,
             shape=fence_data.shape,
             behavior=fence_data.behavior,
-            coordinates_json=fence_data.coordinates_json,
+            coordinates_json=coordinates_json,
             radius=fence_data.radius,
+            edge_buffer=fence_data.edge_buffer or 0,
+            dwell_seconds=fence_data.dwell_seconds or 0,
+            warning_distance=fence_data.warning_distance or 0,
             effective_time=fence_data.effective_time,
             remark=fence_data.remark,
             alarm_type=fence_data.alarm_type,
@@ -89,6 +138,8 @@ class FenceService:
         db.add(new_fence)
         db.commit()
         db.refresh(new_fence)
+        fence_cache.invalidate_fence(new_fence.id)
+        dashboard_counters.fence_added()
 
         # Immediate check for existing devices
         self._check_existing_devices(db, new_fence)
@@ -98,18 +149,17 @@ class FenceService:
     def _check_existing_devices(self, db: Session, fence: ElectronicFence):
         """Check all devices against the newly created fence."""
         logger.info(f"Checking existing devices for fence {fence.name}")
-        devices = (
-            db.query(Device)
-            .filter(Device.last_latitude.isnot(None), Device.last_longitude.isnot(None))
-            .all()
-        )
+        violators = self._compute_violators(db, fence)
 
         count = 0
-        for device in devices:
-            if self.check_device_against_fence(db, fence, device):
-                count += 1
-        
-        self._update_fence_count(db, fence)
+        if violators:
+            devices = db.query(Device).filter(Device.id.in_(violators)).all()
+            for device in devices:
+                if self._raise_fence_alarm(db, fence, device, commit=False):
+                    count += 1
+            db.commit()
+
+        self._update_fence_count(db, fence, violators)
         logger.info(f"Fence creation check: Triggered {count} alarms.")
 
     def update_fence(self, db: Session, fence_id: int, fence_data: FenceUpdate):
@@ -122,14 +172,46 @@ class FenceService:
 
         # Update fields if they are provided (not None)
         update_data = fence_data.model_dump(exclude_unset=True)
+        if update_data.get("coordinates_json") and _plain(update_data.get("shape", db_fence.shape)) == "polygon":
+            update_data["coordinates_json"] = self._simplify_coordinates(update_data["coordinates_json"])
+        changed = {
+            key for key, value in update_data.items()
+            if _plain(getattr(db_fence, key)) != _plain(value)
+        }
+        old_scope = self._trigger_bbox(db, db_fence)
         for key, value in update_data.items():
             setattr(db_fence, key, value)
 
         db.commit()
-        self._update_fence_count(db, db_fence)
+        fence_cache.invalidate_fence(fence_id)
+        if "name" in changed:
+            alarm_refs.discard_fence(fence_id)
+        if changed & VIOLATION_FIELDS:
+            # Edge states were settled against the old outline / rules
+            fence_debouncer.drop_fence(fence_id)
+            self._reevaluate_fence(db, db_fence, old_scope)
         db.refresh(db_fence)
         return db_fence
 
+    def _reevaluate_fence(self, db: Session, fence: ElectronicFence, old_scope):
+        """
+        Recount after a geometry / rule edit, testing only devices inside the union of
+        the old and new trigger boxes; nobody outside both can have changed state.
+        """
+        active = self.is_fence_active_now(fence)
+        if not active or fence_membership.seeded_state(fence.id) is not True:
+            # Nothing incremental to build on, or the count simply drops to 0
+            self._update_fence_count(db, fence)
+            return
+
+        scope = _union_bbox(old_scope, self._trigger_bbox(db, fence))
+        if scope == "global":
+            self._update_fence_count(db, fence)
+            return
+        scanned, found = self._scan_violators(db, fence, scope)
+        violators = (fence_membership.members(fence.id) - scanned) | found
+        self._update_fence_count(db, fence, violators)
+
     def get_fences(self, db: Session, skip: int = 0, limit: int = 100):
         return db.query(ElectronicFence).offset(skip).limit(limit).all()
 
@@ -138,10 +220,26 @@ class FenceService:
             db.query(ElectronicFence).filter(ElectronicFence.id == fence_id).first()
         )
         if db_fence:
-            # Set fence_id to NULL for associated alarms instead of deleting them
-            db.query(AlarmRecord).filter(AlarmRecord.fence_id == fence_id).update({"fence_id": None})
+            # Set fence_id to NULL for associated alarms instead of deleting them,
+            # moving their rollup counts along to the non-fence row
+            alarms = db.query(AlarmRecord).filter(AlarmRecord.fence_id == fence_id)
+            changes = [
+                (alarm_key(row._mapping), alarm_key({**row._mapping, "fence_id": None}))
+                for row in alarms.with_entities(*(getattr(AlarmRecord, f) for f in KEY_SOURCE_FIELDS))
+                .with_for_update()
+            ]
+            alarms.update({"fence_id": None, "pending_key": None})
+            alarm_rollups.alarms_changed(db, changes)
             db.delete(db_fence)
             db.commit()
+            fence_cache.invalidate_fence(fence_id)
+            fence_membership.drop_fence(fence_id)
+            fence_debouncer.drop_fence(fence_id)
+            fence_proximity.drop_fence(fence_id)
+            pending_fence_alarms.discard_fence(fence_id)
+            alarm_correlator.discard_fence(fence_id)
+            alarm_refs.discard_fence(fence_id)
+            dashboard_counters.fence_removed()
             return True
         return False
 
@@ -150,53 +248,326 @@ class FenceService:
         Check if a specific device (with new coordinates) violates any active fence.
         This is typically called by a location update stream.
         """
-        # Update device location first
-        device = db.query(Device).filter(Device.id == device_id).first()
-        if device:
-            device.last_latitude = lat
-            device.last_longitude = lng
-            db.commit()  # Save the new location
-        else:
+        results = self.check_fence_status_batch(
+            db, [LocationPing(device_id=device_id, lat=lat, lng=lng)]
+        )
+        if results[0]["status"] == "device_not_found":
             logger.warning(f"Device {device_id} not found during fence check.")
-            return
 
-        active_fences = (
-            db.query(ElectronicFence).filter(ElectronicFence.is_active == 1).all()
+    def check_fence_status_batch(self, db: Session, pings: list[LocationPing]) -> list[dict]:
+        """
+        Evaluate a batch of location pings in one pass and one transaction.
+        Pings are applied in time order; each device's last position is written
+        with a single bulk UPDATE. Returns one result dict per input ping.
+        """
+        devices = {
+            d.id: d
+            for d in db.query(Device).filter(Device.id.in_({p.device_id for p in pings})).all()
+        }
+
+        # Only fences whose trigger area contains a point can be violated,
+        # and only fences a device was counted against can lose it
+        candidates = {}
+        nearby = {}
+        affected_ids = set()
+        warning_reach = fence_index.warning_reach(db)
+        for device_id in devices:
+            affected_ids |= fence_membership.fences_of(device_id)
+            affected_ids |= fence_proximity.fences_of(device_id)
+            affected_ids |= fence_debouncer.pending_of(device_id)
+        for i, ping in enumerate(pings):
+            if ping.device_id in devices:
+                candidates[i] = fence_index.query_point(db, ping.lat, ping.lng)
+                affected_ids |= candidates[i]
+                if warning_reach > 0:
+                    # Restricted areas close enough to warn about
+                    nearby[i] = fence_index.query_near(db, ping.lat, ping.lng, warning_reach)
+                    affected_ids |= nearby[i]
+
+        fences = {}
+        if affected_ids:
+            fences = {
+                f.id: f
+                for f in db.query(ElectronicFence)
+                .filter(ElectronicFence.id.in_(affected_ids), ElectronicFence.is_active == 1)
+                .all()
+            }
+        active = {}
+        for fence in fences.values():
+            # Never counted, or crossed an effective-time boundary since the last recount
+            active[fence.id] = self._sync_window(db, fence)
+
+        results = [None] * len(pings)
+        positions = {}
+        count_deltas = {}
+        ping_times = [self._ping_time(p) for p in pings]
+        geometry = self._shard_geometry(db, pings, devices, candidates, fences, active)
+        for i in sorted(range(len(pings)), key=lambda i: ping_times[i]):
+            ping = pings[i]
+            device = devices.get(ping.device_id)
+            if device is None:
+                results[i] = {
+                    "device_id": ping.device_id, "status": "device_not_found",
+                    "violations": [], "alarms": [], "warnings": [],
+                }
+                continue
+
+            position = _PingPosition(device, ping.lat, ping.lng)
+            positions[device.id] = position
+            violations, alarms = [], []
+            counted = fence_membership.fences_of(device.id)
+            # Fences with a pending crossing also re-check it, to reset the dwell once the device has left
+            for fence_id in sorted(candidates[i] | counted | fence_debouncer.pending_of(device.id)):
+                fence = fences.get(fence_id)
+                if fence is None:
+                    continue
+                violating = active[fence_id] and self._ping_violation(
+                    db, fence, position, fence_id in candidates[i], ping_times[i], geometry.get((i, fence_id)),
+                    fence_id in counted,
+                )
+                if violating:
+                    violations.append(fence_id)
+                    if self._raise_fence_alarm(db, fence, position, commit=False):
+                        alarms.append(fence_id)
+                if fence_membership.set_violation(fence_id, device.id, violating):
+                    count_deltas[fence_id] = count_deltas.get(fence_id, 0) + (1 if violating else -1)
+            # Also re-check bands the device was in, so warnings re-arm once it has moved away
+            warnings = self._proximity_warnings(
+                db, fences, active, set(nearby.get(i, ())) | fence_proximity.fences_of(device.id), position, violations
+            )
+            results[i] = {
+                "device_id": device.id, "status": "checked",
+                "violations": violations, "alarms": alarms, "warnings": warnings,
+            }
+
+        # Relative updates, so concurrent batches touching one fence add up instead of overwriting
+        for fence_id, delta in count_deltas.items():
+            if delta:
+                db.query(ElectronicFence).filter(ElectronicFence.id == fence_id).update(
+                    {ElectronicFence.worker_count: ElectronicFence.worker_count + delta},
+                    synchronize_session=False,
+                )
+        if positions:
+            # One prepared UPDATE run as executemany over all devices of the batch
+            devices_table = Device.__table__
+            db.execute(
+                update(devices_table)
+                .where(devices_table.c.id == bindparam("device_id"))
+                .values(last_latitude=bindparam("lat"), last_longitude=bindparam("lng")),
+                [{"device_id": p.id, "lat": p.last_latitude, "lng": p.last_longitude} for p in positions.values()],
+            )
+        try:
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Alarms flushed in this batch are gone, so the in-memory state may be ahead of the DB
+            pending_fence_alarms.invalidate()
+            raise
+
+        for i, ping in enumerate(pings):
+            if ping.device_id in devices:
+                position_history.record(ping.device_id, ping.lat, ping.lng, ping_times[i])
+        return results
+
+    def _ping_violation(self, db: Session, fence: ElectronicFence, position: _PingPosition,
+                        is_candidate: bool, ts: datetime, geometry=None, counted: bool = False) -> bool:
+        """
+        check_device_violation for one ping, debounced when the fence has edge_buffer / dwell_seconds.
+        geometry: (inside, in_region, edge_distance) already computed by a fence shard, if any.
+        counted: the device is currently counted as violating the fence.
+        """
+        compiled = fence_cache.get_fence(fence)
+        debounced = bool(compiled.edge_buffer or compiled.dwell_seconds)
+        if not debounced and not is_candidate:
+            # Outside the fence's trigger area a violation is impossible
+            return False
+
+        if geometry is None:
+            raw_inside, in_region = self.is_device_inside_fence(fence, position), None
+            edge_distance = None
+            if debounced:
+                edge_distance = self._edge_distance(compiled, position.last_latitude, position.last_longitude)
+        else:
+            raw_inside, in_region, edge_distance = geometry
+
+        is_inside = raw_inside
+        if debounced:
+            is_inside = fence_debouncer.settle(
+                fence.id, position.id, raw_inside, edge_distance,
+                compiled.edge_buffer, compiled.dwell_seconds, ts,
+                # A first sighting starts on the side the device is counted on
+                seed_inside=counted if fence.behavior == "No Entry" else not counted,
+            )
+        return self._violation_for(db, fence, position, is_inside, in_region)
+
+    def _shard_geometry(self, db: Session, pings, devices, candidates, fences, active) -> dict:
+        """
+        Geometry of every (ping, fence) pair the batch loop may test, computed by the
+        fence shard processes. Empty when sharding is off; missing pairs are evaluated in-process.
+        """
+        if not fence_shards.enabled:
+            return {}
+        # Fences a device may be counted against at any point of the batch
+        reachable = {}
+        for i, ping in enumerate(pings):
+            if ping.device_id in devices:
+                reachable.setdefault(
+                    ping.device_id,
+                    fence_membership.fences_of(ping.device_id) | fence_debouncer.pending_of(ping.device_id),
+                )
+                reachable[ping.device_id] |= candidates[i]
+
+        tasks = []
+        for i, ping in enumerate(pings):
+            if ping.device_id not in devices:
+                continue
+            for fence_id in reachable[ping.device_id]:
+                fence = fences.get(fence_id)
+                if fence is None or not active[fence_id]:
+                    continue
+                compiled = fence_cache.get_fence(fence)
+                debounced = bool(compiled.edge_buffer or compiled.dwell_seconds)
+                if debounced or fence_id in candidates[i]:
+                    tasks.append(((i, fence_id), fence, ping.lat, ping.lng, debounced))
+        return fence_shards.evaluate(db, tasks)
+
+    def _edge_distance(self, compiled, lat: float, lng: float) -> float:
+        """Meters from a point to the fence boundary; only compared against edge_buffer."""
+        return boundary_distance(compiled, lat, lng, compiled.edge_buffer)
+
+    def _proximity_warnings(self, db: Session, fences: dict, active: dict, fence_ids, position: _PingPosition,
+                            violations: list) -> list:
+        """
+        Warn once when a device comes within warning_distance of a "No Entry" fence it is
+        not inside; the warning re-arms after the device moves away again.
+        """
+        warnings = []
+        for fence_id in sorted(fence_ids):
+            fence = fences.get(fence_id)
+            close = False
+            distance = None
+            if fence is not None and fence.behavior == "No Entry" and active[fence_id] and fence_id not in violations:
+                compiled = fence_cache.get_fence(fence)
+                if compiled.warning_distance:
+                    distance = boundary_distance(
+                        compiled, position.last_latitude, position.last_longitude, compiled.warning_distance
+                    )
+                    close = distance <= compiled.warning_distance and not self.is_device_inside_fence(fence, position)
+            if fence_proximity.update(fence_id, position.id, close) and close:
+                self._raise_proximity_warning(db, fence, position, distance)
+                warnings.append(fence_id)
+        return warnings
+
+    def _raise_proximity_warning(self, db: Session, fence: ElectronicFence, device, distance: float):
+        description = f"Device {device.device_name} is {distance:.0f} m from restricted area: {fence.name}"
+        logger.info(f"  PROXIMITY WARNING: {description}")
+        alarm = AlarmCreate(
+            device_id=device.id,
+            fence_id=fence.id,
+            alarm_type="电子围栏接近预警",
+            severity="low",
+            description=description,
+            location=f"{device.last_latitude:.6f}, {device.last_longitude:.6f}",
+            # Not "pending", so it never takes the fence's pending-alarm slot
+            status="warning",
         )
-        for fence in active_fences:
-            if self.is_fence_active_now(fence):
-                self.check_device_against_fence(db, fence, device)
+        # A crowd approaching one fence is one incident, counted on its first warning
+        incident, absorbed = alarm_correlator.correlate(alarm)
+        if absorbed:
+            return
+        try:
+            record = AlarmService().create_alarm(db, alarm, commit=False)
+        except Exception:
+            alarm_correlator.abandon(incident)
+            raise
+        alarm_correlator.attach(incident, record.id)
+
+    def nearest_fence(self, db: Session, lat: float, lng: float, radius: float):
+        """Active fence with the closest boundary within radius meters of (lat, lng), or None."""
+        fence_ids = fence_index.query_near(db, lat, lng, radius)
+        if not fence_ids:
+            return None
+        position = SimpleNamespace(last_latitude=lat, last_longitude=lng)
+        best = None
+        for fence in db.query(ElectronicFence).filter(ElectronicFence.id.in_(fence_ids)).all():
+            distance = boundary_distance(fence_cache.get_fence(fence), lat, lng, radius)
+            if distance <= radius and (best is None or distance < best["distance"]):
+                best = {
+                    "fence_id": fence.id,
+                    "name": fence.name,
+                    "behavior": fence.behavior,
+                    "distance": distance,
+                    "inside": self.is_device_inside_fence(fence, position),
+                }
+        return best
+
+    def _ping_time(self, ping: LocationPing) -> datetime:
+        """Local naive timestamp of a ping; pings without one count as received now."""
+        if ping.ts is None:
+            return datetime.now()
+        if ping.ts.tzinfo is not None:
+            return ping.ts.astimezone().replace(tzinfo=None)
+        return ping.ts
+
+    def window_flip(self, fence: ElectronicFence):
+        """
+        (crossed an effective-time boundary not applied yet, active now).
+        Whoever notices the flip first (ping batch, scheduler or recount) gets True and applies it.
+        """
+        compiled = fence_cache.get_fence(fence)
+        in_window = compiled.active_now()
+        flipped = (
+            bool(fence.is_active) and compiled.window is not None
+            and fence_membership.window_flipped(fence.id, in_window)
+        )
+        return flipped, bool(fence.is_active) and in_window
+
+    def _sync_window(self, db: Session, fence: ElectronicFence) -> bool:
+        """Apply a pending boundary, else seed the fence if its count is stale. Returns whether it is active now."""
+        flipped, active = self.window_flip(fence)
+        if flipped:
+            self.apply_window_boundary(db, fence, active)
+        elif fence_membership.seeded_state(fence.id) != active:
             self._update_fence_count(db, fence)
+        return active
+
+    def apply_window_boundary(self, db: Session, fence: ElectronicFence, active: bool = None):
+        """
+        Called once when a fence enters or leaves its effective time window.
+        Opening: recount and alarm every device already violating it.
+        Closing: zero the count and clear the fence's pending alarms.
+        """
+        if active is None:
+            active = self.is_fence_active_now(fence)
+        # The count restarts from the raw positions at a boundary, and so do edge states
+        fence_debouncer.drop_fence(fence.id)
+        if active:
+            logger.info(f"Fence {fence.name} entered its effective time window")
+            self._check_existing_devices(db, fence)
+        else:
+            logger.info(f"Fence {fence.name} left its effective time window")
+            AlarmService().resolve_fence_alarms(db, fence.id)
+            self._update_fence_count(db, fence)
+
+    def recount_all_fences(self, db: Session):
+        """Full worker_count recount of every fence (startup / scheduled reconciliation)."""
+        for fence in db.query(ElectronicFence).all():
+            # A boundary this recount is the first to see is still applied, not swallowed
+            flipped, active = self.window_flip(fence)
+            if flipped:
+                self.apply_window_boundary(db, fence, active)
+            else:
+                self._update_fence_count(db, fence)
 
     def is_fence_active_now(self, fence: ElectronicFence) -> bool:
         """Check if the fence is within its effective time range."""
         if not fence.is_active:
             return False
-        if not fence.effective_time or '-' not in fence.effective_time:
-            return True
-            
-        try:
-            now = datetime.now().time()
-            start_str, end_str = fence.effective_time.split('-')
-            
-            start_t = self._parse_time_str(start_str)
-            end_t = self._parse_time_str(end_str)
-            
-            if start_t <= end_t:
-                return start_t <= now <= end_t
-            else: # Overnight range
-                return now >= start_t or now <= end_t
-        except Exception as e:
-            logger.error(f"Error checking fence time: {e}")
-            return True
+        return fence_cache.get_fence(fence).active_now()
 
     def _parse_time_str(self, time_str: str) -> time:
         """Parse 'HH:mm' or 'HH.mm' style strings."""
-        ts = time_str.strip().replace('.', ':')
-        parts = ts.split(':')
-        h = int(parts[0])
-        m = int(parts[1]) if len(parts) > 1 else 0
-        return time(h, m)
+        return parse_time_str(time_str)
 
     def is_device_inside_fence(self, fence: ElectronicFence, device: Device) -> bool:
         """Helper to determine if a device is currently inside a fence boundary."""
@@ -204,62 +575,190 @@ class FenceService:
             return False
 
         gcj_lat, gcj_lng = device.last_latitude, device.last_longitude
+        compiled = fence_cache.get_fence(fence)
 
-        if fence.shape == "circle":
-            try:
-                center = json.loads(fence.coordinates_json)
-                center_lat, center_lng = 0.0, 0.0
-                if isinstance(center, list) and len(center) >= 2:
-                    center_lat, center_lng = float(center[0]), float(center[1])
-                elif isinstance(center, dict):
-                    center_lat = float(center.get("lat", 0))
-                    center_lng = float(center.get("lng", 0))
-                
-                dist = self._get_distance(gcj_lat, gcj_lng, center_lat, center_lng)
-                return dist <= (fence.radius or 0)
-            except Exception:
+        if compiled.shape == "circle":
+            if compiled.center is None:
                 return False
+            center_lat, center_lng = compiled.center
+            dist = self._get_distance(gcj_lat, gcj_lng, center_lat, center_lng)
+            return dist <= compiled.radius
 
-        elif fence.shape == "polygon":
-            try:
-                polygon_points = json.loads(fence.coordinates_json)
-                poly = []
-                for p in polygon_points:
-                    if isinstance(p, list) and len(p) >= 2:
-                        poly.append((float(p[1]), float(p[0])))
-                    elif isinstance(p, dict):
-                        poly.append((float(p.get("lng")), float(p.get("lat"))))
-                return self._is_inside_polygon((gcj_lng, gcj_lat), poly)
-            except Exception:
+        elif compiled.shape == "polygon":
+            if compiled.polygon is None:
                 return False
+            return self._inside_compiled_polygon(compiled, gcj_lng, gcj_lat)
         return False
 
-    def _update_fence_count(self, db: Session, fence: ElectronicFence):
-        """Recalculate and update the worker_count (violator count) for a fence."""
+    def _update_fence_count(self, db: Session, fence: ElectronicFence, violators: set = None):
+        """
+        Recalculate and update the worker_count (violator count) for a fence.
+        Also re-seeds the incremental membership state used by check_fence_status.
+        violators: precomputed _compute_violators result, to avoid evaluating twice.
+        """
         # If fence is not active or out of time range, count is 0
-        if not self.is_fence_active_now(fence):
-            fence.worker_count = 0
-            db.commit()
-            return
-
-        devices = db.query(Device).filter(Device.last_latitude.isnot(None)).all()
-        count = 0
-        for device in devices:
-            if self.check_device_violation(db, fence, device):
-                count += 1
-        
-        fence.worker_count = count
+        active = self.is_fence_active_now(fence)
+        if not active:
+            violators = set()
+        elif violators is None:
+            violators = self._compute_violators(db, fence)
+
+        if active and fence_membership.seeded_state(fence.id) is True:
+            # Devices the debouncer tracks keep their debounced verdict: the raw recount
+            # would skip hysteresis and dwell for them
+            tracked = fence_debouncer.devices(fence.id)
+            if tracked:
+                violators = (violators - tracked) | (fence_membership.members(fence.id) & tracked)
+        fence_membership.reset_fence(fence.id, violators, active)
+        fence.worker_count = len(violators)
         db.commit()
 
+    def _compute_violators(self, db: Session, fence: ElectronicFence) -> set:
+        """Ids of all located devices violating the fence geometry (ignores effective time)."""
+        scope = self._trigger_bbox(db, fence)
+        if scope is None:
+            return set()
+        return self._scan_violators(db, fence, None if scope == "global" else scope)[1]
+
+    def _scan_violators(self, db: Session, fence: ElectronicFence, bbox=None):
+        """
+        Evaluate the located devices inside bbox (all of them when None).
+        Returns (ids of the devices tested, ids of those violating the fence).
+        """
+        query = db.query(Device.id, Device.last_latitude, Device.last_longitude).filter(
+            Device.last_latitude.isnot(None)
+        )
+        if bbox is not None:
+            min_lng, min_lat, max_lng, max_lat = bbox
+            query = query.filter(
+                Device.last_latitude >= min_lat, Device.last_latitude <= max_lat,
+                Device.last_longitude >= min_lng, Device.last_longitude <= max_lng,
+            )
+        rows = query.all()
+        if not rows:
+            return set(), set()
+        lats = np.array([r[1] for r in rows], dtype=np.float64)
+        lngs = np.array([r[2] if r[2] is not None else np.nan for r in rows], dtype=np.float64)
+        mask = self._violation_mask(db, fence, lats, lngs)
+        return {r[0] for r in rows}, {rows[i][0] for i in np.flatnonzero(mask)}
+
+    def _trigger_bbox(self, db: Session, fence: ElectronicFence):
+        """Area in which the fence can fire: a bbox, "global", or None (never fires)."""
+        compiled = fence_cache.get_fence(fence)
+        region_bbox = None
+        if compiled.behavior == "No Exit" and compiled.project_region_id:
+            region = db.query(ProjectRegion).filter(ProjectRegion.id == compiled.project_region_id).first()
+            if region:
+                region_bbox = fence_cache.get_region(region).bbox
+        return trigger_bbox(compiled, region_bbox)
+
+    def _violation_mask(self, db: Session, fence: ElectronicFence, lats, lngs, is_inside=None) -> np.ndarray:
+        """
+        Vectorized check_device_violation over arrays of device coordinates.
+        is_inside: inside-fence mask already known (e.g. debounced), computed when None.
+        """
+        if is_inside is None:
+            is_inside = self._inside_fence_mask(fence, lats, lngs)
+
+        if fence.behavior == "No Entry":
+            return is_inside
+        elif fence.behavior == "No Exit":
+            if fence.project_region_id:
+                region = fence.project_region
+                if not region:
+                    region = db.query(ProjectRegion).filter(ProjectRegion.id == fence.project_region_id).first()
+                if region:
+                    return self._inside_region_mask(region, lats, lngs) & ~is_inside
+                return np.zeros(is_inside.shape, dtype=bool)
+            else:
+                return ~is_inside
+        return is_inside
+
+    def _located_mask(self, lats, lngs) -> np.ndarray:
+        """Same test as `device.last_latitude and device.last_longitude` (missing or 0 is unlocated)."""
+        return ~np.isnan(lats) & ~np.isnan(lngs) & (lats != 0) & (lngs != 0)
+
+    def _inside_fence_mask(self, fence: ElectronicFence, lats, lngs, compiled=None) -> np.ndarray:
+        """Vectorized is_device_inside_fence. compiled: the fence's CompiledFence, looked up when None."""
+        located = self._located_mask(lats, lngs)
+        inside = np.zeros(lats.shape, dtype=bool)
+        compiled = compiled or fence_cache.get_fence(fence)
+        if compiled.bbox is None:
+            return inside
+
+        # Only points inside the bbox can be inside the shape
+        min_lng, min_lat, max_lng, max_lat = compiled.bbox
+        if compiled.shape == "circle":
+            idx = np.flatnonzero(
+                located & (lats >= min_lat) & (lats <= max_lat) & (lngs >= min_lng) & (lngs <= max_lng)
+            )
+            center_lat, center_lng = compiled.center
+            inside[idx] = points_in_circle(lats[idx], lngs[idx], center_lat, center_lng, compiled.radius)
+        elif compiled.shape == "polygon":
+            idx = self._polygon_prefilter(located, lats, lngs, compiled.bbox)
+            inside[idx] = self._compiled_polygon_mask(compiled, lngs[idx], lats[idx])
+        return inside
+
+    def _polygon_prefilter(self, located, lats, lngs, bbox) -> np.ndarray:
+        """
+        Indices of points the ray cast can possibly count as inside.
+        Only uses conditions under which no edge can toggle, so the result stays exact.
+        """
+        min_lng, min_lat, max_lng, max_lat = bbox
+        return np.flatnonzero(located & (lats > min_lat) & (lats <= max_lat) & (lngs <= max_lng))
+
+    def _inside_region_mask(self, region: ProjectRegion, lats, lngs) -> np.ndarray:
+        """Vectorized is_device_inside_project_region."""
+        located = self._located_mask(lats, lngs)
+        inside = np.zeros(lats.shape, dtype=bool)
+        compiled = fence_cache.get_region(region)
+        if compiled.bbox is None:
+            return inside
+        idx = self._polygon_prefilter(located, lats, lngs, compiled.bbox)
+        inside[idx] = self._compiled_polygon_mask(compiled, lngs[idx], lats[idx])
+        return inside
+
+    def _inside_compiled_polygon(self, compiled, lng: float, lat: float) -> bool:
+        """Point-in-polygon for a compiled fence / region, through its prepared grid when it has one."""
+        if compiled.prepared is not None:
+            return compiled.prepared.contains(lng, lat)
+        return self._is_inside_polygon((lng, lat), compiled.polygon)
+
+    def _compiled_polygon_mask(self, compiled, lngs, lats) -> np.ndarray:
+        """Vectorized _inside_compiled_polygon."""
+        if compiled.prepared is not None:
+            return compiled.prepared.contains_array(lngs, lats)
+        return points_in_polygon(lngs, lats, compiled.polygon)
+
+    def _simplify_coordinates(self, coordinates_json: str) -> str:
+        """Apply FENCE_SIMPLIFY_TOLERANCE to a polygon '[[lat,lng],...]'; unparsable input is kept as is."""
+        if FENCE_SIMPLIFY_TOLERANCE <= 0:
+            return coordinates_json
+        try:
+            polygon = parse_polygon(coordinates_json)
+        except Exception:
+            return coordinates_json
+        simplified = simplify_polygon(polygon, FENCE_SIMPLIFY_TOLERANCE)
+        if len(simplified) == len(polygon):
+            return coordinates_json
+        logger.info(f"Simplified polygon outline from {len(polygon)} to {len(simplified)} vertices")
+        return json.dumps([[lat, lng] for lng, lat in simplified])
+
     def check_device_violation(self, db: Session, fence: ElectronicFence, device: Device) -> bool:
         """Determine if a device is violating a fence's rules."""
         is_inside = self.is_device_inside_fence(fence, device)
-        
+        return self._violation_for(db, fence, device, is_inside)
+
+    def _violation_for(self, db: Session, fence: ElectronicFence, device: Device, is_inside: bool,
+                       in_region: bool = None) -> bool:
+        """Apply the fence behavior to an already known inside/outside (and in-region, if known) state."""
         if fence.behavior == "No Entry":
             return is_inside
         elif fence.behavior == "No Exit":
             # If targeted to a project region, only violate if inside region but outside fence
             if fence.project_region_id:
+                if in_region is not None:
+                    return in_region and not is_inside
                 region = fence.project_region
                 if not region: # Backup fetch if relationship is lazy or not loaded
                     region = db.query(ProjectRegion).filter(ProjectRegion.id == fence.project_region_id).first()
@@ -278,77 +777,73 @@ class FenceService:
         Core logic to check one device against one fence.
         Returns True if an alarm was triggered, False otherwise.
         """
-        violation = self.check_device_violation(db, fence, device)
-        gcj_lat, gcj_lng = device.last_latitude, device.last_longitude
+        if self.check_device_violation(db, fence, device):
+            return self._raise_fence_alarm(db, fence, device)
+        return False
 
-        if violation:
-            description = ""
-            if fence.behavior == "No Entry":
-                description = f"Device {device.device_name} entered restricted area: {fence.name}"
-            else:
-                description = f"Device {device.device_name} left designated area: {fence.name}"
-
-            # Check for duplicate ACTIVE alarms for this device and fence
-            existing_alarm = (
-                db.query(AlarmRecord)
-                .filter(
-                    AlarmRecord.device_id == device.id,
-                    AlarmRecord.fence_id == fence.id,
-                    AlarmRecord.status == "pending",
-                )
-                .first()
-            )
+    def _raise_fence_alarm(
+        self, db: Session, fence: ElectronicFence, device: Device, commit: bool = True
+    ) -> bool:
+        """Create a pending alarm for a violating device unless one already exists."""
+        gcj_lat, gcj_lng = device.last_latitude, device.last_longitude
 
-            if existing_alarm:
-                return False  # Already alarmed
-
-            logger.warning(f"  VIOLATION DETECTED: {description}")
-            alarm_service = AlarmService()
-            loc_str = f"{gcj_lat:.6f}, {gcj_lng:.6f}"
-
-            # Determine distinct alarm type based on behavior
-            current_alarm_type = "电子围栏越界"  # Default / No Exit
-            if fence.behavior == "No Entry":
-                current_alarm_type = "电子围栏闯入"
-
-            alarm_data = AlarmCreate(
-                device_id=device.id,
-                fence_id=fence.id,
-                alarm_type=current_alarm_type,
-                severity=(
-                    fence.alarm_type.value
-                    if hasattr(fence.alarm_type, "value")
-                    else "high"
-                ),
-                description=description,
-                location=loc_str,
-                status="pending",
-            )
-            try:
-                alarm_service.create_alarm(db, alarm_data)
-                return True
-            except Exception as e:
-                logger.error(f"Failed to create alarm: {e}")
+        description = ""
+        if fence.behavior == "No Entry":
+            description = f"Device {device.device_name} entered restricted area: {fence.name}"
+        else:
+            description = f"Device {device.device_name} left designated area: {fence.name}"
+
+        # Check for duplicate ACTIVE alarms for this device and fence,
+        # including crossings counted on another device's pending alarm
+        if pending_fence_alarms.contains(db, device.id, fence.id) or alarm_correlator.covers(device.id, fence.id):
+            return False  # Already alarmed
+
+        logger.warning(f"  VIOLATION DETECTED: {description}")
+        alarm_service = AlarmService()
+        loc_str = f"{gcj_lat:.6f}, {gcj_lng:.6f}"
+
+        current_alarm_type, severity = self._fence_alarm_kind(fence)
+        alarm_data = AlarmCreate(
+            device_id=device.id,
+            fence_id=fence.id,
+            alarm_type=current_alarm_type,
+            severity=severity,
+            description=description,
+            location=loc_str,
+            status="pending",
+        )
+        # A team crossing together is one incident on the first device's pending alarm
+        incident, absorbed = alarm_correlator.correlate(alarm_data)
+        if absorbed:
+            return False
+        try:
+            record = alarm_service.create_alarm(db, alarm_data, commit=commit)
+            alarm_correlator.attach(incident, record.id)
+            return True
+        except HTTPException as e:
+            if e.status_code != 409:
+                logger.error(f"Failed to create alarm: {e.detail}")
+            # 409: another worker raised the same alarm first
+        except Exception as e:
+            logger.error(f"Failed to create alarm: {e}")
+        alarm_correlator.abandon(incident)
 
         return False
 
+    def _fence_alarm_kind(self, fence: ElectronicFence):
+        """(alarm_type, severity) of the alarms a fence raises."""
+        # Determine distinct alarm type based on behavior
+        current_alarm_type = "电子围栏越界"  # Default / No Exit
+        if fence.behavior == "No Entry":
+            current_alarm_type = "电子围栏闯入"
+        severity = fence.alarm_type.value if hasattr(fence.alarm_type, "value") else "high"
+        return current_alarm_type, severity
+
     def _get_distance(self, lat1, lon1, lat2, lon2):
         """
         Calculate Haversine distance between two points in meters.
         """
-        R = 6371000  # Radius of Earth in meters
-        phi1 = math.radians(lat1)
-        phi2 = math.radians(lat2)
-        delta_phi = math.radians(lat2 - lat1)
-        delta_lambda = math.radians(lon2 - lon1)
-
-        a = (
-            math.sin(delta_phi / 2.0) ** 2
-            + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2.0) ** 2
-        )
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-        return R * c
+        return haversine(lat1, lon1, lat2, lon2)
 
     def _is_inside_polygon(self, point, polygon):
         """
@@ -373,3 +868,19 @@ class FenceService:
                             inside = not inside
             p1x, p1y = p2x, p2y
         return inside
+
+
+def _union_bbox(a, b):
+    """Union of two trigger areas (bbox, "global" or None)."""
+    if a == "global" or b == "global":
+        return "global"
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def _plain(value):
+    """Enum members compare by value, so a schema enum equals the model enum it mirrors."""
+    return value.value if hasattr(value, "value") else value
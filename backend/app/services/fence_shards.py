@@ -0,0 +1,313 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from types import SimpleNamespace
+import numpy as np
+from sqlalchemy.orm import Session
+from app.models.fence import ElectronicFence, ProjectRegion
+from app.services.fence_cache import fence_cache, boundary_distance, CompiledFence, CompiledRegion
+from app.utils.geo_vector import points_in_circle, points_in_polygon
+from app.utils.logger import get_logger
+
+logger = get_logger("FenceShards")
+
+# Number of fence evaluation worker processes, 0 evaluates in-process (default)
+FENCE_SHARDS = int(os.getenv("FENCE_SHARDS", 0))
+# Re-ship geometry at least this often, so rows edited by other processes are picked up
+SHARD_REFRESH_SECONDS = 60
+
+
+def shard_of(project_region_id, shards: int) -> int:
+    """Routing key: every fence of a project region (branch) lives on the same shard."""
+    return (project_region_id or 0) % shards
+
+
+def fence_geometry_array(compiled, region, lats, lngs, need_edge: bool):
+    """
+    (inside_fence, inside_region, edge_distance) lists for many points of one fence,
+    with the same results as FenceService.is_device_inside_fence /
+    is_device_inside_project_region / _edge_distance point by point (the vectorized
+    helpers are exact). inside_region is only computed for "No Exit" fences with a
+    region (None otherwise), edge_distance is None unless requested.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    located = np.flatnonzero((lats != 0) & (lngs != 0) & ~np.isnan(lats) & ~np.isnan(lngs))
+    inside = np.zeros(lats.shape, dtype=bool)
+    if compiled.shape == "circle" and compiled.center is not None:
+        inside[located] = points_in_circle(lats[located], lngs[located], compiled.center[0], compiled.center[1],
+                                           compiled.radius)
+    elif compiled.shape == "polygon" and compiled.polygon is not None:
+        inside[located] = _contains_array(compiled, lngs[located], lats[located])
+
+    in_region = None
+    if compiled.behavior == "No Exit" and compiled.project_region_id:
+        in_region = np.zeros(lats.shape, dtype=bool)
+        if region is not None and region.polygon is not None:
+            in_region[located] = _contains_array(region, lngs[located], lats[located])
+        in_region = in_region.tolist()
+
+    edge_distance = None
+    if need_edge:
+        edge_distance = [
+            boundary_distance(compiled, lat, lng, compiled.edge_buffer) for lat, lng in zip(lats.tolist(), lngs.tolist())
+        ]
+    return inside.tolist(), in_region, edge_distance
+
+
+def _contains_array(compiled, lngs, lats) -> np.ndarray:
+    if compiled.prepared is not None:
+        # A batch puts a few points in each grid row: the per-point cell lookup beats
+        # contains_array, which pays one NumPy pass per edge of every row it touches
+        return np.fromiter(
+            (compiled.prepared.contains(lng, lat) for lng, lat in zip(lngs.tolist(), lats.tolist())),
+            dtype=bool, count=len(lngs),
+        )
+    return points_in_polygon(lngs, lats, compiled.polygon or ())
+
+
+# --- Worker process side: one process per shard, holding that shard's compiled geometry ---
+
+_shard_state = {"version": None, "fences": {}, "regions": {}}
+
+
+def _worker_load(version, fence_rows, region_rows):
+    _shard_state["fences"] = {row["id"]: CompiledFence(SimpleNamespace(**row)) for row in fence_rows}
+    _shard_state["regions"] = {row["id"]: CompiledRegion(SimpleNamespace(**row)) for row in region_rows}
+    _shard_state["version"] = version
+    return len(fence_rows)
+
+
+def _worker_evaluate(version, groups):
+    """
+    groups: [(fence_id, need_edge, lats, lngs)], one per fence, coordinates as arrays.
+    Returns one fence_geometry_array result per group (None for an unknown fence),
+    or None if the shard holds other geometry.
+    """
+    if _shard_state["version"] != version:
+        return None
+    fences, regions = _shard_state["fences"], _shard_state["regions"]
+    results = []
+    for fence_id, need_edge, lats, lngs in groups:
+        compiled = fences.get(fence_id)
+        if compiled is None:
+            results.append(None)
+            continue
+        region = regions.get(compiled.project_region_id)
+        results.append(fence_geometry_array(compiled, region, lats, lngs, need_edge))
+    return results
+
+
+# --- Main process side ---
+
+def _fence_row(fence) -> dict:
+    shape = fence.shape
+    return {
+        "id": fence.id,
+        "shape": shape.value if hasattr(shape, "value") else shape,
+        "behavior": fence.behavior,
+        "project_region_id": fence.project_region_id,
+        "coordinates_json": fence.coordinates_json,
+        "radius": fence.radius,
+        "effective_time": fence.effective_time,
+        "edge_buffer": fence.edge_buffer,
+        "dwell_seconds": fence.dwell_seconds,
+        "warning_distance": fence.warning_distance,
+    }
+
+
+class FenceShardPool:
+    """
+    Fence geometry evaluation spread over worker processes, sharded by project_region_id.
+    Each worker keeps the compiled fences and regions of its shard. A batch sends
+    each shard one message with its points grouped per fence as coordinate arrays,
+    all shards in parallel, and the worker tests every group vectorized.
+    Only the stateless geometry runs remotely: membership, debouncing and alarms
+    stay in FenceService (serially, in the calling process), so results are the
+    same as in-process evaluation; only the geometry part scales with shards.
+    """
+
+    def __init__(self, shards: int = FENCE_SHARDS):
+        self.shards = max(0, shards)
+        self._executors = []
+        self._lock = threading.Lock()
+        self._version = 0
+        self._cache_version = None
+        self._shipped = {}  # fence_id -> CompiledFence the workers were built from
+        self._loads = []  # per shard: (fence_rows, region_rows) of the current version
+        self._synced_at = 0.0
+        self.evaluated = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._executors)
+
+    def start(self):
+        with self._lock:
+            if self.shards <= 0 or self._executors:
+                return
+            ctx = get_context("spawn")
+            self._executors = [ProcessPoolExecutor(max_workers=1, mp_context=ctx) for _ in range(self.shards)]
+            self._cache_version = None
+            self._loads = []
+        logger.info(f"Fence evaluation sharded over {self.shards} worker processes")
+
+    def stop(self):
+        with self._lock:
+            executors, self._executors = self._executors, []
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "shards": len(self._executors),
+            "fences": len(self._shipped),
+            "evaluated": self.evaluated,
+            "fallbacks": self.fallbacks,
+        }
+
+    def evaluate(self, db: Session, tasks):
+        """
+        tasks: [(key, fence, lat, lng, need_edge)].
+        Returns {key: (inside, in_region, edge_distance)}; keys missing from the
+        result (shard failure) must be evaluated in-process by the caller.
+        """
+        if not self._executors or not tasks:
+            return {}
+
+        # shard -> fence_id -> [keys, lats, lngs, need_edge]
+        groups = {}
+        fences = {}
+        shards = len(self._executors)
+        for key, fence, lat, lng, need_edge in tasks:
+            fences[fence.id] = fence
+            group = groups.setdefault(shard_of(fence.project_region_id, shards), {}).setdefault(
+                fence.id, [[], [], [], need_edge]
+            )
+            group[0].append(key)
+            group[1].append(lat)
+            group[2].append(lng)
+
+        results = {}
+        todo = set(groups)
+        # A second round covers a shard that was re-shipped or restarted under us
+        for _ in range(2):
+            with self._lock:
+                if not self._executors:
+                    break
+                if self._needs_sync(fences.values()):
+                    self._sync(db)
+                version = self._version
+                executors = list(self._executors)
+            futures = {
+                shard: executors[shard].submit(_worker_evaluate, version, [
+                    (fence_id, need_edge, np.array(lats, dtype=np.float64), np.array(lngs, dtype=np.float64))
+                    for fence_id, (_, lats, lngs, need_edge) in groups[shard].items()
+                ])
+                for shard in todo
+            }
+            stale = set()
+            for shard, future in futures.items():
+                try:
+                    values = future.result()
+                except BrokenProcessPool:
+                    logger.error(f"Fence shard {shard} worker died, restarting it")
+                    self._restart(shard, executors[shard])
+                    values = None
+                except Exception as e:
+                    logger.error(f"Fence shard {shard} evaluation failed: {e}")
+                    values = None
+                if values is None:
+                    stale.add(shard)
+                    continue
+                for (keys, _, _, _), value in zip(groups[shard].values(), values):
+                    if value is None:
+                        continue
+                    inside, in_region, edge_distance = value
+                    for j, key in enumerate(keys):
+                        results[key] = (
+                            inside[j],
+                            None if in_region is None else in_region[j],
+                            None if edge_distance is None else edge_distance[j],
+                        )
+            todo = stale
+            if not todo:
+                break
+
+        # Still failing: the caller evaluates these pairs itself
+        self.fallbacks += sum(len(group[0]) for shard in todo for group in groups[shard].values())
+        self.evaluated += len(results)
+        return results
+
+    def _needs_sync(self, fences) -> bool:
+        """Caller holds the lock."""
+        if (
+            self._cache_version != fence_cache.version
+            or time.monotonic() - self._synced_at > SHARD_REFRESH_SECONDS
+        ):
+            return True
+        # Entries recompiled because the row changed underneath us (edited by another process)
+        return any(self._shipped.get(fence.id) is not fence_cache.get_fence(fence) for fence in fences)
+
+    def _sync(self, db: Session):
+        """
+        Ship every shard the active fences it owns plus their project regions.
+        Caller holds the lock. The version only moves when the shipped rows changed,
+        so a periodic refresh does not invalidate evaluations in flight.
+        """
+        cache_version = fence_cache.version
+        shards = len(self._executors)
+        fences = db.query(ElectronicFence).filter(ElectronicFence.is_active == 1).all()
+        regions = {r.id: r for r in db.query(ProjectRegion).all()}
+
+        fence_rows = [[] for _ in range(shards)]
+        region_rows = [{} for _ in range(shards)]
+        shipped = {}
+        for fence in fences:
+            shard = shard_of(fence.project_region_id, shards)
+            fence_rows[shard].append(_fence_row(fence))
+            region = regions.get(fence.project_region_id)
+            if region is not None:
+                region_rows[shard][region.id] = {"id": region.id, "coordinates_json": region.coordinates_json}
+            shipped[fence.id] = fence_cache.get_fence(fence)
+        loads = [(fence_rows[i], list(region_rows[i].values())) for i in range(shards)]
+
+        if loads != self._loads:
+            self._version += 1
+            self._loads = loads
+            futures = [
+                executor.submit(_worker_load, self._version, *loads[i])
+                for i, executor in enumerate(self._executors)
+            ]
+            for i, future in enumerate(futures):
+                try:
+                    future.result()
+                except BrokenProcessPool:
+                    logger.error(f"Fence shard {i} worker died during sync, restarting it")
+                    self._replace(i)
+            logger.info(f"Fence shards loaded {len(fences)} fences into {shards} workers")
+        self._shipped = shipped
+        self._cache_version = cache_version
+        self._synced_at = time.monotonic()
+
+    def _restart(self, shard: int, broken):
+        """Replace a dead worker, unless another caller already has."""
+        with self._lock:
+            if shard < len(self._executors) and self._executors[shard] is broken:
+                self._replace(shard)
+
+    def _replace(self, shard: int):
+        """Caller holds the lock. The new worker gets the current geometry before any evaluation."""
+        self._executors[shard].shutdown(wait=False, cancel_futures=True)
+        executor = ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"))
+        if shard < len(self._loads):
+            # One worker process runs its calls in order, so this load precedes later evaluations
+            executor.submit(_worker_load, self._version, *self._loads[shard])
+        self._executors[shard] = executor
+
+
+fence_shards = FenceShardPool()
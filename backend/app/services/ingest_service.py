@@ -0,0 +1,122 @@
+import asyncio
+import os
+import zlib
+from app.core.database import SessionLocal
+from app.schemas.fence_schema import LocationPing
+from app.services.fence_service import FenceService
+from app.utils.logger import get_logger
+
+logger = get_logger("IngestService")
+
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))
+# Max pings one consumer evaluates per FenceService batch
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 200))
+# Seconds to keep draining queued pings on shutdown
+INGEST_DRAIN_TIMEOUT = 5
+
+
+class LocationIngestQueue:
+    """
+    Decouples helmet GPS uploads from fence evaluation.
+    The endpoint only enqueues; a bounded set of consumers drains the queues in
+    micro-batches through FenceService.check_fence_status_batch on worker threads.
+    Each device is pinned to one consumer, so its pings are evaluated in order.
+    """
+
+    def __init__(self, maxsize: int = INGEST_QUEUE_SIZE, workers: int = INGEST_WORKERS,
+                 batch_size: int = INGEST_BATCH_SIZE):
+        self.maxsize = maxsize
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.fence_service = FenceService()
+        self._queues = []
+        self._tasks = []
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        per_queue = max(1, self.maxsize // self.workers)
+        self._queues = [asyncio.Queue(maxsize=per_queue) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._consume(q)) for q in self._queues]
+        logger.info(f"Location ingest started: {self.workers} consumers, capacity {self.maxsize}")
+
+    async def stop(self):
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(q.join() for q in self._queues)), INGEST_DRAIN_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Location ingest stopped with {self.depth()} pings still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, ping: LocationPing) -> bool:
+        """Enqueue without waiting. Returns False when the queue is full (caller should back off)."""
+        if not self._queues:
+            raise RuntimeError("Location ingest queue is not running")
+        queue = self._queues[zlib.crc32(ping.device_id.encode("utf-8")) % len(self._queues)]
+        try:
+            queue.put_nowait(ping)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth(),
+            "queue_capacity": self.maxsize,
+            "workers": self.workers,
+            "busy_workers": self.busy,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    async def _consume(self, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            self.busy += 1
+            try:
+                await asyncio.to_thread(self._process, batch)
+                self.processed += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Failed to evaluate {len(batch)} queued pings: {e}")
+            finally:
+                self.busy -= 1
+                for _ in batch:
+                    queue.task_done()
+
+    def _process(self, batch):
+        db = SessionLocal()
+        try:
+            results = self.fence_service.check_fence_status_batch(db, batch)
+            for r in results:
+                if r["status"] == "device_not_found":
+                    logger.warning(f"Device {r['device_id']} not found during fence check.")
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+location_ingest = LocationIngestQueue()
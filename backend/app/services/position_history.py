@@ -0,0 +1,153 @@
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.core.monthly_tables import month_key, months_between
+from app.models.device_position import device_positions
+from app.utils.logger import get_logger
+
+logger = get_logger("PositionHistory")
+
+# Flush buffered positions every N seconds ...
+POSITION_FLUSH_INTERVAL = int(os.getenv("POSITION_FLUSH_INTERVAL", 5))
+# ... or as soon as M positions are waiting
+POSITION_FLUSH_RECORDS = int(os.getenv("POSITION_FLUSH_RECORDS", 5000))
+# Per-device ring buffer size; older unflushed points are dropped beyond this
+POSITION_RING_SIZE = int(os.getenv("POSITION_RING_SIZE", 1024))
+
+
+class PositionHistory:
+    """
+    Device track history without a per-ping INSERT.
+    Pings land in a per-device ring buffer and a background thread writes all
+    buffers to the monthly device_positions_YYYYMM tables in bulk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffers = {}  # device_id -> deque of (lat, lng, ts)
+        self._inflight = {}  # buffers being written, still visible to get_track
+        self._pending = 0
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="position-history", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._flush_event.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def record(self, device_id: str, lat: float, lng: float, ts: datetime):
+        with self._lock:
+            buffer = self._buffers.get(device_id)
+            if buffer is None:
+                buffer = self._buffers[device_id] = deque(maxlen=POSITION_RING_SIZE)
+            if len(buffer) == buffer.maxlen:
+                self.dropped += 1
+            else:
+                self._pending += 1
+            buffer.append((lat, lng, ts))
+            if self._pending >= POSITION_FLUSH_RECORDS:
+                self._flush_event.set()
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            self._flush_event.wait(POSITION_FLUSH_INTERVAL)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Position history flush failed: {e}")
+
+    def _drain(self):
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+            self._inflight = buffers
+            self._pending = 0
+        return buffers
+
+    def flush(self):
+        """Write every buffered position, one multi-row INSERT per month table."""
+        buffers = self._drain()
+        if not buffers:
+            return
+        rows_by_month = {}
+        for device_id, buffer in buffers.items():
+            for lat, lng, ts in buffer:
+                rows_by_month.setdefault(month_key(ts), []).append(
+                    {"device_id": device_id, "latitude": lat, "longitude": lng, "ts": ts}
+                )
+
+        db = SessionLocal()
+        try:
+            for key, rows in rows_by_month.items():
+                db.execute(device_positions.table_for_write(key).insert(), rows)
+            db.commit()
+            # Only once committed: until then get_track finds these points here
+            with self._lock:
+                self._inflight = {}
+            self.written += sum(len(rows) for rows in rows_by_month.values())
+        except Exception:
+            db.rollback()
+            self._requeue(buffers)
+            raise
+        finally:
+            db.close()
+
+    def _requeue(self, buffers):
+        """Put a failed batch back in front of newer points, within the ring size."""
+        with self._lock:
+            self._inflight = {}
+            for device_id, old in buffers.items():
+                newer = self._buffers.get(device_id, ())
+                merged = deque(old, maxlen=POSITION_RING_SIZE)
+                merged.extend(newer)
+                self._buffers[device_id] = merged
+            self._pending = sum(len(b) for b in self._buffers.values())
+
+    def get_track(self, db: Session, device_id: str, start: datetime, end: datetime) -> list[dict]:
+        """
+        A device's positions with start <= ts <= end in time order, including unflushed ones.
+        The buffers are read before the tables: a point flushed in between is in both
+        and is kept once, whereas reading them after could miss it.
+        """
+        with self._lock:
+            buffered = list(self._inflight.get(device_id, ())) + list(self._buffers.get(device_id, ()))
+
+        points = []
+        for table in device_positions.existing_tables(months_between(start, end)):
+            rows = db.execute(
+                select(table.c.latitude, table.c.longitude, table.c.ts)
+                .where(table.c.device_id == device_id, table.c.ts >= start, table.c.ts <= end)
+                .order_by(table.c.ts)
+            ).all()
+            points.extend({"lat": r[0], "lng": r[1], "ts": r[2]} for r in rows)
+
+        # A DATETIME column without fractional seconds stores the timestamp truncated
+        stored = {p["ts"] for p in points}
+        points.extend(
+            {"lat": lat, "lng": lng, "ts": ts} for lat, lng, ts in buffered
+            if start <= ts <= end and ts not in stored and ts.replace(microsecond=0) not in stored
+        )
+        points.sort(key=lambda p: p["ts"])
+        return points
+
+    def stats(self) -> dict:
+        return {"pending": self._pending, "written": self.written, "dropped": self.dropped}
+
+
+position_history = PositionHistory()
@@ -1,10 +1,15 @@
 import math
+import numpy as np
 
 x_pi = 3.14159265358979324 * 3000.0 / 180.0
 pi = 3.1415926535897932384626  # π
 a = 6378245.0  # Semi-major axis
 ee = 0.00669342162296594323  # Eccentricity squared
 
+# gcj02_to_wgs84 iteration limit and convergence threshold in degrees (~1 mm)
+GCJ02_INVERSE_ITERATIONS = 10
+GCJ02_INVERSE_TOLERANCE = 1e-8
+
 def wgs84_to_gcj02(lng, lat):
     """
     Convert WGS84 coordinate to GCJ02 coordinate (Mars Coordinate System).
@@ -49,3 +54,111 @@ def out_of_china(lng, lat):
     """
     return not (73.66 < lng < 135.05 and 3.86 < lat < 53.55)
 
+def gcj02_to_wgs84(lng, lat, iterations=GCJ02_INVERSE_ITERATIONS):
+    """
+    Convert GCJ02 coordinate back to WGS84 by fixed-point iteration on the forward transform.
+    :param lng: GCJ02 longitude
+    :param lat: GCJ02 latitude
+    :return: (lng_wgs, lat_wgs)
+    """
+    if out_of_china(lng, lat):
+        return lng, lat
+
+    wgs_lng, wgs_lat = lng, lat
+    for _ in range(iterations):
+        gcj_lng, gcj_lat = wgs84_to_gcj02(wgs_lng, wgs_lat)
+        d_lng, d_lat = gcj_lng - lng, gcj_lat - lat
+        wgs_lng -= d_lng
+        wgs_lat -= d_lat
+        if abs(d_lng) < GCJ02_INVERSE_TOLERANCE and abs(d_lat) < GCJ02_INVERSE_TOLERANCE:
+            break
+    return wgs_lng, wgs_lat
+
+
+# ---- NumPy batch versions: same operations in the same order as the scalar functions ----
+
+def out_of_china_array(lngs, lats):
+    """Vectorized out_of_china. Returns a bool mask."""
+    lngs = np.asarray(lngs, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    return ~((73.66 < lngs) & (lngs < 135.05) & (3.86 < lats) & (lats < 53.55))
+
+def _transform_lat_array(lng, lat):
+    ret = -100.0 + 2.0 * lng + 3.0 * lat + 0.2 * lat * lat + \
+          0.1 * lng * lat + 0.2 * np.sqrt(np.abs(lng))
+    ret += (20.0 * np.sin(6.0 * lng * pi) + 20.0 * np.sin(2.0 * lng * pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(lat * pi) + 40.0 * np.sin(lat / 3.0 * pi)) * 2.0 / 3.0
+    ret += (160.0 * np.sin(lat / 12.0 * pi) + 320 * np.sin(lat * pi / 30.0)) * 2.0 / 3.0
+    return ret
+
+def _transform_lng_array(lng, lat):
+    ret = 300.0 + lng + 2.0 * lat + 0.1 * lng * lng + \
+          0.1 * lng * lat + 0.1 * np.sqrt(np.abs(lng))
+    ret += (20.0 * np.sin(6.0 * lng * pi) + 20.0 * np.sin(2.0 * lng * pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(lng * pi) + 40.0 * np.sin(lng / 3.0 * pi)) * 2.0 / 3.0
+    ret += (150.0 * np.sin(lng / 12.0 * pi) + 300.0 * np.sin(lng / 30.0 * pi)) * 2.0 / 3.0
+    return ret
+
+def _offset_array(lng, lat):
+    """(dlng, dlat) the forward transform adds at WGS84 points inside China."""
+    dlat = _transform_lat_array(lng - 105.0, lat - 35.0)
+    dlng = _transform_lng_array(lng - 105.0, lat - 35.0)
+    radlat = lat / 180.0 * pi
+    magic = np.sin(radlat)
+    magic = 1 - ee * magic * magic
+    sqrtmagic = np.sqrt(magic)
+    dlat = (dlat * 180.0) / ((a * (1 - ee)) / (magic * sqrtmagic) * pi)
+    dlng = (dlng * 180.0) / (a / sqrtmagic * np.cos(radlat) * pi)
+    return dlng, dlat
+
+def wgs84_to_gcj02_array(lngs, lats):
+    """
+    Vectorized wgs84_to_gcj02.
+    :param lngs: array-like of WGS84 longitudes
+    :param lats: array-like of WGS84 latitudes
+    :return: (lngs_gcj, lats_gcj) float64 arrays; points out of China are returned unchanged
+    """
+    lngs = np.array(lngs, dtype=np.float64)
+    lats = np.array(lats, dtype=np.float64)
+    inside = ~out_of_china_array(lngs, lats)
+    if inside.any():
+        lng_in, lat_in = lngs[inside], lats[inside]
+        dlng, dlat = _offset_array(lng_in, lat_in)
+        lngs[inside] = lng_in + dlng
+        lats[inside] = lat_in + dlat
+    return lngs, lats
+
+def gcj02_to_wgs84_array(lngs, lats, iterations=GCJ02_INVERSE_ITERATIONS):
+    """
+    Vectorized gcj02_to_wgs84. Each point stops iterating once it converges,
+    exactly where the scalar loop would break.
+    :return: (lngs_wgs, lats_wgs) float64 arrays
+    """
+    lngs = np.array(lngs, dtype=np.float64)
+    lats = np.array(lats, dtype=np.float64)
+    active = np.flatnonzero(~out_of_china_array(lngs, lats))
+    lng0, lat0 = lngs[active], lats[active]
+    wgs_lng, wgs_lat = lng0.copy(), lat0.copy()
+    for _ in range(iterations):
+        if active.size == 0:
+            break
+        dlng, dlat = _offset_array(wgs_lng, wgs_lat)
+        # wgs84_to_gcj02 returns an estimate that has left China unchanged
+        outside = out_of_china_array(wgs_lng, wgs_lat)
+        dlng[outside] = 0.0
+        dlat[outside] = 0.0
+        d_lng = (wgs_lng + dlng) - lng0
+        d_lat = (wgs_lat + dlat) - lat0
+        wgs_lng -= d_lng
+        wgs_lat -= d_lat
+        done = (np.abs(d_lng) < GCJ02_INVERSE_TOLERANCE) & (np.abs(d_lat) < GCJ02_INVERSE_TOLERANCE)
+        if done.any():
+            lngs[active[done]] = wgs_lng[done]
+            lats[active[done]] = wgs_lat[done]
+            keep = ~done
+            active, lng0, lat0 = active[keep], lng0[keep], lat0[keep]
+            wgs_lng, wgs_lat = wgs_lng[keep], wgs_lat[keep]
+    lngs[active] = wgs_lng
+    lats[active] = wgs_lat
+    return lngs, lats
+
@@ -0,0 +1,108 @@
+import math
+import numpy as np
+
+EARTH_RADIUS = 6371000  # Radius of Earth in meters
+
+# Distances this close to a circle radius are re-checked with the scalar formula,
+# so np.sin/np.cos rounding can never flip a result against FenceService
+_CIRCLE_EDGE_TOLERANCE = 1e-6
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Calculate Haversine distance between two points in meters.
+    Reference implementation for haversine_array.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    a = (
+        math.sin(delta_phi / 2.0) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2.0) ** 2
+    )
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return EARTH_RADIUS * c
+
+
+def polygon_boundary_distance(lng: float, lat: float, polygon) -> float:
+    """
+    Distance in meters from a point to the nearest polygon edge.
+    Uses a local equirectangular projection around the point, accurate for fence-sized shapes.
+    polygon: list of (lng, lat)
+    """
+    if not polygon:
+        return math.inf
+    kx = math.radians(1) * EARTH_RADIUS * math.cos(math.radians(lat))
+    ky = math.radians(1) * EARTH_RADIUS
+    best = math.inf
+    n = len(polygon)
+    for i in range(n):
+        x1, y1 = polygon[i]
+        x2, y2 = polygon[(i + 1) % n]
+        ax, ay = (x1 - lng) * kx, (y1 - lat) * ky
+        dx, dy = (x2 - lng) * kx - ax, (y2 - lat) * ky - ay
+        seg_len2 = dx * dx + dy * dy
+        t = 0.0 if seg_len2 == 0 else min(1.0, max(0.0, -(ax * dx + ay * dy) / seg_len2))
+        px, py = ax + t * dx, ay + t * dy
+        best = min(best, px * px + py * py)
+    return math.sqrt(best)
+
+
+def haversine_array(lats, lngs, lat0: float, lng0: float) -> np.ndarray:
+    """Haversine distance in meters from every (lats[i], lngs[i]) to (lat0, lng0)."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    phi1 = np.radians(lats)
+    phi2 = math.radians(lat0)
+    delta_phi = np.radians(lat0 - lats)
+    delta_lambda = np.radians(lng0 - lngs)
+
+    a = (
+        np.sin(delta_phi / 2.0) ** 2
+        + np.cos(phi1) * math.cos(phi2) * np.sin(delta_lambda / 2.0) ** 2
+    )
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS * c
+
+
+def points_in_circle(lats, lngs, center_lat: float, center_lng: float, radius: float) -> np.ndarray:
+    """Vectorized `haversine(lat, lng, center) <= radius`."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    dist = haversine_array(lats, lngs, center_lat, center_lng)
+    inside = dist <= radius
+
+    for i in np.flatnonzero(np.abs(dist - radius) <= _CIRCLE_EDGE_TOLERANCE):
+        inside[i] = haversine(lats[i], lngs[i], center_lat, center_lng) <= radius
+    return inside
+
+
+def points_in_polygon(lngs, lats, polygon) -> np.ndarray:
+    """
+    Vectorized ray casting, edge for edge the same arithmetic as
+    FenceService._is_inside_polygon, so results are bit-identical.
+    polygon: list of (lng, lat)
+    """
+    x = np.asarray(lngs, dtype=np.float64)
+    y = np.asarray(lats, dtype=np.float64)
+    inside = np.zeros(x.shape, dtype=bool)
+    if not polygon:
+        return inside
+
+    n = len(polygon)
+    for i in range(n):
+        p1x, p1y = polygon[i]
+        p2x, p2y = polygon[(i + 1) % n]
+        if p1y == p2y:
+            # Horizontal edges can never satisfy min < y <= max
+            continue
+        crossing = (y > min(p1y, p2y)) & (y <= max(p1y, p2y)) & (x <= max(p1x, p2x))
+        if p1x != p2x:
+            xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+            crossing &= x <= xinters
+        inside ^= crossing
+    return inside
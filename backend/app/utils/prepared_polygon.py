@@ -0,0 +1,248 @@
+import math
+import numpy as np
+
+EARTH_RADIUS = 6371000  # Radius of Earth in meters
+
+# Polygons with fewer vertices are cheaper to test edge by edge than to prepare
+PREPARED_MIN_VERTICES = 64
+# Upper bound on grid rows / columns of a prepared polygon
+PREPARED_MAX_GRID = 128
+# Degrees added around edges and cells when classifying cells, so a point in an
+# edge-free cell is far from every edge compared to float rounding in the ray cast
+_CELL_MARGIN = 1e-9
+
+_MIXED, _OUTSIDE, _INSIDE = 0, 1, 2
+
+
+def ray_cast_edges(x, y, edges) -> bool:
+    """
+    Ray casting over an explicit edge list (p1x, p1y, p2x, p2y).
+    Per edge the same arithmetic as FenceService._is_inside_polygon; the
+    crossings are XOR-ed, so any subset containing every edge that can cross
+    gives the identical result.
+    """
+    inside = False
+    for p1x, p1y, p2x, p2y in edges:
+        if y > min(p1y, p2y):
+            if y <= max(p1y, p2y):
+                if x <= max(p1x, p2x):
+                    if p1y != p2y:
+                        xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+                    if p1x == p2x or x <= xinters:
+                        inside = not inside
+    return inside
+
+
+def ray_cast_edges_array(x, y, edges) -> np.ndarray:
+    """Vectorized ray_cast_edges, same per-edge arithmetic as geo_vector.points_in_polygon."""
+    inside = np.zeros(x.shape, dtype=bool)
+    for p1x, p1y, p2x, p2y in edges:
+        if p1y == p2y:
+            continue
+        crossing = (y > min(p1y, p2y)) & (y <= max(p1y, p2y)) & (x <= max(p1x, p2x))
+        if p1x != p2x:
+            xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+            crossing &= x <= xinters
+        inside ^= crossing
+    return inside
+
+
+def edges_boundary_distance(lng: float, lat: float, edges) -> float:
+    """
+    Meters from a point to the nearest of the given edges, with the same local
+    equirectangular projection as geo_vector.polygon_boundary_distance.
+    """
+    kx = math.radians(1) * EARTH_RADIUS * math.cos(math.radians(lat))
+    ky = math.radians(1) * EARTH_RADIUS
+    best = math.inf
+    for x1, y1, x2, y2 in edges:
+        ax, ay = (x1 - lng) * kx, (y1 - lat) * ky
+        dx, dy = (x2 - lng) * kx - ax, (y2 - lat) * ky - ay
+        seg_len2 = dx * dx + dy * dy
+        t = 0.0 if seg_len2 == 0 else min(1.0, max(0.0, -(ax * dx + ay * dy) / seg_len2))
+        px, py = ax + t * dx, ay + t * dy
+        best = min(best, px * px + py * py)
+    return math.sqrt(best)
+
+
+class PreparedPolygon:
+    """
+    Grid over a polygon's bbox for repeated point-in-polygon tests.
+    - Every grid row keeps the edges whose y-range overlaps it, so a point only
+      ray casts against the edges of its own row instead of the whole outline.
+    - Cells no edge comes near are classified once as inside / outside and
+      answer without any edge test.
+    - Cells keep the edges passing near them, so a boundary distance query only
+      looks at the edges around the point.
+    Results are identical to FenceService._is_inside_polygon.
+    polygon: list of (lng, lat)
+    """
+
+    def __init__(self, polygon):
+        n = len(polygon)
+        self.edges = [
+            (polygon[i][0], polygon[i][1], polygon[(i + 1) % n][0], polygon[(i + 1) % n][1])
+            for i in range(n)
+        ]
+        lngs = [p[0] for p in polygon]
+        lats = [p[1] for p in polygon]
+        self.min_x = min(lngs) - _CELL_MARGIN
+        self.min_y = min(lats) - _CELL_MARGIN
+        max_x = max(lngs) + _CELL_MARGIN
+        max_y = max(lats) + _CELL_MARGIN
+
+        size = max(1, min(PREPARED_MAX_GRID, int(math.sqrt(n)) * 2))
+        self.cols = self.rows = size
+        self.cell_w = (max_x - self.min_x) / size
+        self.cell_h = (max_y - self.min_y) / size
+        self.max_x, self.max_y = max_x, max_y
+
+        self.row_edges = [[] for _ in range(size)]
+        self.cell_edges = {}  # (row, col) -> edges whose bbox overlaps the cell
+        cells = np.full((size, size), _OUTSIDE, dtype=np.int8)
+        mixed = np.zeros((size, size), dtype=bool)
+        for edge in self.edges:
+            p1x, p1y, p2x, p2y = edge
+            r0, r1 = self._row(min(p1y, p2y) - _CELL_MARGIN), self._row(max(p1y, p2y) + _CELL_MARGIN)
+            c0, c1 = self._col(min(p1x, p2x) - _CELL_MARGIN), self._col(max(p1x, p2x) + _CELL_MARGIN)
+            for r in range(r0, r1 + 1):
+                self.row_edges[r].append(edge)
+                for c in range(c0, c1 + 1):
+                    self.cell_edges.setdefault((r, c), []).append(edge)
+            mixed[r0:r1 + 1, c0:c1 + 1] = True
+
+        # Classify edge-free cells by their center; nothing in the cell is near an edge
+        for r in range(size):
+            cy = self.min_y + (r + 0.5) * self.cell_h
+            for c in range(size):
+                if mixed[r, c]:
+                    cells[r, c] = _MIXED
+                else:
+                    cx = self.min_x + (c + 0.5) * self.cell_w
+                    cells[r, c] = _INSIDE if ray_cast_edges(cx, cy, self.row_edges[r]) else _OUTSIDE
+        self.cells = cells
+
+    def _row(self, y: float) -> int:
+        return min(self.rows - 1, max(0, int((y - self.min_y) // self.cell_h))) if self.cell_h > 0 else 0
+
+    def _col(self, x: float) -> int:
+        return min(self.cols - 1, max(0, int((x - self.min_x) // self.cell_w))) if self.cell_w > 0 else 0
+
+    def contains(self, lng: float, lat: float) -> bool:
+        if not (self.min_x <= lng <= self.max_x and self.min_y <= lat <= self.max_y):
+            return False
+        r = self._row(lat)
+        state = self.cells[r, self._col(lng)]
+        if state != _MIXED:
+            return state == _INSIDE
+        return ray_cast_edges(lng, lat, self.row_edges[r])
+
+    def boundary_distance(self, lng: float, lat: float, max_distance: float) -> float:
+        """
+        Meters to the nearest edge, exact when it is within max_distance;
+        otherwise some value > max_distance (inf when no edge is close).
+        """
+        if max_distance == math.inf:
+            return edges_boundary_distance(lng, lat, self.edges)
+        # Degrees spanned by max_distance in the same projection as the distance itself
+        ky = math.radians(1) * EARTH_RADIUS
+        kx = ky * math.cos(math.radians(lat))
+        dlat = max_distance / ky
+        dlng = max_distance / kx if kx > 0 else 360.0
+        if (lng + dlng < self.min_x or lng - dlng > self.max_x
+                or lat + dlat < self.min_y or lat - dlat > self.max_y):
+            return math.inf
+        r0, r1 = self._row(lat - dlat), self._row(lat + dlat)
+        c0, c1 = self._col(lng - dlng), self._col(lng + dlng)
+        nearby = {}
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                for edge in self.cell_edges.get((r, c), ()):
+                    nearby[edge] = None
+        if not nearby:
+            return math.inf
+        return edges_boundary_distance(lng, lat, nearby)
+
+    def contains_array(self, lngs, lats) -> np.ndarray:
+        x = np.asarray(lngs, dtype=np.float64)
+        y = np.asarray(lats, dtype=np.float64)
+        inside = np.zeros(x.shape, dtype=bool)
+        in_box = np.flatnonzero((x >= self.min_x) & (x <= self.max_x) & (y >= self.min_y) & (y <= self.max_y))
+        if in_box.size == 0:
+            return inside
+
+        bx, by = x[in_box], y[in_box]
+        rows = self._rows_array(by)
+        cols = self._cols_array(bx)
+        states = self.cells[rows, cols]
+        inside[in_box[states == _INSIDE]] = True
+
+        mixed = np.flatnonzero(states == _MIXED)
+        for r in np.unique(rows[mixed]):
+            sel = mixed[rows[mixed] == r]
+            inside[in_box[sel]] = ray_cast_edges_array(bx[sel], by[sel], self.row_edges[r])
+        return inside
+
+    def _rows_array(self, y) -> np.ndarray:
+        if self.cell_h <= 0:
+            return np.zeros(y.shape, dtype=np.intp)
+        return np.clip(((y - self.min_y) // self.cell_h).astype(np.intp), 0, self.rows - 1)
+
+    def _cols_array(self, x) -> np.ndarray:
+        if self.cell_w <= 0:
+            return np.zeros(x.shape, dtype=np.intp)
+        return np.clip(((x - self.min_x) // self.cell_w).astype(np.intp), 0, self.cols - 1)
+
+
+def prepare_polygon(polygon):
+    """PreparedPolygon for large outlines, None when plain ray casting is cheaper."""
+    if not polygon or len(polygon) < PREPARED_MIN_VERTICES:
+        return None
+    return PreparedPolygon(polygon)
+
+
+def simplify_polygon(polygon, tolerance: float):
+    """
+    Douglas-Peucker simplification of a closed (lng, lat) ring.
+    tolerance: max deviation in meters (local equirectangular projection).
+    Never returns fewer than 3 vertices.
+    """
+    n = len(polygon)
+    if tolerance <= 0 or n <= 3:
+        return list(polygon)
+
+    lat0 = sum(p[1] for p in polygon) / n
+    kx = math.radians(1) * EARTH_RADIUS * math.cos(math.radians(lat0))
+    ky = math.radians(1) * EARTH_RADIUS
+    pts = [(p[0] * kx, p[1] * ky) for p in polygon]
+
+    # Split the ring at the vertex farthest from the first one and simplify both halves
+    far = max(range(n), key=lambda i: (pts[i][0] - pts[0][0]) ** 2 + (pts[i][1] - pts[0][1]) ** 2)
+    keep = [False] * n
+    keep[0] = keep[far] = True
+    stack = [(0, far), (far, n)]
+    while stack:
+        start, end = stack.pop()
+        ax, ay = pts[start]
+        bx, by = pts[end % n]
+        dx, dy = bx - ax, by - ay
+        seg_len2 = dx * dx + dy * dy
+        best, best_i = -1.0, None
+        for i in range(start + 1, end):
+            px, py = pts[i]
+            if seg_len2 == 0:
+                d2 = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                t = min(1.0, max(0.0, ((px - ax) * dx + (py - ay) * dy) / seg_len2))
+                d2 = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+            if d2 > best:
+                best, best_i = d2, i
+        if best_i is not None and best > tolerance * tolerance:
+            keep[best_i] = True
+            stack.append((start, best_i))
+            stack.append((best_i, end))
+
+    result = [p for p, k in zip(polygon, keep) if k]
+    if len(result) < 3:
+        return list(polygon)
+    return result
@@ -1,9 +1,13 @@
 import os
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from app.core.database import engine, Base
+from sqlalchemy import inspect, text
+from app.core.database import engine, Base, SessionLocal
+from app.models.alarm_records import AlarmRecord
+from app.models.alarm_archive import alarm_archive
 from app.controllers import (
     admin_controller,
     device_controller,
@@ -14,6 +18,16 @@ from app.controllers import (
     dashboard_controller,
     auth_controller,
 )
+from app.services.fence_scheduler import fence_scheduler
+from app.services.ingest_service import location_ingest
+from app.services.alarm_service import pending_fence_alarms
+from app.services.alarm_rollup import alarm_rollups
+from app.services.position_history import position_history
+from app.services.fence_shards import fence_shards
+from app.services.alarm_writer import alarm_writer
+from app.services.alarm_correlation import alarm_correlator
+from app.services.dashboard_counters import dashboard_counters
+from app.services.alarm_archive import alarm_archiver
 from app.utils.logger import get_logger
 
 # Enable verbose ONVIF/SOAP client logging for debugging PTZ stop issues
@@ -34,9 +48,105 @@ logger = get_logger("Main")
 
 # Create Database Tables (Quick setup for dev)
 Base.metadata.create_all(bind=engine)
+# create_all skips tables that already exist, so add columns introduced since ...
+_ADDED_COLUMNS = {
+    "alarm_records": {
+        # Dedupe key of pending fence alarms, unique index created below
+        "pending_key": "VARCHAR(100) NULL",
+    },
+    "electronic_fences": {
+        # Edge debounce: hysteresis band in meters and dwell time in seconds
+        "edge_buffer": "FLOAT DEFAULT 0",
+        "dwell_seconds": "INTEGER DEFAULT 0",
+        # Proximity warning band in meters, 0 disables
+        "warning_distance": "FLOAT DEFAULT 0",
+    },
+}
+# Alarm columns added since, in the hot table and existing archive months
+_ALARM_ADDED_COLUMNS = {
+    # Alarm correlation
+    "occurrences": "INTEGER NOT NULL DEFAULT 1",
+    "last_seen": "DATETIME NULL",
+    # Owner department when the alarm was raised, part of the rollup key
+    "department_id": "INTEGER NULL",
+}
 
 
-app = FastAPI()
+def _backfill_pending_keys(conn):
+    """Give the newest pending alarm of each (device, fence) its key; older duplicates stay unkeyed."""
+    rows = conn.execute(text(
+        "SELECT id, device_id, fence_id FROM alarm_records "
+        "WHERE status = 'pending' AND fence_id IS NOT NULL ORDER BY id"
+    )).all()
+    newest = {(device_id, fence_id): alarm_id for alarm_id, device_id, fence_id in rows}
+    if newest:
+        conn.execute(
+            text("UPDATE alarm_records SET pending_key = :key WHERE id = :id"),
+            [{"key": f"{device_id}:{fence_id}", "id": alarm_id} for (device_id, fence_id), alarm_id in newest.items()],
+        )
+    conn.execute(text("CREATE UNIQUE INDEX uq_alarm_records_pending_key ON alarm_records (pending_key)"))
+
+
+def _backfill_departments(conn, table_name):
+    """Existing alarms take their device owner's current department, as the rollups did so far."""
+    conn.execute(text(
+        f"UPDATE {table_name} SET department_id = ("
+        "SELECT users.department_id FROM devices JOIN users ON devices.owner_id = users.id "
+        f"WHERE devices.id = {table_name}.device_id)"
+    ))
+
+
+with engine.begin() as conn:
+    archive_tables = [f"{alarm_archive.prefix}_{key}" for key in alarm_archive.existing_keys()]
+    columns = {**_ADDED_COLUMNS}
+    columns["alarm_records"] = {**columns["alarm_records"], **_ALARM_ADDED_COLUMNS}
+    for table_name in archive_tables:
+        columns[table_name] = _ALARM_ADDED_COLUMNS
+    for table_name, added in columns.items():
+        present = {column["name"] for column in inspect(conn).get_columns(table_name)}
+        for name, ddl in added.items():
+            if name not in present:
+                logger.info(f"Adding column {table_name}.{name}")
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl}"))
+                if table_name == "alarm_records" and name == "pending_key":
+                    _backfill_pending_keys(conn)
+                if name == "department_id":
+                    _backfill_departments(conn, table_name)
+# ... and indexes
+for index in AlarmRecord.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm in-memory alarm state before the first ping arrives
+    db = SessionLocal()
+    try:
+        pending_fence_alarms.load(db)
+        alarm_rollups.rebuild_if_empty(db)
+    finally:
+        db.close()
+
+    # Background workers that keep in-memory fence state in sync with the DB
+    fence_scheduler.start()
+    position_history.start()
+    fence_shards.start()
+    alarm_writer.start()
+    alarm_correlator.start()
+    dashboard_counters.start()
+    alarm_archiver.start()
+    await location_ingest.start()
+    yield
+    await location_ingest.stop()
+    alarm_archiver.stop()
+    dashboard_counters.stop()
+    alarm_writer.stop()
+    alarm_correlator.stop()
+    fence_shards.stop()
+    position_history.stop()
+    fence_scheduler.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 os.makedirs(static_dir, exist_ok=True)
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
@@ -0,0 +1,127 @@
+"""
+几何向量化等价性测试
+随机生成围栏多边形与测试点, 校验向量化 / 预处理实现与逐点标量实现的结果完全一致 (逐位相同):
+- geo_vector.points_in_polygon          vs FenceService._is_inside_polygon
+- PreparedPolygon.contains / contains_array / boundary_distance
+- coord_transform 的数组版正反变换       vs 标量版
+运行: python test_geo_equivalence.py  (或 pytest test_geo_equivalence.py)
+"""
+
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.fence_service import FenceService
+from app.utils.coord_transform import (
+    gcj02_to_wgs84, gcj02_to_wgs84_array, out_of_china, out_of_china_array,
+    wgs84_to_gcj02, wgs84_to_gcj02_array,
+)
+from app.utils.geo_vector import points_in_polygon, polygon_boundary_distance
+from app.utils.prepared_polygon import PREPARED_MIN_VERTICES, PreparedPolygon
+
+SEED = 20261018
+ROUNDS = 30
+# 坐标量化步长 (度): 让测试点精确落在顶点、边上以及水平 / 竖直边上
+GRID = 1e-4
+
+scalar_inside = FenceService()._is_inside_polygon
+
+
+def random_polygon(rng, n_vertices):
+    """绕中心的随机星形多边形 [(lng, lat)], 坐标量化到 GRID, 并混入水平 / 竖直边。"""
+    cx, cy = rng.uniform(73, 135), rng.uniform(18, 53)
+    angles = np.sort(rng.uniform(0, 2 * math.pi, n_vertices))
+    radii = rng.uniform(0.002, 0.02, n_vertices)
+    polygon = []
+    for a, r in zip(angles, radii):
+        x = round((cx + r * math.cos(a)) / GRID) * GRID
+        y = round((cy + r * math.sin(a)) / GRID) * GRID
+        if polygon and rng.random() < 0.2:
+            # 与上一顶点同经度或同纬度
+            if rng.random() < 0.5:
+                x = polygon[-1][0]
+            else:
+                y = polygon[-1][1]
+        polygon.append((x, y))
+    return polygon
+
+
+def probe_points(rng, polygon, n_random=2000):
+    """随机点 + 全部顶点 + 边中点 + 与顶点同经 / 同纬的点。"""
+    xs = [p[0] for p in polygon]
+    ys = [p[1] for p in polygon]
+    min_x, max_x, min_y, max_y = min(xs), max(xs), min(ys), max(ys)
+    pad = 0.002
+    points = list(zip(rng.uniform(min_x - pad, max_x + pad, n_random), rng.uniform(min_y - pad, max_y + pad, n_random)))
+    points += polygon
+    n = len(polygon)
+    for i in range(n):
+        (x1, y1), (x2, y2) = polygon[i], polygon[(i + 1) % n]
+        points.append(((x1 + x2) / 2, (y1 + y2) / 2))
+        points.append((rng.uniform(min_x - pad, max_x + pad), y1))
+        points.append((x1, rng.uniform(min_y - pad, max_y + pad)))
+    return np.array([p[0] for p in points]), np.array([p[1] for p in points])
+
+
+def test_points_in_polygon():
+    rng = np.random.default_rng(SEED)
+    for _ in range(ROUNDS):
+        polygon = random_polygon(rng, int(rng.integers(3, 40)))
+        lngs, lats = probe_points(rng, polygon)
+        expected = [scalar_inside((x, y), polygon) for x, y in zip(lngs.tolist(), lats.tolist())]
+        assert points_in_polygon(lngs, lats, polygon).tolist() == expected
+
+
+def test_prepared_polygon():
+    rng = np.random.default_rng(SEED + 1)
+    for _ in range(ROUNDS):
+        polygon = random_polygon(rng, int(rng.integers(PREPARED_MIN_VERTICES, 400)))
+        prepared = PreparedPolygon(polygon)
+        lngs, lats = probe_points(rng, polygon)
+        expected = [scalar_inside((x, y), polygon) for x, y in zip(lngs.tolist(), lats.tolist())]
+        assert [prepared.contains(x, y) for x, y in zip(lngs.tolist(), lats.tolist())] == expected
+        assert prepared.contains_array(lngs, lats).tolist() == expected
+
+        max_distance = float(rng.uniform(5, 500))
+        for x, y in list(zip(lngs.tolist(), lats.tolist()))[:300]:
+            exact = polygon_boundary_distance(x, y, polygon)
+            got = prepared.boundary_distance(x, y, max_distance)
+            if exact <= max_distance:
+                assert got == exact
+            else:
+                assert got > max_distance
+
+
+def test_coord_transform():
+    rng = np.random.default_rng(SEED + 2)
+    # 覆盖国内、国外, 以及 out_of_china 四条边界两侧 ±0.02° 内的密集点
+    # (反算的中间估计值可能越过边界, 此时标量版按原样返回)
+    lngs = [rng.uniform(70, 140, 20000)]
+    lats = [rng.uniform(-5, 60, 20000)]
+    for edge in (73.66, 135.05):
+        lngs.append(rng.uniform(edge - 0.02, edge + 0.02, 20000))
+        lats.append(rng.uniform(3.86, 53.55, 20000))
+    for edge in (3.86, 53.55):
+        lngs.append(rng.uniform(73.66, 135.05, 20000))
+        lats.append(rng.uniform(edge - 0.02, edge + 0.02, 20000))
+    lngs, lats = np.concatenate(lngs), np.concatenate(lats)
+
+    assert out_of_china_array(lngs, lats).tolist() == [out_of_china(x, y) for x, y in zip(lngs.tolist(), lats.tolist())]
+
+    g_lngs, g_lats = wgs84_to_gcj02_array(lngs, lats)
+    for i, (x, y) in enumerate(zip(lngs.tolist(), lats.tolist())):
+        assert wgs84_to_gcj02(x, y) == (g_lngs[i], g_lats[i])
+
+    w_lngs, w_lats = gcj02_to_wgs84_array(g_lngs, g_lats)
+    for i, (x, y) in enumerate(zip(g_lngs.tolist(), g_lats.tolist())):
+        assert gcj02_to_wgs84(x, y) == (w_lngs[i], w_lats[i])
+
+
+if __name__ == "__main__":
+    for test in (test_points_in_polygon, test_prepared_polygon, test_coord_transform):
+        test()
+        print(f"✅ {test.__name__}")